@@ -1,18 +1,627 @@
 import os
 import re
 import json
-from groq import Groq
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError, RateLimitError
 from dotenv import load_dotenv
-from shop_data import SYSTEM_INSTRUCTION, SERVICES, get_system_instruction_with_emotion
+from emotion_lexicon import classify_emotion
+from marker_filter import MarkerFilter
+from service_index import get_service_index
+from catalog_answers import answer_from_catalog
+from customer_info_rules import CUSTOMER_INFO_FIELDS, scan_history_tail, get_customer_info_rule_stats
+from llm_cache import LlmCache, cache_key
+from context_window import (
+    ContextPlan, CONTEXT_SUMMARY_TOKENS, summary_cache, format_turns, record_summary_call, get_context_metrics,
+    count_message_tokens
+)
+from model_router import ModelRouter
+from circuit_breaker import CircuitBreaker, CallDeadlineExceeded
+from rate_limiter import (
+    RateLimiter, RateLimitTimeout, QUEUE_TIMEOUTS, PRIORITY_CHAT, PRIORITY_ASSIST, PRIORITY_BACKGROUND
+)
+from shop_data import SYSTEM_INSTRUCTION, SERVICES, EMOTION_TAG_INSTRUCTION, get_system_instruction_with_emotion
 
 load_dotenv()
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Pool kết nối keep-alive dùng chung cho mọi lời gọi Groq (tránh bắt tay TLS lại mỗi request).
+# Giữ số kết nối idle nhỏ hơn hẳn max: pool của httpx quét toàn bộ kết nối mỗi lần
+# nhận/trả request, pool lớn toàn kết nối idle làm chậm rõ khi nhiều chat đồng thời
+# (xem bench_concurrency.py).
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "20"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60"))
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+
+_groq_limits = httpx.Limits(
+    max_connections=GROQ_MAX_CONNECTIONS,
+    max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+    keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+)
+
+# SDK không tự thử lại: lỗi 429 được xếp hàng lại qua bộ giới hạn của model, lỗi mạng/5xx
+# thử lại trong _create_completion
+client = Groq(
+    api_key=os.getenv("GROQ_API_KEY"),
+    http_client=httpx.Client(limits=_groq_limits, timeout=GROQ_TIMEOUT),
+    max_retries=0,
+)
+
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Body của response, trả lại slot khi đóng (kể cả response stream)"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+
+class _GatedTransport(httpx.AsyncBaseTransport):
+    """
+    Giới hạn số request đang chạy bằng semaphore trước khi vào pool của httpx.
+
+    Pool của httpx quét mọi kết nối cho từng request đang xếp hàng mỗi khi có
+    request vào/ra, nên khi số chat đồng thời vượt max_connections phần xếp
+    hàng bên trong pool tốn CPU theo bình phương; chờ ở semaphore thì gần như
+    không tốn gì.
+    """
+
+    def __init__(self, limit: int):
+        self._transport = httpx.AsyncHTTPTransport(limits=_groq_limits)
+        self._limit = limit
+        self._slots = None
+        self._loop = None
+
+    def _get_slots(self):
+        # Semaphore gắn với event loop đang chạy; tạo lại nếu loop đổi
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(self._limit)
+            self._loop = loop
+        return self._slots
+
+    async def handle_async_request(self, request):
+        slots = self._get_slots()
+        await slots.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            slots.release()
+            raise
+        response.stream = _ReleasingStream(response.stream, slots.release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# Client bất đồng bộ cho các endpoint async: chờ Groq không chiếm thread của server
+async_client = AsyncGroq(
+    api_key=os.getenv("GROQ_API_KEY"),
+    http_client=httpx.AsyncClient(transport=_GatedTransport(GROQ_MAX_CONNECTIONS), timeout=GROQ_TIMEOUT),
+    max_retries=0,
+)
+
+# Số lần thử lại khi lỗi mạng / Groq lỗi 5xx (như mặc định của SDK)
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "2"))
+# Token completion ước lượng cho request không đặt max_tokens (để trừ vào hạn mức token/phút)
+GROQ_COMPLETION_TOKENS = int(os.getenv("GROQ_COMPLETION_TOKENS", "600"))
+
+# Deadline cho mỗi lần gọi một model (gồm chờ lượt, gọi và thử lại), giây. Router
+# gọi model dự phòng với deadline mới, nên một tác vụ chờ tối đa gấp đôi.
+CALL_DEADLINES = {
+    PRIORITY_CHAT: float(os.getenv("GROQ_DEADLINE_CHAT", "15")),
+    PRIORITY_ASSIST: float(os.getenv("GROQ_DEADLINE_ASSIST", "3")),
+    PRIORITY_BACKGROUND: float(os.getenv("GROQ_DEADLINE_BACKGROUND", "20")),
+}
+# Hedging (chỉ client async, không áp dụng cho stream): request chậm hơn p95 gần đây
+# của model (tối thiểu GROQ_HEDGE_MIN_MS) thì gửi thêm một bản, lấy kết quả về trước.
+# Đặt GROQ_HEDGE_TASKS rỗng để tắt.
+GROQ_HEDGE_TASKS = {task.strip() for task in os.getenv("GROQ_HEDGE_TASKS", "chat,emotion").split(",") if task.strip()}
+GROQ_HEDGE_MIN_MS = float(os.getenv("GROQ_HEDGE_MIN_MS", "300"))
+# Số request gần nhất của (tác vụ, model) dùng tính p95; chưa đủ GROQ_HEDGE_MIN_SAMPLES thì chưa hedging
+GROQ_HEDGE_SAMPLES = 200
+GROQ_HEDGE_MIN_SAMPLES = int(os.getenv("GROQ_HEDGE_MIN_SAMPLES", "20"))
+
+# Hạn mức request/token của Groq tính riêng cho từng model: mỗi model một RateLimiter
+# (bucket + hàng đợi), dùng chung cho lời gọi đồng bộ lẫn async
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Circuit breaker theo model: model bị ngắt thì router chuyển sang model dự phòng ngay
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+_hedge_lock = threading.Lock()
+_hedge_metrics = {"hedged": 0, "hedge_wins": 0, "skipped": 0}
+# (tác vụ, model) -> thời gian phản hồi của từng request đã trả lời (ms). Tính theo từng
+# request chứ không theo cả lượt gọi, request bị hủy/quá hạn không được ghi.
+_service_times = {}
+
+
+def _breaker(model: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model)
+        return _breakers[model]
+
+
+def _limiter(model: str) -> RateLimiter:
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = RateLimiter()
+        return _limiters[model]
+
+
+def _record_hedge(event: str):
+    with _hedge_lock:
+        _hedge_metrics[event] += 1
+
+
+def _record_service_time(hedge_key, elapsed_ms: float):
+    with _hedge_lock:
+        _service_times.setdefault(hedge_key, deque(maxlen=GROQ_HEDGE_SAMPLES)).append(elapsed_ms)
+
+
+def _hedge_delay(hedge_key):
+    """Thời gian chờ trước khi hedging (giây): p95 thời gian phản hồi gần đây, None nếu chưa đủ mẫu"""
+    with _hedge_lock:
+        times = sorted(_service_times.get(hedge_key, ()))
+    if len(times) < GROQ_HEDGE_MIN_SAMPLES:
+        return None
+    return max(times[min(len(times) - 1, int(0.95 * len(times)))], GROQ_HEDGE_MIN_MS) / 1000
+
+
+def get_groq_health_stats():
+    """
+    Deadline theo độ ưu tiên, trạng thái circuit breaker của từng model và số request hedging
+
+    Returns:
+        dict: {deadlines, breakers: {model: CircuitBreaker.stats()},
+               hedging: {tasks, min_ms, hedged, hedge_wins, skipped, p95_ms: {"tác vụ/model": ms}}}
+    """
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    with _hedge_lock:
+        hedging = dict(_hedge_metrics)
+        service_times = {f"{task}/{model}": sorted(times) for (task, model), times in _service_times.items()}
+    hedging["p95_ms"] = {
+        key: round(times[min(len(times) - 1, int(0.95 * len(times)))], 1) for key, times in service_times.items()
+    }
+    return {
+        "deadlines": {str(priority): seconds for priority, seconds in CALL_DEADLINES.items()},
+        "breakers": {model: breaker.stats() for model, breaker in breakers.items()},
+        "hedging": dict(hedging, tasks=sorted(GROQ_HEDGE_TASKS), min_ms=GROQ_HEDGE_MIN_MS),
+    }
+
+
+def get_rate_limit_stats():
+    """
+    Tình trạng bộ giới hạn tốc độ gọi Groq của từng model: hàng đợi theo độ ưu tiên,
+    hạn mức còn lại, thời gian chờ
+
+    Returns:
+        dict: {model: RateLimiter.stats()}
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model: limiter.stats() for model, limiter in limiters.items()}
+
+
+def _request_cost(request: dict) -> int:
+    """Số token ước lượng của một request (prompt + completion tối đa)"""
+    return count_message_tokens(request["messages"]) + request.get("max_tokens", GROQ_COMPLETION_TOKENS)
+
+
+def _retryable(e: Exception) -> bool:
+    """Lỗi mạng, timeout, 408/409 và 5xx đáng thử lại (giống SDK)"""
+    if isinstance(e, APIConnectionError):
+        return True
+    return isinstance(e, APIStatusError) and (e.status_code in (408, 409) or e.status_code >= 500)
+
+
+def _retry_delay(attempt: int) -> float:
+    return min(0.5 * 2 ** attempt, 8.0)
+
+
+def _used_tokens(completion):
+    usage = getattr(completion, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def _breaker_outcome(e: Exception):
+    """Kết quả tính cho circuit breaker: timeout, lỗi mạng, 5xx là lỗi provider; 4xx là provider vẫn trả lời"""
+    if isinstance(e, RateLimitError):
+        return None
+    if isinstance(e, (APIConnectionError, CallDeadlineExceeded)):
+        return False
+    if isinstance(e, APIStatusError):
+        return e.status_code < 500
+    return None
+
+
+class _CompletionCall:
+    """
+    Trạng thái một lần gọi Groq dùng chung cho _create_completion và _acreate_completion:
+    circuit breaker và bộ giới hạn tốc độ của model, deadline theo độ ưu tiên, số lần thử lại. Mọi quyết định
+    (lỗi nào tính cho breaker, khi nào thử lại, 429 xếp hàng lại) nằm ở đây; hai bản
+    sync/async chỉ khác cách chờ.
+    """
+
+    def __init__(self, request: dict, priority: int):
+        self.model = request["model"]
+        self.priority = priority
+        self.cost = _request_cost(request)
+        self.breaker = _breaker(self.model)
+        self.limiter = _limiter(self.model)
+        now = time.monotonic()
+        self.deadline = now + CALL_DEADLINES[priority]
+        # Hạn chờ lượt trong bộ giới hạn của model
+        self.queue_deadline = min(self.deadline, now + QUEUE_TIMEOUTS[priority])
+        self.attempt = 0
+        self.probe = False
+
+    def start(self):
+        """Xin phép circuit breaker (ném CircuitOpenError nếu model đang bị ngắt mạch)"""
+        self.probe = self.breaker.allow()
+
+    def remaining(self) -> float:
+        """Số giây còn lại tới deadline (timeout của HTTP)"""
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise CallDeadlineExceeded(f"{self.model}: hết thời gian trước khi gọi")
+        return remaining
+
+    def failed(self, e: BaseException):
+        """
+        Ghi lượt gọi lỗi và quyết định có gọi lại không
+
+        Returns:
+            float | None: Số giây chờ trước khi gọi lại (0 với 429: bộ giới hạn của model đã
+                          tạm dừng hàng đợi, request xếp hàng lại), None nếu phải ném lỗi
+        """
+        if isinstance(e, RateLimitError):
+            self.breaker.record(None, self.probe)
+            self.limiter.rate_limited(e.response.headers)
+            return 0.0
+        self.breaker.record(_breaker_outcome(e) if isinstance(e, Exception) else None, self.probe)
+        delay = _retry_delay(self.attempt)
+        if self.attempt >= GROQ_MAX_RETRIES or not _retryable(e) or time.monotonic() + delay >= self.deadline:
+            return None
+        self.attempt += 1
+        return delay
+
+    def succeeded(self, raw, completion):
+        """Ghi lượt gọi thành công, chỉnh hạn mức của model theo header/usage; trả lại completion"""
+        self.breaker.record(True, self.probe)
+        self.limiter.observe(raw.headers, self.cost, _used_tokens(completion))
+        return completion
+
+
+def _create_completion(request: dict, priority: int):
+    """
+    Gọi client.chat.completions.create qua circuit breaker và bộ giới hạn tốc độ của model
+
+    Chờ lượt theo độ ưu tiên, chỉnh hạn mức theo header của response. Gặp 429
+    thì hàng đợi của model tạm dừng theo retry-after và request được xếp hàng lại
+    thay vì báo lỗi ngay. Cả lần gọi (chờ lượt, gọi, thử lại) nằm trong
+    CALL_DEADLINES của độ ưu tiên: timeout của HTTP là thời gian còn lại.
+
+    Args:
+        request: Tham số completions.create (kèm model)
+        priority: PRIORITY_CHAT | PRIORITY_ASSIST | PRIORITY_BACKGROUND
+
+    Returns:
+        ChatCompletion (hoặc Stream nếu request có stream=True)
+
+    Raises:
+        RateLimitTimeout: Không tới lượt trong hạn chờ
+        CircuitOpenError: Model đang bị ngắt mạch
+    """
+    call = _CompletionCall(request, priority)
+    while True:
+        call.start()
+        try:
+            call.limiter.acquire(call.cost, priority, call.queue_deadline)
+            raw = client.chat.completions.with_raw_response.create(**request, timeout=call.remaining())
+        except BaseException as e:
+            delay = call.failed(e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        return call.succeeded(raw, raw.parse())
+
+
+async def _araw_create(request: dict, deadline: float, hedge_key=None):
+    """Một request tới Groq, hủy khi quá deadline. Thời gian phản hồi được ghi theo hedge_key."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise CallDeadlineExceeded(f"{request['model']}: hết thời gian trước khi gọi")
+    started = time.perf_counter()
+    try:
+        raw = await asyncio.wait_for(
+            async_client.chat.completions.with_raw_response.create(**request, timeout=remaining), remaining
+        )
+    except asyncio.TimeoutError:
+        raise CallDeadlineExceeded(f"{request['model']}: không trả lời trong {remaining:.1f}s") from None
+    if hedge_key is not None:
+        _record_service_time(hedge_key, (time.perf_counter() - started) * 1000)
+    return raw
+
+
+async def _ahedged_create(request: dict, call: _CompletionCall, hedge_key):
+    """
+    Gửi request; nếu sau p95 thời gian phản hồi của hedge_key vẫn chưa có kết quả
+    (và bộ giới hạn của model còn lượt ngay) thì gửi thêm một bản giống hệt, lấy kết quả
+    về trước và hủy bản còn lại. Token đã giữ cho bản thừa được trả lại bộ giới hạn.
+    """
+    deadline = call.deadline
+    hedge_after = _hedge_delay(hedge_key) if hedge_key is not None else None
+    first = asyncio.ensure_future(_araw_create(request, deadline, hedge_key))
+    tasks = [first]
+    hedged = False
+    try:
+        if hedge_after is None or time.monotonic() + hedge_after >= deadline:
+            return await first
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if done:
+            return first.result()
+        if not call.limiter.try_acquire(call.cost, call.priority):
+            _record_hedge("skipped")
+            return await first
+
+        _record_hedge("hedged")
+        hedged = True
+        tasks.append(asyncio.ensure_future(_araw_create(request, deadline, hedge_key)))
+        error = None
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    if task is not first:
+                        _record_hedge("hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        if hedged:
+            # Chỉ một lượt được observe() theo usage thực tế, lượt của bản thừa trả lại ở đây
+            call.limiter.release(call.cost)
+
+
+async def _acreate_completion(request: dict, priority: int, hedge_key=None):
+    """
+    Như _create_completion cho async_client (chờ lượt không chặn event loop,
+    request bị hủy đúng lúc quá deadline)
+
+    Args:
+        hedge_key: (tác vụ, model) để hedging theo p95 thời gian phản hồi (None = không hedging)
+    """
+    call = _CompletionCall(request, priority)
+    while True:
+        call.start()
+        try:
+            await call.limiter.aacquire(call.cost, priority, call.queue_deadline)
+            raw = await _ahedged_create(request, call, hedge_key)
+        except BaseException as e:
+            delay = call.failed(e)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        return call.succeeded(raw, await raw.parse())
+
+
+EMOTIONS = ['annoyed', 'worried', 'happy', 'neutral']
+
+# Cách phát hiện cảm xúc trong chat_with_ai:
+# - "sequential": gọi detect_emotion rồi mới gọi completion chính (2 lượt chờ nối tiếp)
+# - "parallel": detect_emotion chạy song song, completion dùng cảm xúc của lượt trước,
+#   cảm xúc mới trả về cho client để áp dụng ở lượt sau
+# - "inline": không gọi riêng, completion chính trả cảm xúc qua thẻ ||EMOTION:...||
+EMOTION_MODES = ("sequential", "parallel", "inline")
+EMOTION_MODE = os.getenv("EMOTION_MODE", "sequential").lower()
+
+_emotion_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EMOTION_WORKERS", "8")), thread_name_prefix="emotion")
+
+EMOTION_TAG = re.compile(r'\|\|EMOTION:\s*([a-zA-Z]+)\s*\|\|')
+
+# Bộ phân loại từ điển đủ tự tin (> ngưỡng) thì không gọi LLM; đặt >= 1 để luôn gọi LLM.
+# Một từ đơn trọng số 1.5 ("vui", "cảm ơn") cho đúng 0.6 nên vẫn hỏi LLM.
+EMOTION_LOCAL_THRESHOLD = float(os.getenv("EMOTION_LOCAL_THRESHOLD", "0.6"))
+
+# Kết quả LLM cho input giống hệt (retry, double-click, trích xuất lại lịch sử chưa đổi)
+emotion_cache = LlmCache("emotion")
+services_cache = LlmCache("extract_services")
+customer_info_cache = LlmCache("extract_customer_info")
+
+
+# Model cho từng tác vụ (chat, tóm tắt, cảm xúc, trích xuất), xem model_router.DEFAULT_ROUTES
+model_router = ModelRouter()
+
+
+def get_model_route_stats():
+    """
+    Model đang dùng cho từng tác vụ, số lần nâng/hạ cấp và p50/p95 của từng model
+
+    Returns:
+        dict: ModelRouter.stats()
+    """
+    return model_router.stats()
+
+
+def _route_plan(task: str, request: dict):
+    """
+    Returns:
+        tuple: (Route, [(model, hedge_key)]) - hedge_key là None khi tác vụ không hedging
+               (ngoài GROQ_HEDGE_TASKS, hoặc request stream)
+    """
+    route = model_router.route(task)
+    hedging = task in GROQ_HEDGE_TASKS and not request.get("stream")
+    return route, [(model, (task, model) if hedging else None) for model in route.plan()]
+
+
+def _route_succeeded(route, model: str, started: float, attempt: int):
+    route.record(model, (time.perf_counter() - started) * 1000, ok=True, escalated=attempt > 0)
+    route.finish(model)
+
+
+def _route_failed(route, model: str, started: float, attempt: int, plan: list, e: Exception):
+    """
+    Ghi lượt gọi lỗi; True nếu còn model để gọi lại. Hết lượt (RateLimitTimeout) cũng
+    chuyển model: model dự phòng có hạn mức và hàng đợi riêng.
+    """
+    route.record(model, (time.perf_counter() - started) * 1000, ok=False, escalated=attempt > 0)
+    if attempt == len(plan) - 1:
+        return False
+    print(f"⚠️  {route.task}: {model} lỗi ({e}), gọi lại bằng {plan[attempt + 1][0]}")
+    return True
+
+
+def _routed_completion(task: str, request: dict, priority: int, parse=None):
+    """
+    Gọi model theo bảng định tuyến của tác vụ
+
+    Model được chọn theo Route.plan(); lỗi hoặc parse ném lỗi thì gọi lại một lần
+    bằng model còn lại. Độ trễ (kể cả parse; với stream là tới khi luồng mở)
+    được ghi cho p50/p95 của route. Bản sync không hedging vì không hủy được
+    request đang chạy (hedge_key bị bỏ qua).
+
+    Args:
+        task: Tên tác vụ trong model_router
+        request: Tham số completions.create (không kèm model)
+        priority: Độ ưu tiên trong hàng đợi của bộ giới hạn
+        parse: Hàm nhận completion trả về kết quả, ném lỗi nếu kết quả không hợp lệ
+
+    Returns:
+        Kết quả của parse (hoặc completion nếu không có parse)
+    """
+    route, plan = _route_plan(task, request)
+    for attempt, (model, _) in enumerate(plan):
+        started = time.perf_counter()
+        try:
+            completion = _create_completion(dict(request, model=model), priority)
+            result = parse(completion) if parse else completion
+        except Exception as e:
+            if not _route_failed(route, model, started, attempt, plan, e):
+                raise
+            continue
+        _route_succeeded(route, model, started, attempt)
+        return result
+
+
+async def _arouted_completion(task: str, request: dict, priority: int, parse=None):
+    """Như _routed_completion cho async_client, có hedging cho các tác vụ trong GROQ_HEDGE_TASKS"""
+    route, plan = _route_plan(task, request)
+    for attempt, (model, hedge_key) in enumerate(plan):
+        started = time.perf_counter()
+        try:
+            completion = await _acreate_completion(dict(request, model=model), priority, hedge_key)
+            result = parse(completion) if parse else completion
+        except Exception as e:
+            if not _route_failed(route, model, started, attempt, plan, e):
+                raise
+            continue
+        _route_succeeded(route, model, started, attempt)
+        return result
+
+
+def _completion_text(completion) -> str:
+    return completion.choices[0].message.content
+
+
+def get_llm_cache_stats():
+    """
+    Số liệu hit/miss của các cache kết quả LLM và của bộ trích xuất thông tin khách bằng luật
+
+    Returns:
+        dict: {tên cache: LlmCache.stats(), customer_info_rules: {...}}
+    """
+    stats = {cache.name: cache.stats() for cache in (emotion_cache, services_cache, customer_info_cache)}
+    stats["customer_info_rules"] = get_customer_info_rule_stats()
+    return stats
+
+
+_emotion_metrics_lock = threading.Lock()
+# local: phân loại tại chỗ; fallback: chuyển LLM (có thể trúng cache); llm: số lần gọi Groq thật
+_emotion_metrics = {"local": 0, "fallback": 0, "llm": 0, "llm_ms": 0.0, "local_ms": 0.0}
+
+
+def get_emotion_metrics():
+    """
+    Tỉ lệ tin nhắn được phân loại cảm xúc tại chỗ và thời gian tiết kiệm được
+
+    Thời gian tiết kiệm ước tính = thời gian trung bình một lượt gọi LLM
+    trừ thời gian phân loại tại chỗ, nhân số lượt không phải gọi LLM.
+
+    Returns:
+        dict: {messages, local_hits, llm_fallbacks, llm_calls, hit_rate, avg_llm_ms, avg_local_ms,
+               saved_ms_per_message, saved_ms_total}
+    """
+    with _emotion_metrics_lock:
+        metrics = dict(_emotion_metrics)
+
+    total = metrics["local"] + metrics["fallback"]
+    avg_llm = metrics["llm_ms"] / metrics["llm"] if metrics["llm"] else None
+    avg_local = metrics["local_ms"] / total if total else None
+    saved_total = (avg_llm - avg_local) * metrics["local"] if avg_llm is not None and avg_local is not None else None
+    return {
+        "messages": total,
+        "local_hits": metrics["local"],
+        "llm_fallbacks": metrics["fallback"],
+        "llm_calls": metrics["llm"],
+        "hit_rate": round(metrics["local"] / total, 3) if total else None,
+        "threshold": EMOTION_LOCAL_THRESHOLD,
+        "avg_llm_ms": round(avg_llm, 1) if avg_llm is not None else None,
+        "avg_local_ms": round(avg_local, 3) if avg_local is not None else None,
+        "saved_ms_per_message": round(saved_total / total, 1) if saved_total is not None else None,
+        "saved_ms_total": round(saved_total) if saved_total is not None else None,
+    }
+
+
+def _classify_locally(message: str):
+    """Bộ phân loại từ điển; trả về cảm xúc nếu đủ tự tin, None nếu cần hỏi LLM"""
+    started = time.perf_counter()
+    emotion, confidence = classify_emotion(message)
+    local_ms = (time.perf_counter() - started) * 1000
+
+    confident = confidence > EMOTION_LOCAL_THRESHOLD
+    with _emotion_metrics_lock:
+        _emotion_metrics["local_ms"] += local_ms
+        _emotion_metrics["local" if confident else "fallback"] += 1
+
+    if confident:
+        print(f"Detected emotion (lexicon {confidence}): {emotion}")
+        return emotion
+    return None
 
 
 def detect_emotion(message: str, history: list):
     """
-    Phát hiện cảm xúc của khách hàng bằng Groq AI
+    Phát hiện cảm xúc của khách hàng: bộ phân loại từ điển tại chỗ, chuyển sang
+    Groq AI khi độ tin cậy không vượt EMOTION_LOCAL_THRESHOLD
 
     Args:
         message: Tin nhắn từ người dùng
@@ -21,10 +630,44 @@ def detect_emotion(message: str, history: list):
     Returns:
         str: Một trong ['annoyed', 'worried', 'happy', 'neutral']
     """
+    # Thử bộ phân loại từ điển trước, chỉ gọi LLM khi chưa đủ tự tin
+    emotion = _classify_locally(message)
+    if emotion:
+        return emotion
+
+    recent = history[-3:] if history else []
     try:
-        history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history[-3:]]) if history else ""
+        return emotion_cache.get_or_compute(
+            cache_key(message, recent),
+            lambda: _call_emotion_llm(message, recent)
+        )
+    except Exception as e:
+        print(f"Lỗi phát hiện cảm xúc: {e}")
+        return "neutral"
+
+
+async def adetect_emotion(message: str, history: list):
+    """Như detect_emotion nhưng gọi Groq bất đồng bộ"""
+    emotion = _classify_locally(message)
+    if emotion:
+        return emotion
+
+    recent = history[-3:] if history else []
+    try:
+        return await emotion_cache.aget_or_compute(
+            cache_key(message, recent),
+            lambda: _acall_emotion_llm(message, recent)
+        )
+    except Exception as e:
+        print(f"Lỗi phát hiện cảm xúc: {e}")
+        return "neutral"
+
+
+def _emotion_request(message: str, recent: list):
+    """Tham số completions.create để phân loại cảm xúc"""
+    history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent])
 
-        emotion_prompt = f"""Phân tích cảm xúc của khách hàng từ tin nhắn cuối cùng.
+    emotion_prompt = f"""Phân tích cảm xúc của khách hàng từ tin nhắn cuối cùng.
 
 Lịch sử chat gần đây:
 {history_text}
@@ -41,33 +684,282 @@ Danh sách cảm xúc:
 
 CH CHỉ trả lại MỘT trong 4 từ trên, không giải thích thêm. Ví dụ: "annoyed"""
 
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "Bạn là chuyên gia phân tích cảm xúc. Hãy xác định cảm xúc của khách hàng dựa trên lời nói của họ."},
-                {"role": "user", "content": emotion_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=20
-        )
+    return dict(
+        messages=[
+            {"role": "system", "content": "Bạn là chuyên gia phân tích cảm xúc. Hãy xác định cảm xúc của khách hàng dựa trên lời nói của họ."},
+            {"role": "user", "content": emotion_prompt}
+        ],
+        temperature=0.3,
+        max_tokens=20
+    )
 
-        emotion_text = completion.choices[0].message.content.strip().lower()
 
-        # Kiểm tra kết quả
-        emotions = ['annoyed', 'worried', 'happy', 'neutral']
-        for emotion in emotions:
-            if emotion in emotion_text:
-                print(f"Detected emotion: {emotion}")
-                return emotion
+def _parse_emotion(emotion_text: str):
+    emotion_text = emotion_text.strip().lower()
+
+    # Kiểm tra kết quả
+    for emotion in EMOTIONS:
+        if emotion in emotion_text:
+            print(f"Detected emotion: {emotion}")
+            return emotion
+
+    # Không có nhãn nào: ném lỗi để gọi lại bằng model dự phòng (detect_emotion trả "neutral" nếu vẫn lỗi)
+    raise ValueError(f"Không có nhãn cảm xúc trong phản hồi: {emotion_text!r}")
 
-        return "neutral"
 
+@contextmanager
+def _timed_emotion_call():
+    """Đếm số lần và thời gian gọi Groq thật cho cảm xúc"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _emotion_metrics_lock:
+            _emotion_metrics["llm"] += 1
+            _emotion_metrics["llm_ms"] += (time.perf_counter() - started) * 1000
+
+
+def _call_emotion_llm(message: str, recent: list):
+    """Gọi Groq phân loại cảm xúc (lỗi API được ném ra để không bị cache)"""
+    with _timed_emotion_call():
+        return _routed_completion("emotion", _emotion_request(message, recent), PRIORITY_ASSIST,
+                                  lambda completion: _parse_emotion(_completion_text(completion)))
+
+
+async def _acall_emotion_llm(message: str, recent: list):
+    with _timed_emotion_call():
+        return await _arouted_completion("emotion", _emotion_request(message, recent), PRIORITY_ASSIST,
+                                         lambda completion: _parse_emotion(_completion_text(completion)))
+
+
+def _split_emotion_tag(reply: str):
+    """Tách thẻ ||EMOTION:...|| khỏi câu trả lời (chế độ inline)"""
+    match = EMOTION_TAG.search(reply)
+    if not match:
+        return reply, None
+    emotion = match.group(1).lower()
+    return EMOTION_TAG.sub("", reply, count=1).strip(), emotion if emotion in EMOTIONS else None
+
+
+def _resolve_emotion_mode(previous_emotion: str, emotion_mode: str):
+    """Chuẩn hóa chế độ cảm xúc và cảm xúc lượt trước"""
+    mode = (emotion_mode or EMOTION_MODE).lower()
+    if mode not in EMOTION_MODES:
+        mode = "sequential"
+    if previous_emotion not in EMOTIONS:
+        previous_emotion = "neutral"
+    return mode, previous_emotion
+
+
+def _start_emotion(message: str, history: list, previous_emotion: str, emotion_mode: str):
+    """
+    Chọn chế độ cảm xúc và lấy cảm xúc dùng cho completion chính
+
+    Returns:
+        tuple: (chế độ, cảm xúc dùng ngay, Future cảm xúc mới hoặc None)
+    """
+    mode, previous_emotion = _resolve_emotion_mode(previous_emotion, emotion_mode)
+
+    if mode == "sequential":
+        # Phát hiện cảm xúc của khách
+        return mode, detect_emotion(message, history), None
+
+    # Chưa có cảm xúc của tin nhắn này: tạm dùng cảm xúc lượt trước
+    future = _emotion_executor.submit(detect_emotion, message, history) if mode == "parallel" else None
+    return mode, previous_emotion, future
+
+
+async def _astart_emotion(message: str, history: list, previous_emotion: str, emotion_mode: str):
+    """Như _start_emotion, chế độ parallel chạy adetect_emotion thành task song song"""
+    mode, previous_emotion = _resolve_emotion_mode(previous_emotion, emotion_mode)
+
+    if mode == "sequential":
+        return mode, await adetect_emotion(message, history), None
+
+    task = asyncio.create_task(adetect_emotion(message, history)) if mode == "parallel" else None
+    return mode, previous_emotion, task
+
+
+def _chat_system_text(emotion: str, mode: str):
+    """System instruction điều chỉnh theo cảm xúc (kèm hướng dẫn thẻ cảm xúc ở chế độ inline)"""
+    adjusted_system_instruction = get_system_instruction_with_emotion(emotion)
+    if mode == "inline":
+        adjusted_system_instruction += EMOTION_TAG_INSTRUCTION
+    return adjusted_system_instruction
+
+
+def _build_chat_messages(message: str, history: list, emotion: str, mode: str):
+    """Ghép system instruction (theo cảm xúc), lịch sử (trong ngân sách token) và tin nhắn mới"""
+    plan = ContextPlan(_chat_system_text(emotion, mode), history, message)
+    if plan.blocking:
+        try:
+            summary = summary_cache.get_or_compute(
+                plan.key, lambda: _summarize_turns_llm(plan.base_summary, plan.pending_turns)
+            )
+            plan.use_summary(summary)
+        except Exception as e:
+            print(f"Lỗi tóm tắt lịch sử chat: {e}")
+    elif plan.due and not summary_cache.in_flight(plan.key):
+        _summary_executor.submit(_refresh_summary, plan.key, plan.base_summary, plan.pending_turns)
+    return plan.build()
+
+
+async def _abuild_chat_messages(message: str, history: list, emotion: str, mode: str):
+    """Như _build_chat_messages, tóm tắt (nếu cần) bằng client async"""
+    plan = ContextPlan(_chat_system_text(emotion, mode), history, message)
+    if plan.blocking:
+        try:
+            summary = await summary_cache.aget_or_compute(
+                plan.key, lambda: _asummarize_turns_llm(plan.base_summary, plan.pending_turns)
+            )
+            plan.use_summary(summary)
+        except Exception as e:
+            print(f"Lỗi tóm tắt lịch sử chat: {e}")
+    elif plan.due and not summary_cache.in_flight(plan.key):
+        task = asyncio.create_task(_arefresh_summary(plan.key, plan.base_summary, plan.pending_turns))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return plan.build()
+
+
+# Tóm tắt chạy nền khi prompt vẫn vừa ngân sách với tóm tắt cũ hơn
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-summary")
+_background_tasks = set()
+
+
+def _summary_request(base_summary: str, turns: list):
+    """Tham số completions.create để gộp các lượt mới vào bản tóm tắt"""
+    previous = f"TÓM TẮT TRƯỚC ĐÓ:\n{base_summary}\n\n" if base_summary else ""
+    summary_prompt = f"""{previous}CÁC LƯỢT TRAO ĐỔI MỚI:
+{format_turns(turns)}
+
+Viết lại MỘT bản tóm tắt ngắn gọn (gạch đầu dòng, tối đa 8 dòng) cho toàn bộ nội dung trên.
+Giữ đủ: tên khách, số điện thoại, email, tên/loại/cân nặng thú cưng, dịch vụ và gói đã chọn,
+thời gian hẹn, giá đã báo, yêu cầu đặc biệt, điều khách còn băn khoăn. Không thêm thông tin mới."""
+
+    return dict(
+        messages=[
+            {"role": "system", "content": "Bạn tóm tắt hội thoại giữa khách và nhân viên tư vấn Mimi của Pet Lovers Spa & Hotel."},
+            {"role": "user", "content": summary_prompt}
+        ],
+        temperature=0.2,
+        max_tokens=CONTEXT_SUMMARY_TOKENS
+    )
+
+
+def _summarize_turns_llm(base_summary: str, turns: list, priority: int = PRIORITY_CHAT):
+    try:
+        completion = _routed_completion("summary", _summary_request(base_summary, turns), priority)
+    except Exception:
+        record_summary_call(ok=False)
+        raise
+    record_summary_call(ok=True)
+    return completion.choices[0].message.content.strip()
+
+
+async def _asummarize_turns_llm(base_summary: str, turns: list, priority: int = PRIORITY_CHAT):
+    try:
+        completion = await _arouted_completion("summary", _summary_request(base_summary, turns), priority)
+    except Exception:
+        record_summary_call(ok=False)
+        raise
+    record_summary_call(ok=True)
+    return completion.choices[0].message.content.strip()
+
+
+def _refresh_summary(key: str, base_summary: str, turns: list):
+    try:
+        summary_cache.get_or_compute(key, lambda: _summarize_turns_llm(base_summary, turns, PRIORITY_BACKGROUND))
     except Exception as e:
-        print(f"Lỗi phát hiện cảm xúc: {e}")
-        return "neutral"
+        print(f"Lỗi tóm tắt lịch sử chat: {e}")
 
 
-def chat_with_ai(message: str, history: list, selected_services: list = []):
+async def _arefresh_summary(key: str, base_summary: str, turns: list):
+    try:
+        await summary_cache.aget_or_compute(
+            key, lambda: _asummarize_turns_llm(base_summary, turns, PRIORITY_BACKGROUND)
+        )
+    except Exception as e:
+        print(f"Lỗi tóm tắt lịch sử chat: {e}")
+
+
+def _chat_request(messages: list, stream: bool = False):
+    """Tham số completions.create cho completion chính"""
+    request = dict(
+        messages=messages,
+        temperature=0.6
+    )
+    if stream:
+        request["stream"] = True
+    return request
+
+
+def _finish_chat(bot_reply: str, mode: str, emotion: str):
+    """Tách thẻ cảm xúc (inline) và khối đơn hàng khỏi câu trả lời đầy đủ"""
+    if mode == "inline":
+        bot_reply, tagged_emotion = _split_emotion_tag(bot_reply)
+        emotion = tagged_emotion or emotion
+
+    # Kiểm tra và tách đơn hàng
+    match = re.search(r'\|\|JSON_START\|\|(.*?)\|\|JSON_END\|\|', bot_reply, re.DOTALL)
+
+    order_info = None
+    if match:
+        try:
+            json_str = match.group(1)
+            order_info = json.loads(json_str)
+            # Xóa JSON khỏi tin nhắn hiển thị
+            bot_reply = bot_reply.replace(match.group(0), "").strip()
+        except Exception as e:
+            print(f"Lỗi xử lý đơn hàng: {e}")
+
+    return {
+        "reply": bot_reply,
+        "order_data": order_info,
+        "services": SERVICES,
+        "emotion": emotion
+    }
+
+
+def _chat_error_result(e: Exception):
+    """Câu trả lời cho khách khi gọi Groq lỗi"""
+    error_str = str(e)
+    print(f"Lỗi API chat: {e}")
+
+    # Handle rate limit error (Groq trả 429, hoặc không tới lượt trong hàng đợi của bộ giới hạn)
+    if isinstance(e, (RateLimitError, RateLimitTimeout)) or "429" in error_str or "rate limit" in error_str.lower():
+        reply = "⚠️ Hệ thống tạm bận (đã đạt giới hạn). Vui lòng chờ một lát rồi thử lại!"
+    else:
+        reply = "❌ Lỗi kết nối. Vui lòng thử lại sau."
+
+    return {
+        "reply": reply,
+        "order_data": None,
+        "show_services": False
+    }
+
+
+def _catalog_result(message: str, history: list, previous_emotion: str):
+    """
+    Kết quả dạng chat_with_ai khi câu hỏi tra cứu bảng giá / gói được trả lời
+    từ danh mục (bỏ qua cả lời gọi cảm xúc lẫn completion chính)
+
+    Returns:
+        dict hoặc None nếu cần gọi LLM
+    """
+    reply = answer_from_catalog(message, history)
+    if reply is None:
+        return None
+    return {
+        "reply": reply,
+        "order_data": None,
+        "services": SERVICES,
+        "emotion": previous_emotion if previous_emotion in EMOTIONS else "neutral"
+    }
+
+
+def chat_with_ai(message: str, history: list, selected_services: list = [], previous_emotion: str = None,
+                 emotion_mode: str = None):
     """
     Chat với Groq AI và trích xuất đơn hàng nếu có
     Tự động phát hiện cảm xúc và điều chỉnh response phù hợp
@@ -76,151 +968,211 @@ def chat_with_ai(message: str, history: list, selected_services: list = []):
         message: Tin nhắn từ người dùng
         history: Lịch sử chat
         selected_services: Danh sách dịch vụ đã chọn
+        previous_emotion: Cảm xúc trả về ở lượt trước (dùng cho chế độ parallel/inline)
+        emotion_mode: "sequential" | "parallel" | "inline" (mặc định EMOTION_MODE)
 
     Returns:
         dict: {reply, order_data, services, emotion}
     """
+    instant = _catalog_result(message, history, previous_emotion)
+    if instant is not None:
+        return instant
+
     try:
-        # Phát hiện cảm xúc của khách
-        emotion = detect_emotion(message, history)
+        mode, emotion, emotion_future = _start_emotion(message, history, previous_emotion, emotion_mode)
+        messages = _build_chat_messages(message, history, emotion, mode)
 
-        # Điều chỉnh system instruction dựa trên cảm xúc
-        adjusted_system_instruction = get_system_instruction_with_emotion(emotion)
+        completion = _routed_completion("chat", _chat_request(messages), PRIORITY_CHAT)
 
-        messages = [{"role": "system", "content": adjusted_system_instruction}] + history
-        messages.append({"role": "user", "content": message})
+        if emotion_future is not None:
+            # detect_emotion tự bắt lỗi và trả "neutral"
+            emotion = emotion_future.result()
+        return _finish_chat(completion.choices[0].message.content, mode, emotion)
+
+    except Exception as e:
+        return _chat_error_result(e)
 
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            temperature=0.6
-        )
 
-        bot_reply = completion.choices[0].message.content
+async def achat_with_ai(message: str, history: list, selected_services: list = [], previous_emotion: str = None,
+                        emotion_mode: str = None):
+    """Như chat_with_ai nhưng chờ Groq bất đồng bộ (không chiếm thread của server)"""
+    instant = _catalog_result(message, history, previous_emotion)
+    if instant is not None:
+        return instant
+
+    try:
+        mode, emotion, emotion_task = await _astart_emotion(message, history, previous_emotion, emotion_mode)
+        messages = await _abuild_chat_messages(message, history, emotion, mode)
+
+        completion = await _arouted_completion("chat", _chat_request(messages), PRIORITY_CHAT)
+
+        if emotion_task is not None:
+            emotion = await emotion_task
+        return _finish_chat(completion.choices[0].message.content, mode, emotion)
+
+    except Exception as e:
+        return _chat_error_result(e)
 
-        # Kiểm tra và tách đơn hàng
-        match = re.search(r'\|\|JSON_START\|\|(.*?)\|\|JSON_END\|\|', bot_reply, re.DOTALL)
+
+class _ReplyStream:
+    """
+    Ghép câu trả lời dạng luồng: lọc dần khối ||JSON_START||...||JSON_END||
+    (và thẻ ||EMOTION:...|| ở chế độ inline) để chúng không bao giờ hiện ra
+    cho khách, rồi tách đơn hàng khi luồng kết thúc.
+    """
+
+    def __init__(self, mode: str):
+        self.emotion_filter = MarkerFilter("||EMOTION:", "||") if mode == "inline" else None
+        self.order_filter = MarkerFilter("||JSON_START||", "||JSON_END||")
+        self.parts = []
+
+    def feed(self, text: str, final: bool = False) -> str:
+        """Nhận một đoạn token, trả về phần hiển thị được"""
+        if self.emotion_filter is not None:
+            text = self.emotion_filter.feed(text) + (self.emotion_filter.flush() if final else "")
+        text = self.order_filter.feed(text) + (self.order_filter.flush() if final else "")
+        # Bỏ khoảng trắng đầu câu trả lời (còn lại sau khi tách thẻ cảm xúc)
+        if not self.parts:
+            text = text.lstrip()
+        if text:
+            self.parts.append(text)
+        return text
+
+    def result(self, emotion: str):
+        """Kết quả cuối cùng giống chat_with_ai"""
+        if self.emotion_filter is not None and self.emotion_filter.blocks:
+            tagged_emotion = self.emotion_filter.blocks[0].strip().lower()
+            emotion = tagged_emotion if tagged_emotion in EMOTIONS else emotion
 
         order_info = None
-        if match:
+        if self.order_filter.blocks:
             try:
-                json_str = match.group(1)
-                order_info = json.loads(json_str)
-                # Xóa JSON khỏi tin nhắn hiển thị
-                bot_reply = bot_reply.replace(match.group(0), "").strip()
+                order_info = json.loads(self.order_filter.blocks[0])
             except Exception as e:
                 print(f"Lỗi xử lý đơn hàng: {e}")
+        elif self.order_filter.unterminated:
+            print("Lỗi xử lý đơn hàng: thiếu ||JSON_END||")
 
         return {
-            "reply": bot_reply,
+            "reply": "".join(self.parts).strip(),
             "order_data": order_info,
             "services": SERVICES,
             "emotion": emotion
         }
 
-    except Exception as e:
-        error_str = str(e)
-        print(f"Lỗi API chat: {e}")
-
-        # Handle rate limit error
-        if "429" in error_str or "rate limit" in error_str.lower():
-            reply = "⚠️ Hệ thống tạm bận (đã đạt giới hạn). Vui lòng chờ một lát rồi thử lại!"
-        else:
-            reply = "❌ Lỗi kết nối. Vui lòng thử lại sau."
 
-        return {
-            "reply": reply,
-            "order_data": None,
-            "show_services": False
-        }
+def _chunk_text(chunk) -> str:
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
 
 
-def extract_services_from_history(history: list):
+def stream_chat_with_ai(message: str, history: list, selected_services: list = [], previous_emotion: str = None,
+                        emotion_mode: str = None):
     """
-    Trích xuất dịch vụ từ lịch sử chat bằng AI
-    Chỉ trích xuất từ tin nhắn người dùng mới nhất (chứa từ khóa xác nhận)
+    Như chat_with_ai nhưng trả từng đoạn câu trả lời ngay khi Groq sinh ra
+
+    Khối ||JSON_START||...||JSON_END|| (và thẻ ||EMOTION:...|| ở chế độ inline)
+    được lọc dần theo từng token nên không bao giờ hiện ra cho khách; đơn
+    hàng được tách ra khi luồng kết thúc.
 
     Args:
+        message: Tin nhắn từ người dùng
         history: Lịch sử chat
+        selected_services: Danh sách dịch vụ đã chọn
+        previous_emotion: Cảm xúc trả về ở lượt trước
+        emotion_mode: "sequential" | "parallel" | "inline" (mặc định EMOTION_MODE)
 
-    Returns:
-        dict: {services: [list of extracted services]}
+    Yields:
+        tuple: ("token", {text}) cho từng đoạn hiển thị, cuối cùng là
+               ("done", {reply, order_data, services, emotion}) như chat_with_ai
     """
-    try:
-        # Lấy tin nhắn người dùng mới nhất (tin nhắn xác nhận)
-        last_user_message = None
-        for msg in reversed(history):
-            if msg.get('role') == 'user':
-                last_user_message = msg.get('content', '')
-                break
+    instant = _catalog_result(message, history, previous_emotion)
+    if instant is not None:
+        yield "token", {"text": instant["reply"]}
+        yield "done", instant
+        return
 
-        if not last_user_message:
-            return {"services": []}
-
-        # First try: Keyword matching for service names
-        extracted_by_keyword = []
-        message_lower = last_user_message.lower()
-
-        # Score each service based on how many keywords from its name appear in the message
-        service_scores = []
-
-        for service_key, service_data in SERVICES.items():
-            for sub in service_data.get('sub_services', []):
-                service_name = sub['name'].lower()
-
-                # Exact match - highest priority
-                if service_name in message_lower:
-                    service_scores.append((5, {
-                        'service_key': service_key,
-                        'sub_id': sub['id'],
-                        'name': sub['name'],
-                        'price': sub['price']
-                    }))
-                    continue
-
-                # Count how many keywords match
-                service_keywords = [w for w in service_name.split() if len(w) > 2]
-                matching_keywords = sum(1 for keyword in service_keywords if keyword in message_lower)
-
-                # Only include if at least 2 keywords match (e.g., "phòng" + "thường")
-                # This prevents matching just "phòng" for both "Phòng Thường" and "Phòng VIP"
-                if len(service_keywords) > 0 and matching_keywords == len(service_keywords):
-                    service_scores.append((matching_keywords, {
-                        'service_key': service_key,
-                        'sub_id': sub['id'],
-                        'name': sub['name'],
-                        'price': sub['price']
-                    }))
-
-        # Sort by score (descending) and extract
-        service_scores.sort(key=lambda x: x[0], reverse=True)
-        extracted_by_keyword = [service for _, service in service_scores]
-
-        # Remove duplicates (same service mentioned multiple times)
-        unique_by_id = {}
-        for service in extracted_by_keyword:
-            if service['sub_id'] not in unique_by_id:
-                unique_by_id[service['sub_id']] = service
-
-        extracted_by_keyword = list(unique_by_id.values())
-
-        # If we found services via keyword matching, return them
-        if extracted_by_keyword:
-            print(f"Found services via keyword matching: {extracted_by_keyword}")
-            return {"services": extracted_by_keyword}
+    stream = None
+    try:
+        mode, emotion, emotion_future = _start_emotion(message, history, previous_emotion, emotion_mode)
+        messages = _build_chat_messages(message, history, emotion, mode)
+        stream = _routed_completion("chat", _chat_request(messages, stream=True), PRIORITY_CHAT)
+
+        reply = _ReplyStream(mode)
+        for chunk in stream:
+            text = reply.feed(_chunk_text(chunk))
+            if text:
+                yield "token", {"text": text}
+        text = reply.feed("", final=True)
+        if text:
+            yield "token", {"text": text}
+
+        if emotion_future is not None:
+            emotion = emotion_future.result()
+        yield "done", reply.result(emotion)
 
-        # List all available services for matching
-        all_services_list = []
-        for service_key, service_data in SERVICES.items():
-            for sub in service_data.get('sub_services', []):
-                all_services_list.append({
-                    'service_key': service_key,
-                    'sub_id': sub['id'],
-                    'name': sub['name'],
-                    'price': sub['price']
-                })
+    except Exception as e:
+        yield "done", _chat_error_result(e)
+    finally:
+        # Người đọc dừng giữa chừng (khách ngắt kết nối): đóng luồng để trả kết nối về pool
+        if stream is not None:
+            stream.close()
+
+
+async def astream_chat_with_ai(message: str, history: list, selected_services: list = [], previous_emotion: str = None,
+                               emotion_mode: str = None):
+    """Như stream_chat_with_ai nhưng đọc luồng Groq bất đồng bộ"""
+    instant = _catalog_result(message, history, previous_emotion)
+    if instant is not None:
+        yield "token", {"text": instant["reply"]}
+        yield "done", instant
+        return
+
+    stream = emotion_task = None
+    try:
+        mode, emotion, emotion_task = await _astart_emotion(message, history, previous_emotion, emotion_mode)
+        messages = await _abuild_chat_messages(message, history, emotion, mode)
+        stream = await _arouted_completion("chat", _chat_request(messages, stream=True), PRIORITY_CHAT)
+
+        reply = _ReplyStream(mode)
+        async for chunk in stream:
+            text = reply.feed(_chunk_text(chunk))
+            if text:
+                yield "token", {"text": text}
+        text = reply.feed("", final=True)
+        if text:
+            yield "token", {"text": text}
+
+        if emotion_task is not None:
+            emotion = await emotion_task
+        yield "done", reply.result(emotion)
 
-        extraction_prompt = f"""Bạn là trợ lý phân tích dịch vụ thú cưng. Hãy TRÍCH XUẤT những dịch vụ mà khách hàng đề cập TRONG TIN NHẮN XÁC NHẬN NÀY (không phải toàn bộ lịch sử).
+    except Exception as e:
+        yield "done", _chat_error_result(e)
+    finally:
+        # Người đọc dừng giữa chừng (khách ngắt kết nối): đóng luồng để trả slot
+        # của _GatedTransport và kết nối về pool, hủy phân tích cảm xúc còn chạy
+        if emotion_task is not None and not emotion_task.done():
+            emotion_task.cancel()
+        if stream is not None:
+            await stream.close()
+
+
+def _services_request(last_user_message: str):
+    """Tham số completions.create để trích xuất dịch vụ từ tin nhắn xác nhận"""
+    # List all available services for matching
+    all_services_list = []
+    for service_key, service_data in SERVICES.items():
+        for sub in service_data.get('sub_services', []):
+            all_services_list.append({
+                'service_key': service_key,
+                'sub_id': sub['id'],
+                'name': sub['name'],
+                'price': sub['price']
+            })
+
+    extraction_prompt = f"""Bạn là trợ lý phân tích dịch vụ thú cưng. Hãy TRÍCH XUẤT những dịch vụ mà khách hàng đề cập TRONG TIN NHẮN XÁC NHẬN NÀY (không phải toàn bộ lịch sử).
 
 QUAN TRỌNG: Chỉ trích xuất những dịch vụ được đề cập TỪ TRONG TIN NHẮN HIỆN TẠI, không phải từ các tin nhắn trước!
 
@@ -245,60 +1197,126 @@ Hãy trả lại JSON với cấu trúc:
 
 Nếu không tìm thấy dịch vụ nào, trả lại: {{"services": []}}"""
 
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "Bạn là trợ lý phân tích chuyên nghiệp. Hãy trích xuất dịch vụ CHỈ từ tin nhắn hiện tại, không phải từ toàn bộ lịch sử."},
-                {"role": "user", "content": extraction_prompt}
-            ],
-            temperature=0.2,
-            max_tokens=500
-        )
+    return dict(
+        messages=[
+            {"role": "system", "content": "Bạn là trợ lý phân tích chuyên nghiệp. Hãy trích xuất dịch vụ CHỈ từ tin nhắn hiện tại, không phải từ toàn bộ lịch sử."},
+            {"role": "user", "content": extraction_prompt}
+        ],
+        temperature=0.2,
+        max_tokens=500
+    )
 
-        response_text = completion.choices[0].message.content
-        print(f"Extraction response: {response_text}")
 
-        # Extract JSON from response
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            try:
-                result = json.loads(json_match.group(0))
-                services = result.get("services", [])
-                print(f"Extracted services: {services}")
-                return {"services": services}
-            except json.JSONDecodeError as je:
-                print(f"JSON decode error: {je}")
+def _parse_services(response_text: str):
+    print(f"Extraction response: {response_text}")
 
-        return {"services": []}
+    # Extract JSON from response (lỗi được ném ra để kết quả hỏng không bị cache)
+    json_match = re.search(r'\{[\s\S]*\}', response_text)
+    if not json_match:
+        raise ValueError(f"Không tìm thấy JSON trong phản hồi: {response_text!r}")
 
-    except Exception as e:
-        print(f"Lỗi trích xuất dịch vụ: {e}")
-        return {"services": []}
+    result = json.loads(json_match.group(0))
+    services = result.get("services", [])
+    print(f"Extracted services: {services}")
+    return services
 
 
-def extract_customer_info_from_history(history: list):
+def _extract_services_llm(last_user_message: str):
+    """Gọi Groq trích xuất dịch vụ khi so khớp từ khóa không ra (lỗi được ném ra để không bị cache)"""
+    return _routed_completion("extract_services", _services_request(last_user_message), PRIORITY_BACKGROUND,
+                              lambda completion: _parse_services(_completion_text(completion)))
+
+
+async def _aextract_services_llm(last_user_message: str):
+    return await _arouted_completion("extract_services", _services_request(last_user_message), PRIORITY_BACKGROUND,
+                                     lambda completion: _parse_services(_completion_text(completion)))
+
+
+def _last_user_message(history: list):
+    """Tin nhắn người dùng mới nhất (tin nhắn xác nhận)"""
+    for msg in reversed(history):
+        if msg.get('role') == 'user':
+            return msg.get('content', '')
+    return None
+
+
+def _match_services_by_keyword(last_user_message: str):
+    """So khớp tên gói dịch vụ trong tin nhắn bằng chỉ mục dựng sẵn (có dấu hay không dấu, không gọi LLM)"""
+    return get_service_index().match(last_user_message)
+
+
+def extract_services_from_history(history: list):
     """
-    Trích xuất thông tin khách hàng từ lịch sử chat bằng AI
+    Trích xuất dịch vụ từ lịch sử chat bằng AI
+    Chỉ trích xuất từ tin nhắn người dùng mới nhất (chứa từ khóa xác nhận)
 
     Args:
         history: Lịch sử chat
 
     Returns:
-        dict: {name, phone, petName, petType, time} - các trường có thể rỗng nếu không tìm thấy
+        dict: {services: [list of extracted services]}
     """
     try:
-        # Tạo full chat history text
-        history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+        last_user_message = _last_user_message(history)
+        if not last_user_message:
+            return {"services": []}
+
+        # First try: Keyword matching for service names
+        extracted_by_keyword = _match_services_by_keyword(last_user_message)
+        if extracted_by_keyword:
+            print(f"Found services via keyword matching: {extracted_by_keyword}")
+            return {"services": extracted_by_keyword}
+
+        services = services_cache.get_or_compute(
+            cache_key(last_user_message),
+            lambda: _extract_services_llm(last_user_message)
+        )
+        return {"services": services}
+
+    except Exception as e:
+        print(f"Lỗi trích xuất dịch vụ: {e}")
+        return {"services": []}
+
+
+async def aextract_services_from_history(history: list):
+    """Như extract_services_from_history nhưng gọi Groq bất đồng bộ"""
+    try:
+        last_user_message = _last_user_message(history)
+        if not last_user_message:
+            return {"services": []}
+
+        extracted_by_keyword = _match_services_by_keyword(last_user_message)
+        if extracted_by_keyword:
+            print(f"Found services via keyword matching: {extracted_by_keyword}")
+            return {"services": extracted_by_keyword}
+
+        services = await services_cache.aget_or_compute(
+            cache_key(last_user_message),
+            lambda: _aextract_services_llm(last_user_message)
+        )
+        return {"services": services}
+
+    except Exception as e:
+        print(f"Lỗi trích xuất dịch vụ: {e}")
+        return {"services": []}
+
+
+# Mô tả từng trường trong prompt: (tên trường, giá trị mẫu trong JSON)
+_CUSTOMER_INFO_PROMPT_FIELDS = {
+    "name": ("Tên khách hàng", "Tên khách (nếu tìm thấy, nếu không để trống)"),
+    "phone": ("Số điện thoại", "SĐT (nếu tìm thấy, nếu không để trống)"),
+    "petName": ("Tên thú cưng", "Tên thú cưng (nếu tìm thấy, nếu không để trống)"),
+    "petType": ("Loại thú cưng (Chó, Mèo, v.v.)", "Loại thú cưng như Chó/Mèo (nếu tìm thấy, nếu không để trống)"),
+    "time": ("Giờ hẹn/thời gian", "Giờ hẹn (nếu tìm thấy, nếu không để trống)"),
+}
 
-        if not history_text.strip():
-            return {"name": "", "phone": "", "petName": "", "petType": "", "time": ""}
 
-        extraction_prompt = f"""Bạn là trợ lý trích xuất thông tin khách hàng. Hãy trích xuất các thông tin sau từ lịch sử chat:
-- Tên khách hàng
-- Số điện thoại
-- Tên thú cưng
-- Loại thú cưng (Chó, Mèo, v.v.)
-- Giờ hẹn/thời gian
+def _customer_info_request(history_text: str, fields=CUSTOMER_INFO_FIELDS):
+    """Tham số completions.create để trích xuất các trường thông tin khách hàng `fields`"""
+    wanted = "\n".join(f"- {_CUSTOMER_INFO_PROMPT_FIELDS[field][0]}" for field in fields)
+    example = ",\n".join(f'    "{field}": "{_CUSTOMER_INFO_PROMPT_FIELDS[field][1]}"' for field in fields)
+    extraction_prompt = f"""Bạn là trợ lý trích xuất thông tin khách hàng. Hãy trích xuất các thông tin sau từ lịch sử chat:
+{wanted}
 
 Lịch sử chat:
 {history_text}
@@ -310,47 +1328,113 @@ HƯỚNG DẪN:
 
 Hãy trả lại JSON:
 {{
-    "name": "Tên khách (nếu tìm thấy, nếu không để trống)",
-    "phone": "SĐT (nếu tìm thấy, nếu không để trống)",
-    "petName": "Tên thú cưng (nếu tìm thấy, nếu không để trống)",
-    "petType": "Loại thú cưng như Chó/Mèo (nếu tìm thấy, nếu không để trống)",
-    "time": "Giờ hẹn (nếu tìm thấy, nếu không để trống)"
+{example}
 }}
 
 CHỈ TRẢ LẠI JSON, KHÔNG CÓ LỜI GIẢI THÍCH."""
 
-        completion = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": "Bạn là trợ lý trích xuất thông tin chuyên nghiệp. Hãy trích xuất thông tin khách hàng từ cuộc trò chuyện một cách chính xác."},
-                {"role": "user", "content": extraction_prompt}
-            ],
-            temperature=0.2,
-            max_tokens=300
+    return dict(
+        messages=[
+            {"role": "system", "content": "Bạn là trợ lý trích xuất thông tin chuyên nghiệp. Hãy trích xuất thông tin khách hàng từ cuộc trò chuyện một cách chính xác."},
+            {"role": "user", "content": extraction_prompt}
+        ],
+        temperature=0.2,
+        max_tokens=300
+    )
+
+
+def _parse_customer_info(response_text: str, fields=CUSTOMER_INFO_FIELDS):
+    print(f"Customer info extraction response: {response_text}")
+
+    # Extract JSON from response (lỗi được ném ra để kết quả hỏng không bị cache)
+    json_match = re.search(r'\{[\s\S]*\}', response_text)
+    if not json_match:
+        raise ValueError(f"Không tìm thấy JSON trong phản hồi: {response_text!r}")
+
+    result = json.loads(json_match.group(0))
+    extracted_info = {field: result.get(field, "") for field in fields}
+    print(f"Extracted customer info: {extracted_info}")
+    return extracted_info
+
+
+def _extract_customer_info_llm(history_text: str, fields):
+    """Gọi Groq trích xuất các trường `fields` từ lịch sử chat (lỗi được ném ra để không bị cache)"""
+    return _routed_completion("extract_customer_info", _customer_info_request(history_text, fields), PRIORITY_BACKGROUND,
+                              lambda completion: _parse_customer_info(_completion_text(completion), fields))
+
+
+async def _aextract_customer_info_llm(history_text: str, fields):
+    return await _arouted_completion(
+        "extract_customer_info", _customer_info_request(history_text, fields), PRIORITY_BACKGROUND,
+        lambda completion: _parse_customer_info(_completion_text(completion), fields)
+    )
+
+
+def _merge_customer_info(local_info: dict, llm_info: dict):
+    """Giữ thông tin tìm được bằng luật, LLM chỉ điền các trường còn trống"""
+    return {field: local_info.get(field) or llm_info.get(field, "") for field in CUSTOMER_INFO_FIELDS}
+
+
+def _customer_info_llm_input(history: list):
+    """
+    Tìm bằng luật rồi thu gọn phần gửi cho AI: chỉ hỏi các trường còn trống,
+    chỉ gửi đoạn hội thoại còn có thể chứa chúng (xem scan_history_tail)
+
+    Returns:
+        tuple: (info, fields, history_text) - fields rỗng nếu không cần gọi AI
+    """
+    info, tail = scan_history_tail(history)
+    fields = tuple(field for field in CUSTOMER_INFO_FIELDS if not info[field])
+    history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in tail])
+    if not history_text.strip():
+        fields = ()
+    return info, fields, history_text
+
+
+def extract_customer_info_from_history(history: list):
+    """
+    Trích xuất thông tin khách hàng từ lịch sử chat: tìm bằng luật trước
+    (SĐT, giờ hẹn, loài, tên), chỉ gọi AI cho các trường còn trống
+
+    Args:
+        history: Lịch sử chat
+
+    Returns:
+        dict: {name, phone, petName, petType, time} - các trường có thể rỗng nếu không tìm thấy
+    """
+    info = dict.fromkeys(CUSTOMER_INFO_FIELDS, "")
+    try:
+        info, fields, history_text = _customer_info_llm_input(history)
+        if not fields:
+            print(f"Found customer info via rules: {info}")
+            return info
+
+        llm_info = customer_info_cache.get_or_compute(
+            cache_key(fields, history_text),
+            lambda: _extract_customer_info_llm(history_text, fields)
         )
+        return _merge_customer_info(info, llm_info)
+
+    except Exception as e:
+        print(f"Lỗi trích xuất thông tin khách hàng: {e}")
+        return info
 
-        response_text = completion.choices[0].message.content
-        print(f"Customer info extraction response: {response_text}")
 
-        # Extract JSON from response
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            try:
-                result = json.loads(json_match.group(0))
-                extracted_info = {
-                    "name": result.get("name", ""),
-                    "phone": result.get("phone", ""),
-                    "petName": result.get("petName", ""),
-                    "petType": result.get("petType", ""),
-                    "time": result.get("time", "")
-                }
-                print(f"Extracted customer info: {extracted_info}")
-                return extracted_info
-            except json.JSONDecodeError as je:
-                print(f"JSON decode error: {je}")
-
-        return {"name": "", "phone": "", "petName": "", "petType": "", "time": ""}
+async def aextract_customer_info_from_history(history: list):
+    """Như extract_customer_info_from_history nhưng gọi Groq bất đồng bộ"""
+    info = dict.fromkeys(CUSTOMER_INFO_FIELDS, "")
+    try:
+        info, fields, history_text = _customer_info_llm_input(history)
+        if not fields:
+            print(f"Found customer info via rules: {info}")
+            return info
+
+        llm_info = await customer_info_cache.aget_or_compute(
+            cache_key(fields, history_text),
+            lambda: _aextract_customer_info_llm(history_text, fields)
+        )
+        return _merge_customer_info(info, llm_info)
 
     except Exception as e:
         print(f"Lỗi trích xuất thông tin khách hàng: {e}")
-        return {"name": "", "phone": "", "petName": "", "petType": "", "time": ""}
+        return info
@@ -1,12 +1,16 @@
 import os
 import json
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
-import smtplib
-from email.mime.text import MIMEText
-from email.header import Header
 from shop_data import SHOP_INFO, SERVICES
-
-ORDER_FILE = "orders.json"
+from order_store import get_order_store
+from order_schema import normalize_order
+from order_stats import get_order_stats
+from order_timeseries import get_order_timeseries
+from order_events import order_events
+from notifier import get_notifier
+from order_writer import get_order_writer, add_commit_listener, OrderCommitPending, ORDER_COMMIT_TIMEOUT
 
 # Thông tin đăng nhập demo
 USERS = {
@@ -41,81 +45,127 @@ def get_services():
     return {"services": SERVICES}
 
 
-def save_order_to_file(order_data):
+def _on_orders_committed(orders):
     """
-    Lưu đơn hàng vào file JSON
+    Ghi thông báo email vào outbox, cập nhật bộ đếm, bản sao dạng cột và
+    đẩy delta SSE sau khi một lô đơn đã được thread ghi đơn lưu bền vững
     
     Args:
-        order_data: Thông tin đơn hàng
+        orders: Các đơn vừa ghi (theo thứ tự ghi)
     
     Returns:
         None
     """
-    if os.path.exists(ORDER_FILE):
-        with open(ORDER_FILE, "r", encoding="utf-8") as f:
-            try:
-                orders = json.load(f)
-            except:
-                orders = []
-    else:
-        orders = []
-    
+    # Ghi outbox trước khi request nhận mã đơn: đơn đã lưu thì chắc chắn sẽ được báo
+    get_notifier().record(orders)
+
+    stats = get_order_stats()
+    timeseries = get_order_timeseries()
+    for order in orders:
+        stats.add(order)
+        timeseries.add(order)
+
+        # Đẩy delta tới các dashboard đang mở kênh SSE
+        order_events.publish({"type": "order", "order": order, "stats": stats.snapshot()})
+
+
+add_commit_listener(_on_orders_committed)
+
+
+def _submit_order(order_data):
+    """Chuẩn hóa đơn hàng rồi đưa vào thread ghi đơn, trả về Future mã đơn"""
+    # Dựng bộ đếm trước khi ghi để đơn mới không bị đếm hai lần
+    get_order_stats()
+    get_order_timeseries()
+
     order_data["created_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    orders.append(order_data)
+    order_data.update(normalize_order(order_data))
+    return get_order_writer().submit(order_data)
+
+
+def save_order_to_file(order_data):
+    """
+    Chuẩn hóa đơn hàng (sub_ids, price_vnd...) rồi đưa vào thread ghi đơn
+    
+    Đơn đến cùng lúc được gom thành một lần ghi (group commit); hàm chờ tới
+    khi đơn đã được ghi bền vững.
+    
+    Args:
+        order_data: Thông tin đơn hàng
+    
+    Returns:
+        str: Mã đơn hàng
     
-    with open(ORDER_FILE, "w", encoding="utf-8") as f:
-        json.dump(orders, f, ensure_ascii=False, indent=4)
+    Raises:
+        OrderCommitPending: Chờ quá ORDER_COMMIT_TIMEOUT; đơn vẫn sẽ được ghi (không gửi lại)
+    """
+    future = _submit_order(order_data)
+    try:
+        order_id = future.result(timeout=ORDER_COMMIT_TIMEOUT)
+    except FutureTimeoutError:
+        raise OrderCommitPending(order_data["id"]) from None
     
-    print(f"✅ Đã lưu đơn hàng cho {order_data.get('name')}")
+    print(f"✅ Đã lưu đơn hàng {order_id} cho {order_data.get('name')}")
+    return order_id
 
 
-def send_email_task(order_data):
+async def asave_order_to_file(order_data):
     """
-    Gửi email thông báo đơn hàng mới
+    Như save_order_to_file nhưng chờ thread ghi đơn bằng await (không chặn event loop)
     
     Args:
         order_data: Thông tin đơn hàng
     
     Returns:
-        None
+        str: Mã đơn hàng
     """
-    sender = os.getenv("EMAIL_GUI")
-    pwd = os.getenv("MAT_KHAU_UNG_DUNG")
-    receiver = os.getenv("EMAIL_NHAN")
+    # shield: hết thời gian chờ không được hủy Future mà thread ghi đơn sẽ set_result
+    future = asyncio.wrap_future(_submit_order(order_data))
+    try:
+        order_id = await asyncio.wait_for(asyncio.shield(future), ORDER_COMMIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise OrderCommitPending(order_data["id"]) from None
+    
+    print(f"✅ Đã lưu đơn hàng {order_id} cho {order_data.get('name')}")
+    return order_id
 
-    if not sender or not pwd:
-        print("❌ Thiếu thông tin Email")
-        return
 
-    time_now = datetime.now().strftime("%H:%M - %d/%m/%Y")
-    subject = f"🔔 [ĐƠN MỚI] Khách {order_data.get('name', 'Ẩn danh')} chốt đơn!"
+def _missing_order_fields(order_info):
+    # Validate order data
+    return not all(key in order_info for key in ['name', 'phone', 'service', 'time', 'price'])
 
-    body = f"""
-    Kính gửi Chủ Shop,
-    
-    Khách hàng vừa chốt đơn qua Chatbot Mimi!
-    ----------------------------
-    ⏰ Thời gian: {time_now}
-    👤 Tên: {order_data.get('name')}
-    📞 SĐT: {order_data.get('phone')}
-    🐕 Dịch vụ: {order_data.get('service')}
-    📅 Lịch hẹn: {order_data.get('time')}
-    💰 Giá tạm tính: {order_data.get('price')}
-    ----------------------------
-    """
 
-    msg = MIMEText(body, 'plain', 'utf-8')
-    msg['Subject'] = Header(subject, 'utf-8')
-    msg['From'] = sender
-    msg['To'] = receiver
+def _order_confirmed(order_info, order_id):
+    return {
+        "success": True,
+        "order_id": order_id,
+        "reply": f"✅ Cảm ơn {order_info.get('name')}! Đơn hàng đã được xác nhận. Chúng tôi sẽ liên hệ với bạn sớm!"
+    }
 
-    try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as s:
-            s.login(sender, pwd)
-            s.sendmail(sender, receiver, msg.as_string())
-        print(f"✅ Đã gửi email thành công cho khách: {order_data.get('name')}")
-    except Exception as e:
-        print(f"❌ Lỗi gửi mail: {e}")
+
+def _order_pending(order_info, e: OrderCommitPending):
+    # Đơn vẫn nằm trong hàng đợi ghi: báo mã đơn thay vì báo lỗi để khách không gửi lại (tạo đơn trùng)
+    print(f"⚠️  {e}")
+    return {
+        "success": True,
+        "pending": True,
+        "order_id": e.order_id,
+        "reply": f"⏳ Cảm ơn {order_info.get('name')}! Đơn hàng {e.order_id} đã được tiếp nhận và đang được xử lý."
+    }
+
+
+def _order_failed(e):
+    print(f"Lỗi xác nhận đơn hàng: {e}")
+    return {
+        "success": False,
+        "reply": f"❌ Có lỗi xảy ra: {str(e)}"
+    }
+
+
+ORDER_INCOMPLETE = {
+    "success": False,
+    "reply": "❌ Thông tin đơn hàng không đầy đủ"
+}
 
 
 def confirm_order(order_info):
@@ -126,101 +176,135 @@ def confirm_order(order_info):
         order_info: Thông tin đơn hàng
     
     Returns:
-        dict: {success: bool, reply: str}
+        dict: {success: bool, reply: str, order_id, pending: True nếu đơn chưa ghi xong}
     """
     try:
-        # Validate order data
-        if not all(key in order_info for key in ['name', 'phone', 'service', 'time', 'price']):
-            return {
-                "success": False,
-                "reply": "❌ Thông tin đơn hàng không đầy đủ"
-            }
+        if _missing_order_fields(order_info):
+            return dict(ORDER_INCOMPLETE)
 
         # Save order to file
-        save_order_to_file(order_info)
+        order_id = save_order_to_file(order_info)
+        return _order_confirmed(order_info, order_id)
 
-        return {
-            "success": True,
-            "reply": f"✅ Cảm ơn {order_info.get('name')}! Đơn hàng đã được xác nhận. Chúng tôi sẽ liên hệ với bạn sớm!"
-        }
+    except OrderCommitPending as e:
+        return _order_pending(order_info, e)
 
     except Exception as e:
-        print(f"Lỗi xác nhận đơn hàng: {e}")
-        return {
-            "success": False,
-            "reply": f"❌ Có lỗi xảy ra: {str(e)}"
-        }
+        return _order_failed(e)
 
 
-def get_all_orders():
+async def aconfirm_order(order_info):
     """
-    Lấy danh sách tất cả đơn hàng
+    Như confirm_order nhưng chờ ghi đơn bằng await
+    
+    Args:
+        order_info: Thông tin đơn hàng
     
     Returns:
-        dict: {orders: [list of orders]}
+        dict: {success: bool, reply: str, order_id, pending: True nếu đơn chưa ghi xong}
     """
     try:
-        if not os.path.exists(ORDER_FILE):
-            return {"orders": []}
+        if _missing_order_fields(order_info):
+            return dict(ORDER_INCOMPLETE)
+
+        order_id = await asave_order_to_file(order_info)
+        return _order_confirmed(order_info, order_id)
 
-        with open(ORDER_FILE, "r", encoding="utf-8") as f:
-            orders = json.load(f)
+    except OrderCommitPending as e:
+        return _order_pending(order_info, e)
 
-        return {"orders": orders}
+    except Exception as e:
+        return _order_failed(e)
+
+
+def get_all_orders(limit: int = None, cursor: str = None, date_from: str = None, date_to: str = None,
+                   phone: str = None, service: str = None, newest_first: bool = False):
+    """
+    Lấy danh sách đơn hàng (có phân trang bằng cursor và bộ lọc)
+    
+    Args:
+        limit: Số đơn tối đa mỗi trang (None = lấy hết)
+        cursor: Cursor trang trước trả về (next_cursor)
+        date_from: Từ ngày "YYYY-MM-DD"
+        date_to: Đến ngày "YYYY-MM-DD"
+        phone: SĐT khách
+        service: Mã dịch vụ ("spa") hoặc mã gói ("spa_1")
+        newest_first: Sắp xếp đơn mới nhất lên đầu
+    
+    Returns:
+        dict: {orders: [list of orders], next_cursor: str|None}
+    
+    Raises:
+        ValueError: Cursor không hợp lệ
+    """
+    try:
+        rows = get_order_store().query(
+            date_from=date_from,
+            date_to=date_to,
+            phone=phone,
+            service=service,
+            cursor=cursor,
+            newest_first=newest_first
+        )
+
+        orders = []
+        next_cursor = None
+        for row_cursor, order in rows:
+            if limit is not None and len(orders) >= limit:
+                break
+            orders.append(order)
+            next_cursor = row_cursor
+        else:
+            # Đã duyệt hết, không còn trang sau
+            next_cursor = None
+
+        return {"orders": orders, "next_cursor": next_cursor}
+    except ValueError:
+        # Cursor hỏng là lỗi của request, không phải "hết đơn"
+        raise
     except Exception as e:
         print(f"Lỗi lấy đơn hàng: {e}")
-        return {"orders": []}
+        return {"orders": [], "next_cursor": None}
+
+
+def stream_orders(date_from: str = None, date_to: str = None, phone: str = None,
+                  service: str = None, newest_first: bool = False):
+    """
+    Xuất đơn hàng dạng NDJSON (mỗi dòng một đơn), đọc dần từ store
+    
+    Args:
+        date_from, date_to, phone, service, newest_first: Như get_all_orders
+    
+    Returns:
+        generator: các dòng JSON kết thúc bằng "\n"
+    """
+    rows = get_order_store().query(
+        date_from=date_from,
+        date_to=date_to,
+        phone=phone,
+        service=service,
+        newest_first=newest_first
+    )
+    for _, order in rows:
+        yield json.dumps(order, ensure_ascii=False) + "\n"
 
 
-def get_stats():
+def get_stats(include_orders: bool = False):
     """
     Lấy thống kê: tổng đơn, tổng doanh thu, đơn hôm nay
     
+    Args:
+        include_orders: Có kèm toàn bộ danh sách đơn hàng hay không (đọc cả lịch sử; danh sách đơn
+            nên lấy theo trang qua get_all_orders)
+    
     Returns:
         dict: {total_orders, total_revenue, today_orders, today_revenue, orders}
     """
     try:
-        if not os.path.exists(ORDER_FILE):
-            return {
-                "total_orders": 0,
-                "total_revenue": 0,
-                "today_orders": 0,
-                "today_revenue": 0,
-                "orders": []
-            }
-
-        with open(ORDER_FILE, "r", encoding="utf-8") as f:
-            orders = json.load(f)
-
-        # Tính toán thống kê
-        total_orders = len(orders)
-        total_revenue = 0
-        today_orders = 0
-        today_revenue = 0
-        today_date = datetime.now().strftime("%Y-%m-%d")
-
-        for order in orders:
-            # Tính doanh thu tổng
-            price_str = order.get("price", "0").replace("k", "").replace("K", "").strip()
-            try:
-                price = float(price_str) * 1000
-            except:
-                price = 0
-            total_revenue += price
-
-            # Tính đơn hôm nay
-            created_at = order.get("created_at", "")
-            if created_at.startswith(today_date):
-                today_orders += 1
-                today_revenue += price
-
-        return {
-            "total_orders": total_orders,
-            "total_revenue": int(total_revenue),
-            "today_orders": today_orders,
-            "today_revenue": int(today_revenue),
-            "orders": orders
-        }
+        # Bộ đếm được cập nhật khi ghi đơn, không cần đọc lại lịch sử
+        stats = get_order_stats().snapshot()
+        stats["orders"] = get_order_store().load_orders() if include_orders else []
+        return stats
     except Exception as e:
         print(f"Lỗi tính thống kê: {e}")
         return {
@@ -230,3 +314,58 @@ def get_stats():
             "today_revenue": 0,
             "orders": []
         }
+
+
+def get_stats_timeseries(bucket: str = "day", group_by: str = "none", date_from: str = None, date_to: str = None):
+    """
+    Lấy doanh thu / số đơn theo giờ, ngày hoặc tuần (có thể tách theo dịch vụ)
+    
+    Args:
+        bucket: "hour" | "day" | "week"
+        group_by: "none" | "service" | "sub_service"
+        date_from: Từ ngày "YYYY-MM-DD" (mặc định 30 ngày trước)
+        date_to: Đến ngày "YYYY-MM-DD" (mặc định hôm nay)
+    
+    Returns:
+        dict: {bucket, group_by, series: [{bucket, group, orders, revenue}]}
+    
+    Raises:
+        ValueError: bucket / group_by / ngày không hợp lệ
+    """
+    series = get_order_timeseries().query(bucket, group_by, date_from, date_to)
+    return {"bucket": bucket, "group_by": group_by, "series": series}
+
+
+def get_monthly_stats():
+    """
+    Lấy thống kê theo tháng (với ORDER_STORE=segments, tháng đã đóng đọc từ summary)
+    
+    Returns:
+        dict: {months: [{month, orders, revenue, services}]}
+    """
+    try:
+        summaries = get_order_store().monthly_summaries()
+        return {
+            "months": [
+                {
+                    "month": month,
+                    "orders": summary["orders"],
+                    "revenue": summary["revenue"],
+                    "services": summary["services"]
+                }
+                for month, summary in summaries.items()
+            ]
+        }
+    except Exception as e:
+        print(f"Lỗi tính thống kê theo tháng: {e}")
+        return {"months": []}
+
+
+def get_notification_status():
+    """
+    Tình trạng hàng đợi email thông báo đơn hàng (độ dài hàng đợi, độ trễ gửi)
+    
+    Returns:
+        dict: xem NotificationOutbox.status
+    """
+    return get_notifier().status()
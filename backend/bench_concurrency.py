@@ -0,0 +1,171 @@
+"""
+Đo số chat đồng thời một worker chịu được: endpoint đồng bộ (trước) và async (sau)
+
+Groq được thay bằng một server giả lập cục bộ trả lời sau --llm-ms mili giây,
+nên đo được đúng phần server (threadpool / event loop / pool kết nối) mà không
+tốn quota. Trong lúc chat chạy, script gọi /api/services liên tục để xem các
+endpoint nhẹ có bị xếp hàng sau chat hay không.
+
+Cách dùng:
+    python bench_concurrency.py
+    python bench_concurrency.py --levels 20,50,100,200 --llm-ms 800
+    GROQ_MAX_CONNECTIONS=50 GROQ_MAX_KEEPALIVE=50 python bench_concurrency.py   # thử cấu hình pool khác
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import argparse
+import itertools
+import multiprocessing
+
+FAKE_GROQ_PORT = 18900
+APP_PORT = 18901
+
+# Mỗi tin nhắn một khác để cache cảm xúc không che mất lời gọi Groq
+_message_ids = itertools.count()
+
+os.environ.setdefault("GROQ_API_KEY", "bench")
+os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{FAKE_GROQ_PORT}"
+# Server giả lập không giới hạn tốc độ: bỏ hạn mức phía client để đo đúng phần server
+os.environ.setdefault("GROQ_RPM", "1000000")
+os.environ.setdefault("GROQ_TPM", "1000000000")
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+# Chạy trong thư mục tạm để không đụng vào dữ liệu đơn hàng thật
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="bench-concurrency-"))
+
+import ai_logic
+import main
+from api_data import get_services
+
+
+def fake_groq_app(llm_ms: float):
+    """Server giả lập endpoint chat completions của Groq"""
+    app = FastAPI()
+
+    @app.post("/openai/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(llm_ms / 1000)
+        content = "neutral" if body.get("max_tokens") == 20 else "Dạ Mimi chào anh/chị ạ!"
+        return {
+            "id": "bench", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    return app
+
+
+def sync_app():
+    """Bản endpoint đồng bộ như trước: mỗi chat giữ một thread trong threadpool"""
+    app = FastAPI()
+
+    @app.get("/api/services")
+    def services():
+        return get_services()
+
+    @app.post("/api/chat")
+    def chat(data: main.ChatRequest):
+        return ai_logic.chat_with_ai(data.message, data.history, data.selected_services, previous_emotion=data.emotion)
+
+    return app
+
+
+def run_fake_groq(llm_ms: float):
+    """Chạy server giả lập ở process riêng để không tranh GIL với app được đo"""
+    uvicorn.run(fake_groq_app(llm_ms), host="127.0.0.1", port=FAKE_GROQ_PORT, log_level="warning")
+
+
+def run_app(name: str):
+    """Chạy app cần đo ở process riêng, tách khỏi bộ tạo tải"""
+    app = sync_app() if name == "sync" else main.app
+    uvicorn.run(app, host="127.0.0.1", port=APP_PORT, log_level="warning")
+
+
+def start(target, args, port: int):
+    """Khởi động process server và chờ tới khi nhận kết nối"""
+    process = multiprocessing.Process(target=target, args=args, daemon=True)
+    process.start()
+    while True:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+
+async def load(concurrency: int):
+    """Gửi concurrency chat cùng lúc, đồng thời đo độ trễ /api/services"""
+    base = f"http://127.0.0.1:{APP_PORT}"
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base, timeout=120, limits=limits) as http:
+        done = asyncio.Event()
+        probe_latencies = []
+
+        async def one_chat():
+            body = {"message": f"ok shop {next(_message_ids)}", "history": [], "selected_services": []}
+            started = time.perf_counter()
+            response = await http.post("/api/chat", json=body)
+            response.raise_for_status()
+            return (time.perf_counter() - started) * 1000
+
+        async def probe():
+            while not done.is_set():
+                started = time.perf_counter()
+                await http.get("/api/services")
+                probe_latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(0.05)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(one_chat() for _ in range(concurrency))))
+        wall = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    probe_latencies.sort()
+    return {
+        "wall_s": wall,
+        "chats_per_s": concurrency / wall,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "services_p95_ms": probe_latencies[min(len(probe_latencies) - 1, int(0.95 * len(probe_latencies)))]
+        if probe_latencies else 0,
+    }
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="So sánh chat đồng thời: endpoint đồng bộ và async")
+    parser.add_argument("--levels", default="10,40,80,160", help="Các mức chat đồng thời, cách nhau bởi dấu phẩy")
+    parser.add_argument("--llm-ms", type=float, default=800, help="Độ trễ giả lập mỗi lời gọi Groq")
+    args = parser.parse_args()
+
+    # Không gửi email / không phụ thuộc cấu hình thật
+    os.environ.pop("EMAIL_GUI", None)
+
+    start(run_fake_groq, (args.llm_ms,), FAKE_GROQ_PORT)
+    levels = [int(level) for level in args.levels.split(",")]
+
+    print(f"Mỗi chat = 2 lời gọi Groq giả lập x {args.llm_ms:.0f} ms (cảm xúc + trả lời)")
+    print(f"{'app':<7}{'đồng thời':>10}{'giây':>8}{'chat/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'services p95':>14}")
+    for name in ("sync", "async"):
+        server = start(run_app, (name,), APP_PORT)
+        try:
+            for level in levels:
+                result = asyncio.run(load(level))
+                print(f"{name:<7}{level:>10}{result['wall_s']:>8.2f}{result['chats_per_s']:>9.1f}"
+                      f"{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}{result['services_p95_ms']:>14.0f}")
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,98 @@
+"""
+Đo độ trễ chat_with_ai theo từng EMOTION_MODE (sequential / parallel / inline)
+và tỉ lệ tin nhắn được phân loại cảm xúc tại chỗ (EMOTION_LOCAL_THRESHOLD)
+
+Cách dùng:
+    python bench_emotion_modes.py                 # gọi Groq thật (cần GROQ_API_KEY)
+    python bench_emotion_modes.py --simulate      # giả lập Groq bằng sleep, không tốn quota
+    python bench_emotion_modes.py --simulate --emotion-ms 400 --chat-ms 900 -n 30
+"""
+import os
+import time
+import types
+import argparse
+import statistics
+
+os.environ.setdefault("GROQ_API_KEY", "simulate")
+
+import ai_logic
+
+MESSAGES = [
+    "Chào shop, bé nhà mình hôm nay bỏ ăn, mình lo quá",
+    "Shop còn phòng VIP cho mèo cuối tuần này không?",
+    "Đặt lịch tắm mà chờ mãi chưa thấy ai gọi lại, bực ghê",
+    "Cảm ơn shop nhiều nha, bé cắt lông xong xinh lắm 😍",
+    "Giá gói Sạch Sẽ bao nhiêu vậy shop?",
+    "mình muốn gửi bé 3 ngày",
+    "be bi non tu sang, co sao khong shop",
+    "ok shop",
+]
+
+
+class _SimulatedCompletions:
+    """Thay client.chat.completions: ngủ theo độ trễ cấu hình rồi trả câu trả lời mẫu"""
+
+    def __init__(self, emotion_ms: float, chat_ms: float):
+        self.emotion_ms = emotion_ms
+        self.chat_ms = chat_ms
+
+    def create(self, messages, max_tokens=None, **kwargs):
+        # detect_emotion luôn gọi với max_tokens nhỏ
+        is_emotion = max_tokens is not None and max_tokens <= 20
+        time.sleep((self.emotion_ms if is_emotion else self.chat_ms) / 1000)
+        if is_emotion:
+            content = "neutral"
+        elif "||EMOTION:" in messages[0]["content"]:
+            content = "||EMOTION:happy||\nDạ Mimi chào anh/chị ạ!"
+        else:
+            content = "Dạ Mimi chào anh/chị ạ!"
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def run(mode: str, rounds: int):
+    """Chạy rounds lượt chat, trả về danh sách độ trễ (ms)"""
+    latencies = []
+    history = []
+    emotion = None
+    for i in range(rounds):
+        message = MESSAGES[i % len(MESSAGES)]
+        started = time.perf_counter()
+        result = ai_logic.chat_with_ai(message, history[-6:], previous_emotion=emotion, emotion_mode=mode)
+        latencies.append((time.perf_counter() - started) * 1000)
+        emotion = result.get("emotion")
+        history += [{"role": "user", "content": message}, {"role": "assistant", "content": result["reply"]}]
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh độ trễ các chế độ phát hiện cảm xúc")
+    parser.add_argument("-n", "--rounds", type=int, default=10, help="Số lượt chat mỗi chế độ")
+    parser.add_argument("--modes", default=",".join(ai_logic.EMOTION_MODES), help="Các chế độ cần đo, cách nhau bởi dấu phẩy")
+    parser.add_argument("--simulate", action="store_true", help="Giả lập Groq thay vì gọi thật")
+    parser.add_argument("--emotion-ms", type=float, default=350, help="Độ trễ giả lập của lượt phát hiện cảm xúc")
+    parser.add_argument("--chat-ms", type=float, default=900, help="Độ trễ giả lập của completion chính")
+    args = parser.parse_args()
+
+    if args.simulate:
+        ai_logic.client = types.SimpleNamespace(
+            chat=types.SimpleNamespace(completions=_SimulatedCompletions(args.emotion_ms, args.chat_ms))
+        )
+
+    print(f"{'mode':<12}{'mean':>10}{'p50':>10}{'p95':>10}{'max':>10}   (ms, {args.rounds} lượt)")
+    baseline = None
+    for mode in args.modes.split(","):
+        latencies = sorted(run(mode.strip(), args.rounds))
+        mean = statistics.mean(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        baseline = baseline or mean
+        print(f"{mode:<12}{mean:>10.0f}{p50:>10.0f}{p95:>10.0f}{latencies[-1]:>10.0f}   {mean / baseline:.2f}x")
+
+    metrics = ai_logic.get_emotion_metrics()
+    print(f"\nPhân loại cảm xúc tại chỗ: {metrics['local_hits']}/{metrics['messages']} tin nhắn "
+          f"(hit rate {metrics['hit_rate']}), tiết kiệm ~{metrics['saved_ms_per_message']} ms/tin nhắn")
+
+
+if __name__ == "__main__":
+    main()
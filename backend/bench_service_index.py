@@ -0,0 +1,114 @@
+"""
+Đo tỉ lệ tin nhắn xác nhận phải gọi LLM để tìm gói dịch vụ (không khớp tại chỗ):
+bộ so khớp cũ (duyệt SERVICES, phân biệt dấu) so với chỉ mục service_index
+
+Cách dùng:
+    python bench_service_index.py
+    python bench_service_index.py -n 2000    # số lần lặp để đo thời gian
+"""
+import time
+import argparse
+
+from shop_data import SERVICES
+from service_index import ServiceIndex
+
+# (tin nhắn, các gói khách thực sự nhắc tới). Gói rỗng = khách không nêu gói,
+# phải hỏi LLM / hỏi lại là đúng.
+CORPUS = [
+    ("chốt phòng vip nha shop", ["hotel_2"]),
+    ("chot phong vip 2 dem", ["hotel_2"]),
+    ("ok lấy phòng thường", ["hotel_1"]),
+    ("ok phong thuong 3 ngay nhe", ["hotel_1"]),
+    ("xác nhận phòng thg cho bé", ["hotel_1"]),
+    ("vâng cho bé ở vip", ["hotel_2"]),
+    ("chốt kiểu teddy bear", ["style_1"]),
+    ("ok cat teddy cho be", ["style_1"]),
+    ("được, cắt Teddy đi shop", ["style_1"]),
+    ("xác nhận kiểu nhật", ["style_2"]),
+    ("chot kieu nhat ban", ["style_2"]),
+    ("ok japanese style", ["style_2"]),
+    ("chốt summer cut", ["style_3"]),
+    ("ok summer cho mat", ["style_3"]),
+    ("xác nhận kiểu bờm sư tử", ["style_4"]),
+    ("chot bom su tu", ["style_4"]),
+    ("ok kiểu trái tim nha", ["style_5"]),
+    ("chot trai tim cho be", ["style_5"]),
+    ("chốt gói thơm tho", ["spa_1"]),
+    ("ok tam thom tho", ["spa_1"]),
+    ("xác nhận Sạch Sẽ (5kg-10kg)", ["spa_2"]),
+    ("chot goi sach se", ["spa_2"]),
+    ("ok siêu cấp cho bé 15kg", ["spa_3"]),
+    ("chot sieu cap", ["spa_3"]),
+    ("chốt thơm tho + teddy bear", ["spa_1", "style_1"]),
+    ("ok tam thom tho voi cat summer cut", ["spa_1", "style_3"]),
+    ("xác nhận phòng vip và gói sạch sẽ", ["hotel_2", "spa_2"]),
+    ("chot phong thuong, chu nhat dua be qua", ["hotel_1"]),
+    ("ok Thơm Tho (Dưới 5kg)", ["spa_1"]),
+    ("vâng kiểu Nhật (Japanese) ạ", ["style_2"]),
+    ("chốt Phòng VIP", ["hotel_2"]),
+    ("Phòng Thường nhé", ["hotel_1"]),
+    ("được ạ, gói Siêu Cấp", ["spa_3"]),
+    ("ok chốt", []),
+    ("vâng ạ", []),
+    ("được, chủ nhật mình qua", []),
+    ("ổn áp, xác nhận giúp mình", []),
+    ("chốt cái lúc nãy", []),
+    ("ok gói tắm rẻ nhất", []),
+    ("xác nhận dịch vụ khách sạn", []),
+]
+
+
+def legacy_match(message: str):
+    """Bộ so khớp trước đây: so tên gói viết thường trong tin nhắn, phân biệt dấu"""
+    message_lower = message.lower()
+    matched = []
+    for service_key, service_data in SERVICES.items():
+        for sub in service_data.get("sub_services", []):
+            service_name = sub["name"].lower()
+            if service_name in message_lower:
+                matched.append(sub["id"])
+                continue
+            service_keywords = [w for w in service_name.split() if len(w) > 2]
+            if service_keywords and all(keyword in message_lower for keyword in service_keywords):
+                matched.append(sub["id"])
+    return matched
+
+
+def evaluate(name: str, match, rounds: int):
+    resolved = correct = false_hits = 0
+    for message, expected in CORPUS:
+        found = match(message)
+        resolved += bool(found)
+        correct += sorted(found) == sorted(expected)
+        false_hits += bool(set(found) - set(expected))
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message, _ in CORPUS:
+            match(message)
+    per_message_us = (time.perf_counter() - started) / (rounds * len(CORPUS)) * 1e6
+
+    total = len(CORPUS)
+    print(f"{name:<10}{resolved:>6}/{total:<4}{1 - resolved / total:>12.0%}{correct:>9}/{total:<4}"
+          f"{false_hits:>8}{per_message_us:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh tỉ lệ phải gọi LLM khi tìm gói dịch vụ")
+    parser.add_argument("-n", "--rounds", type=int, default=500, help="Số lần lặp corpus để đo thời gian")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = ServiceIndex()
+    build_ms = (time.perf_counter() - started) * 1000
+
+    with_service = sum(1 for _, expected in CORPUS if expected)
+    print(f"{len(CORPUS)} tin nhắn xác nhận, {with_service} có nêu gói; dựng chỉ mục {build_ms:.2f} ms "
+          f"({len(index.patterns)} cụm)")
+    print(f"{'matcher':<10}{'khớp':>11}{'gọi LLM':>12}{'đúng':>14}{'sai gói':>8}{'µs/tin':>12}")
+    evaluate("cũ", legacy_match, args.rounds)
+    evaluate("index", lambda message: [sub["sub_id"] for sub in index.match(message)], args.rounds)
+
+
+if __name__ == "__main__":
+    main()
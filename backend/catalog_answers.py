@@ -0,0 +1,257 @@
+import os
+import time
+import threading
+from text_utils import fold_vietnamese, tokenize
+from shop_data import SERVICES
+from service_index import get_service_index
+
+# Bật/tắt trả lời bảng giá/mô tả gói từ danh mục (không gọi LLM)
+CATALOG_ANSWERS = os.getenv("CATALOG_ANSWERS", "1") != "0"
+# Tin nhắn dài hơn chừng này từ không phải câu hỏi tra cứu đơn thuần, để LLM trả lời
+CATALOG_MAX_WORDS = int(os.getenv("CATALOG_MAX_WORDS", "14"))
+
+# Cách khách gọi từng nhóm dịch vụ (ngoài tên nhóm trong SERVICES)
+CATEGORY_ALIASES = {
+    "spa": ["spa", "tắm", "tắm rửa", "tắm spa", "gói tắm", "dịch vụ tắm"],
+    "styling": ["cắt", "cắt tỉa", "cắt lông", "tỉa lông", "tạo kiểu", "cắt tạo kiểu", "kiểu cắt", "grooming"],
+    "hotel": ["khách sạn", "ks", "lưu trú", "gửi bé", "trông bé", "phòng", "hotel"],
+}
+
+# Cụm hỏi giá / hỏi danh sách / hỏi chi tiết
+_PRICE_PHRASES = [
+    "giá", "giá cả", "giá tiền", "bao nhiêu", "bao nhiêu tiền", "bn", "nhiêu", "nhiêu tiền", "mấy tiền",
+    "chi phí", "phí", "hết bao nhiêu", "tính sao", "price",
+]
+_MENU_PHRASES = [
+    "bảng giá", "menu", "bảng dịch vụ", "price list", "các gói", "những gói", "có những", "gói nào", "kiểu nào",
+    "loại nào", "mấy loại", "mấy gói", "mấy kiểu", "những kiểu", "dịch vụ gì", "dịch vụ nào", "các dịch vụ", "những dịch vụ",
+]
+_DETAIL_PHRASES = [
+    "có gì", "gồm gì", "gồm những gì", "bao gồm", "có những gì", "như thế nào", "thế nào", "ra sao",
+    "chi tiết", "là gì", "khác gì", "có gì hay", "có gì tốt", "được gì", "làm gì",
+]
+# Từ đệm không đổi ý câu hỏi. Từ nào ngoài danh sách này và các cụm trên
+# (vd. cân nặng, giờ hẹn, "chốt") đều chuyển câu hỏi sang LLM.
+_FILLER_PHRASES = [
+    "cho", "mình", "tôi", "tui", "hỏi", "xin", "admin", "vs", "với", "là", "của", "bên", "mik", "mk", "xem",
+    "được", "đc", "hiện tại", "hiện", "gói", "kiểu", "dịch vụ", "dv", "các", "những", "nào", "loại", "mấy",
+    "một", "thì", "sao", "ở", "đây", "đó", "ấy", "luôn", "và", "hay", "hoặc", "bé", "cún", "mèo",
+    "thú cưng", "pet", "muốn", "biết", "tham khảo", "có", "đang", "nay", "giúp", "hello", "hi", "chào",
+    "cho hỏi", "dạ", "vâng", "nhờ", "cần", "tư vấn", "của shop",
+    # giá phòng theo ngày: "phòng vip bao nhiêu 1 ngày" (số ngày khác thì để LLM tính)
+    "ngày", "đêm", "1 ngày", "một ngày", "1 đêm", "một đêm", "mỗi ngày", "lần", "1 lần", "một lần",
+]
+# Từ đệm cuối câu / lời gọi, được phép đứng sau "không" ("giá spa bao nhiêu không ạ")
+_PARTICLE_PHRASES = [
+    "ạ", "a", "ạh", "nhé", "nha", "nhỉ", "vậy", "thế", "vầy", "hả", "hở", "ơi", "shop", "shop ơi", "ad",
+    "em", "e", "anh", "chị", "bạn",
+]
+# "không/ko/k" cuối câu là từ hỏi; giữa câu là phủ định ("không muốn tắm, giá phòng bao nhiêu")
+# mà mẫu trả lời không hiểu được, nên chuyển cho LLM
+_NEGATION_PHRASES = ["không", "ko", "k", "hông", "hok", "kg"]
+
+
+def _phrase(text: str):
+    return tuple(tokenize(fold_vietnamese(text)))
+
+
+class CatalogAnswers:
+    """
+    Trả lời câu hỏi tra cứu bảng giá / nội dung gói ("bảng giá spa", "giá cắt
+    teddy", "khách sạn VIP có gì") bằng mẫu dựng từ SERVICES, không gọi LLM.
+
+    Tin nhắn được tách thành các cụm đã biết (tên gói lấy từ service_index,
+    nhóm dịch vụ, cụm hỏi giá/chi tiết, từ đệm), ưu tiên cụm dài nhất. Chỉ
+    trả lời khi mọi từ đều thuộc các cụm đó; còn lại (đặt lịch, cân nặng,
+    phàn nàn...) để LLM xử lý.
+    """
+
+    def __init__(self, services: dict = None, service_patterns: dict = None):
+        self.services = SERVICES if services is None else services
+        if service_patterns is None:
+            service_patterns = get_service_index().patterns
+
+        self.subs = {}
+        for service_key, service_data in self.services.items():
+            for sub in service_data.get("sub_services", []):
+                self.subs[sub["id"]] = dict(sub, service_key=service_key)
+
+        # Cụm sau ghi đè cụm trước: tên gói > nhóm dịch vụ > cụm hỏi > từ đệm
+        self.vocabulary = {}
+        for kind, phrases in (("filler", _FILLER_PHRASES), ("particle", _PARTICLE_PHRASES),
+                              ("negation", _NEGATION_PHRASES)):
+            for text in phrases:
+                self.vocabulary[_phrase(text)] = (kind, None)
+        for kind, phrases in (("price", _PRICE_PHRASES), ("menu", _MENU_PHRASES), ("detail", _DETAIL_PHRASES)):
+            for text in phrases:
+                self.vocabulary[_phrase(text)] = (kind, None)
+        for service_key, service_data in self.services.items():
+            for text in [service_data["name"]] + CATEGORY_ALIASES.get(service_key, []):
+                self.vocabulary[_phrase(text)] = ("category", service_key)
+        for phrase, sub_id in service_patterns.items():
+            if sub_id in self.subs:
+                self.vocabulary[phrase] = ("sub", sub_id)
+        self.vocabulary.pop((), None)
+        self._longest = max(len(phrase) for phrase in self.vocabulary)
+
+    def parse(self, message: str):
+        """
+        Tách tin nhắn thành các cụm đã biết
+
+        Returns:
+            list: [(loại, giá trị)] hoặc None nếu có từ lạ / phủ định giữa câu / tin nhắn quá dài
+        """
+        tokens = tokenize(fold_vietnamese(message))
+        if not tokens or len(tokens) > CATALOG_MAX_WORDS:
+            return None
+
+        parts = []
+        position = 0
+        while position < len(tokens):
+            for length in range(min(self._longest, len(tokens) - position), 0, -1):
+                found = self.vocabulary.get(tuple(tokens[position:position + length]))
+                if found is not None:
+                    parts.append(found)
+                    position += length
+                    break
+            else:
+                return None
+
+        for index, (kind, _) in enumerate(parts):
+            if kind == "negation" and any(after != "particle" for after, _ in parts[index + 1:]):
+                return None
+        return parts
+
+    def answer(self, message: str, first_turn: bool = True):
+        """
+        Câu trả lời từ danh mục nếu tin nhắn chỉ là câu hỏi tra cứu
+
+        Args:
+            message: Tin nhắn của khách
+            first_turn: Khách chưa nhắn gì trước đó. Giữa hội thoại, "giá bao nhiêu"
+                không nêu gói thường hỏi về gói đang bàn nên để LLM trả lời.
+
+        Returns:
+            tuple: (intent, câu trả lời) hoặc None nếu cần LLM.
+                   intent là "menu" | "category" | "price" | "detail"
+        """
+        parts = self.parse(message)
+        if not parts:
+            return None
+
+        kinds = {kind for kind, _ in parts}
+        sub_ids = list(dict.fromkeys(value for kind, value in parts if kind == "sub"))
+        categories = list(dict.fromkeys(value for kind, value in parts if kind == "category"))
+
+        if sub_ids:
+            if "detail" in kinds:
+                return "detail", self._detail_reply(sub_ids)
+            if kinds & {"price", "menu"}:
+                return "price", self._price_reply(sub_ids)
+            return None
+        if categories:
+            if kinds & {"price", "menu", "detail"}:
+                return "category", self._category_reply(categories)
+            return None
+        if "menu" in kinds or ("price" in kinds and first_turn):
+            return "menu", self._menu_reply()
+        return None
+
+    def _lines(self, service_key: str):
+        return [f"- {sub['name']}: {sub['price']}" for sub in self.services[service_key].get("sub_services", [])]
+
+    def _menu_reply(self):
+        blocks = []
+        for service_key, service_data in self.services.items():
+            blocks.append("\n".join([f"{service_data['icon']} {service_data['name']}:"] + self._lines(service_key)))
+        return ("Dạ bảng giá bên em đây ạ 🐾\n\n" + "\n\n".join(blocks)
+                + "\n\nBé nhà mình muốn dùng dịch vụ nào ạ?")
+
+    def _category_reply(self, categories: list):
+        blocks = []
+        for service_key in categories:
+            service_data = self.services[service_key]
+            blocks.append("\n".join([f"{service_data['icon']} {service_data['name']}:"] + self._lines(service_key)))
+        return "Dạ bên em có các gói sau ạ:\n\n" + "\n\n".join(blocks) + "\n\nBé nhà mình muốn chọn gói nào ạ?"
+
+    def _price_reply(self, sub_ids: list):
+        lines = [f"- {self.subs[sub_id]['name']}: {self.subs[sub_id]['price']}" for sub_id in sub_ids]
+        return "Dạ giá bên em ạ:\n" + "\n".join(lines) + "\n\nBé có muốn chọn gói này không ạ?"
+
+    def _detail_reply(self, sub_ids: list):
+        blocks = [
+            f"✨ {self.subs[sub_id]['name']} ({self.subs[sub_id]['price']}): {self.subs[sub_id]['description']}"
+            for sub_id in sub_ids
+        ]
+        return "Dạ " + "\n\n".join(blocks) + "\n\nBé có muốn chọn gói này không ạ?"
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+_metrics_lock = threading.Lock()
+_metrics = {"messages": 0, "answered": 0, "answer_us": 0.0, "menu": 0, "category": 0, "price": 0, "detail": 0}
+
+
+def get_catalog_answers():
+    """
+    Lấy bộ trả lời từ danh mục (dựng ở lần gọi đầu)
+
+    Returns:
+        CatalogAnswers
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = CatalogAnswers()
+    return _catalog
+
+
+def answer_from_catalog(message: str, history: list):
+    """
+    Trả lời ngay từ danh mục nếu tin nhắn chỉ hỏi bảng giá / nội dung gói
+
+    Args:
+        message: Tin nhắn từ người dùng
+        history: Lịch sử chat
+
+    Returns:
+        str: Câu trả lời, hoặc None nếu cần gọi LLM
+    """
+    if not CATALOG_ANSWERS:
+        return None
+
+    started = time.perf_counter()
+    first_turn = not any(msg.get("role") == "user" for msg in history or [])
+    found = get_catalog_answers().answer(message, first_turn)
+    elapsed_us = (time.perf_counter() - started) * 1e6
+
+    with _metrics_lock:
+        _metrics["messages"] += 1
+        _metrics["answer_us"] += elapsed_us
+        if found:
+            _metrics["answered"] += 1
+            _metrics[found[0]] += 1
+    return found[1] if found else None
+
+
+def get_catalog_answer_metrics():
+    """
+    Tỉ lệ tin nhắn chat được trả lời từ danh mục (không gọi LLM)
+
+    Returns:
+        dict: {enabled, messages, answered, llm, local_share, avg_us, by_intent}
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    total = metrics["messages"]
+    return {
+        "enabled": CATALOG_ANSWERS,
+        "messages": total,
+        "answered": metrics["answered"],
+        "llm": total - metrics["answered"],
+        "local_share": round(metrics["answered"] / total, 3) if total else None,
+        "avg_us": round(metrics["answer_us"] / total, 1) if total else None,
+        "by_intent": {intent: metrics[intent] for intent in ("menu", "category", "price", "detail")},
+    }
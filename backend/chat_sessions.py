@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import time
+import secrets
+import threading
+from collections import OrderedDict
+
+# Số phiên giữ trong RAM; phiên ít dùng nhất bị chuyển xuống đĩa (nếu bật) khi vượt
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "2000"))
+# Phiên không có lượt chat mới sau chừng này giây thì hết hạn
+CHAT_SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "7200"))
+# Thư mục lưu phiên bị đẩy khỏi RAM; để rỗng để tắt (phiên bị đẩy ra sẽ mất)
+CHAT_SESSION_DIR = os.getenv("CHAT_SESSION_DIR", "chat_sessions")
+# Giới hạn số message giữ trong một phiên (bỏ message cũ nhất khi vượt)
+CHAT_SESSION_MAX_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "400"))
+# Khoảng thời gian tối thiểu giữa hai lần dọn phiên hết hạn (giây)
+CHAT_SESSION_SWEEP_INTERVAL = 60
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _clean_messages(messages: list):
+    """Chỉ giữ role/content của các message hợp lệ (giống dữ liệu frontend gửi lên)"""
+    return [
+        {"role": m["role"], "content": m["content"]}
+        for m in messages or []
+        if isinstance(m, dict) and m.get("role") and m.get("content")
+    ]
+
+
+class ChatSession:
+    """Trạng thái hội thoại của một khách: lịch sử và cảm xúc lượt trước"""
+
+    __slots__ = ("id", "history", "emotion", "updated")
+
+    def __init__(self, session_id: str, history: list = None, emotion: str = None, updated: float = None):
+        self.id = session_id
+        self.history = history or []
+        self.emotion = emotion
+        self.updated = updated or time.time()
+
+    def expired(self, now: float, ttl: float) -> bool:
+        return now - self.updated > ttl
+
+    def to_dict(self):
+        return {"id": self.id, "history": self.history, "emotion": self.emotion, "updated": self.updated}
+
+
+class ChatSessionStore:
+    """
+    Lưu lịch sử chat phía server theo session id, để client chỉ gửi tin nhắn mới.
+
+    Phiên nằm trong một LRU giới hạn CHAT_SESSION_MAX. Phiên bị đẩy ra (và
+    toàn bộ phiên khi tắt server) được ghi thành file JSON trong
+    CHAT_SESSION_DIR, lần truy cập sau nạp lại vào RAM. Phiên quá
+    CHAT_SESSION_TTL giây không hoạt động bị xóa cả trong RAM lẫn trên đĩa.
+    """
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX, ttl: float = CHAT_SESSION_TTL,
+                 spill_dir: str = CHAT_SESSION_DIR):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.spill_dir = spill_dir or None
+        self._lock = threading.Lock()
+        # session id -> ChatSession, thứ tự từ cũ tới mới dùng
+        self._sessions = OrderedDict()
+        self._last_sweep = 0.0
+        self._stats = {"created": 0, "expired": 0, "spilled": 0, "loaded": 0, "dropped": 0}
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self.sweep()
+
+    def create(self, history: list = None):
+        """
+        Tạo phiên mới
+
+        Args:
+            history: Lịch sử có sẵn (client cũ gửi cả lịch sử)
+
+        Returns:
+            ChatSession
+        """
+        session = ChatSession(secrets.token_hex(16), _clean_messages(history)[-CHAT_SESSION_MAX_MESSAGES:])
+        with self._lock:
+            self._sessions[session.id] = session
+            self._stats["created"] += 1
+            evicted = self._evict_locked()
+        self._spill_all(evicted)
+        self._maybe_sweep()
+        return session
+
+    def get(self, session_id: str):
+        """
+        Lấy phiên còn hạn (nạp lại từ đĩa nếu đã bị đẩy khỏi RAM)
+
+        Returns:
+            ChatSession hoặc None nếu không tồn tại / đã hết hạn
+        """
+        if not session_id or not _SESSION_ID.match(session_id):
+            return None
+
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                if not session.expired(now, self.ttl):
+                    self._sessions.move_to_end(session_id)
+                    return session
+                del self._sessions[session_id]
+                self._stats["expired"] += 1
+                return None
+
+        session = self._load(session_id)
+        if session is None:
+            return None
+        if session.expired(now, self.ttl):
+            with self._lock:
+                self._stats["expired"] += 1
+            return None
+
+        with self._lock:
+            # Request khác có thể đã nạp phiên này trong lúc đọc file
+            current = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            self._stats["loaded"] += 1 if current is session else 0
+            evicted = self._evict_locked()
+        self._spill_all(evicted)
+        return current
+
+    def snapshot(self, session: ChatSession):
+        """
+        Returns:
+            tuple: (bản sao lịch sử, cảm xúc lượt trước)
+        """
+        with self._lock:
+            return list(session.history), session.emotion
+
+    def record(self, session: ChatSession, client_messages: list, message: str, reply: str, emotion: str = None):
+        """
+        Ghi một lượt chat vào phiên
+
+        Args:
+            session: Phiên
+            client_messages: Các tin chỉ có ở client từ sau lượt trước (ghi trước tin nhắn mới)
+            message: Tin nhắn của khách
+            reply: Câu trả lời hiển thị cho khách
+            emotion: Cảm xúc của lượt này
+        """
+        turn = _clean_messages(client_messages) + _clean_messages([
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": reply},
+        ])
+        with self._lock:
+            session.history.extend(turn)
+            if len(session.history) > CHAT_SESSION_MAX_MESSAGES:
+                del session.history[:len(session.history) - CHAT_SESSION_MAX_MESSAGES]
+            session.emotion = emotion or session.emotion
+            session.updated = time.time()
+            if session.id in self._sessions:
+                self._sessions.move_to_end(session.id)
+            else:
+                # Phiên đã bị đẩy khỏi RAM giữa lúc trả lời: đưa lại vào
+                self._sessions[session.id] = session
+            evicted = self._evict_locked()
+        self._spill_all(evicted)
+
+    def _evict_locked(self):
+        evicted = []
+        while len(self._sessions) > self.max_sessions:
+            _, session = self._sessions.popitem(last=False)
+            evicted.append(session)
+        return evicted
+
+    def _path(self, session_id: str):
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _spill_all(self, sessions: list):
+        """Ghi các phiên bị đẩy khỏi RAM xuống đĩa (hoặc bỏ nếu tắt spill)"""
+        for session in sessions:
+            if self.spill_dir is None:
+                with self._lock:
+                    self._stats["dropped"] += 1
+                continue
+            with self._lock:
+                data = session.to_dict()
+                data["history"] = list(data["history"])
+            path = self._path(session.id)
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(path + ".tmp", path)
+                with self._lock:
+                    self._stats["spilled"] += 1
+            except OSError as e:
+                print(f"⚠️  Không ghi được phiên chat {session.id}: {e}")
+
+    def _load(self, session_id: str):
+        """Đọc phiên đã bị đẩy xuống đĩa (file bị xóa, RAM là bản chính từ đây)"""
+        if self.spill_dir is None:
+            return None
+        path = self._path(session_id)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.remove(path)
+        except (OSError, ValueError):
+            return None
+        return ChatSession(data["id"], data.get("history") or [], data.get("emotion"), data.get("updated"))
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep >= CHAT_SESSION_SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.sweep()
+
+    def sweep(self):
+        """Xóa các phiên hết hạn trong RAM và trên đĩa"""
+        now = time.time()
+        with self._lock:
+            # Phiên dùng lâu nhất nằm đầu LRU
+            while self._sessions:
+                session = next(iter(self._sessions.values()))
+                if not session.expired(now, self.ttl):
+                    break
+                self._sessions.popitem(last=False)
+                self._stats["expired"] += 1
+
+        if self.spill_dir is None:
+            return
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    with self._lock:
+                        self._stats["expired"] += 1
+            except OSError:
+                pass
+
+    def close(self):
+        """Ghi toàn bộ phiên trong RAM xuống đĩa (gọi khi tắt server)"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        if self.spill_dir is not None:
+            self._spill_all(sessions)
+
+    def stats(self):
+        """
+        Returns:
+            dict: {active, max_sessions, ttl, spill_dir, on_disk, created, expired, spilled, loaded, dropped}
+        """
+        with self._lock:
+            stats = dict(self._stats, active=len(self._sessions))
+        on_disk = len([n for n in os.listdir(self.spill_dir) if n.endswith(".json")]) if self.spill_dir else 0
+        return dict(stats, max_sessions=self.max_sessions, ttl=self.ttl, spill_dir=self.spill_dir, on_disk=on_disk)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chat_sessions():
+    """
+    Lấy kho phiên chat dùng chung cho cả process
+
+    Returns:
+        ChatSessionStore
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatSessionStore()
+    return _store
+
+
+def stop_chat_sessions():
+    """Ghi các phiên đang mở xuống đĩa (gọi khi tắt server)"""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+
+# Số lần lỗi liên tiếp thì ngắt mạch (ngừng gọi model đó)
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+# Thời gian ngắt trước khi cho một request thử (half-open), giây
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Mạch đang ngắt: không gọi provider, báo lỗi ngay"""
+
+
+class CallDeadlineExceeded(Exception):
+    """Lời gọi Groq không xong trước deadline"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho lời gọi tới một model.
+
+    - closed: gọi bình thường; CIRCUIT_FAILURES lỗi liên tiếp (timeout, lỗi
+      mạng, 5xx) thì chuyển sang open.
+    - open: mọi lời gọi bị từ chối ngay bằng CircuitOpenError trong
+      CIRCUIT_RESET_SECONDS giây, không dội thêm request vào provider đang lỗi.
+    - half_open: hết thời gian chờ thì cho đúng một request thử; thành công
+      thì đóng mạch, lỗi thì ngắt tiếp.
+    """
+
+    def __init__(self, name: str, failures: int = CIRCUIT_FAILURES, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0, "probes": 0}
+
+    def allow(self) -> bool:
+        """
+        Xin phép gọi provider
+
+        Returns:
+            bool: True nếu đây là request thử của trạng thái half-open (truyền lại cho record)
+
+        Raises:
+            CircuitOpenError: Mạch đang ngắt, hoặc đang có request thử (half-open)
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._state = HALF_OPEN
+            probe = self._state == HALF_OPEN and not self._probing
+            if probe:
+                self._probing = True
+                self._stats["probes"] += 1
+            elif self._state != CLOSED:
+                self._stats["rejected"] += 1
+                retry_in = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+                raise CircuitOpenError(f"{self.name}: mạch đang ngắt, thử lại sau {retry_in:.0f}s")
+            self._stats["calls"] += 1
+            return probe
+
+    def record(self, ok, probe: bool = False):
+        """
+        Ghi kết quả lời gọi đã được allow()
+
+        Args:
+            ok: True nếu provider trả lời (kể cả lỗi 4xx), False nếu timeout / lỗi mạng / 5xx,
+                None nếu không tính (request bị hủy, 429 đã do rate limiter xử lý)
+            probe: Giá trị allow() trả về cho lời gọi này
+        """
+        with self._lock:
+            if probe:
+                self._probing = False
+            if ok is None:
+                return
+            if ok:
+                self._consecutive = 0
+                self._state = CLOSED
+                return
+            self._stats["failures"] += 1
+            self._consecutive += 1
+            if probe or self._consecutive >= self.failures:
+                if self._state != OPEN:
+                    self._stats["opened"] += 1
+                    print(f"⚠️  Ngắt mạch {self.name} sau {self._consecutive} lỗi liên tiếp")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        """
+        Returns:
+            dict: {state, consecutive_failures, calls, failures, rejected, opened, probes}
+        """
+        with self._lock:
+            state = self._state
+            if state == OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                state = HALF_OPEN
+            return dict(self._stats, state=state, consecutive_failures=self._consecutive)
@@ -0,0 +1,54 @@
+"""
+Chuyển lịch sử đơn hàng (orders.json hoặc orders.jsonl) sang dạng segment tháng
+
+Cách dùng:
+    python compact_orders.py orders.json --out orders
+    ORDER_STORE=segments uvicorn main:app ...
+"""
+import os
+import json
+import argparse
+from order_store import SegmentedOrderStore, write_segments
+
+
+def read_orders(path: str):
+    """
+    Đọc đơn hàng từ file JSON (một mảng) hoặc JSONL (mỗi dòng một đơn)
+
+    Args:
+        path: Đường dẫn file nguồn
+
+    Returns:
+        generator: các dict đơn hàng
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"⚠️  Bỏ qua dòng hỏng {line_no} trong {path}")
+        else:
+            yield from json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chia lịch sử đơn hàng thành segment theo tháng")
+    parser.add_argument("source", help="orders.json hoặc orders.jsonl")
+    parser.add_argument("--out", default=os.getenv("ORDER_SEGMENT_DIR", "orders"), help="Thư mục segment đích")
+    args = parser.parse_args()
+
+    counts = write_segments(read_orders(args.source), args.out)
+    for month, count in sorted(counts.items()):
+        print(f"{month}: {count} đơn")
+
+    # Mở store để đóng các tháng đã qua (ghi summary)
+    SegmentedOrderStore(args.out)
+    print(f"✅ Đã chia {sum(counts.values())} đơn hàng vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()
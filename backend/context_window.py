@@ -0,0 +1,169 @@
+import os
+import math
+import threading
+from llm_cache import LlmCache, cache_key
+
+# Ngân sách token cho toàn bộ prompt chat (system + tóm tắt + lịch sử + tin nhắn mới)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Số lượt (khách + Mimi) gần nhất luôn gửi nguyên văn
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "4"))
+# Các lượt cũ được tóm tắt theo từng khối để tóm tắt dùng lại được qua nhiều request
+CONTEXT_SUMMARY_BLOCK_TURNS = int(os.getenv("CONTEXT_SUMMARY_BLOCK_TURNS", "4"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+# Ước lượng token theo số ký tự (tiếng Việt có dấu với tokenizer của Llama khoảng 3 ký tự/token)
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3"))
+# Token phụ cho mỗi message (role, định dạng)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "TÓM TẮT CÁC LƯỢT TRAO ĐỔI TRƯỚC (khách đã nói, không cần hỏi lại):\n"
+
+# Tóm tắt theo tiền tố lịch sử: khóa = hash của các message đã được tóm tắt
+summary_cache = LlmCache("context_summary", ttl=float(os.getenv("CONTEXT_SUMMARY_TTL", "3600")))
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "requests": 0, "summarized": 0, "trimmed": 0, "dropped_messages": 0,
+    "full_tokens": 0, "prompt_tokens": 0, "summary_calls": 0, "summary_errors": 0,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một đoạn text (không cần tokenizer)"""
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages: list) -> int:
+    """Ước lượng số token của danh sách message gửi cho model"""
+    return sum(estimate_tokens(str(m.get("content", ""))) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def format_turns(messages: list) -> str:
+    """Chuyển các message thành đoạn hội thoại dạng text để tóm tắt"""
+    speakers = {"user": "Khách", "assistant": "Mimi"}
+    return "\n".join(f"{speakers.get(m.get('role'), m.get('role'))}: {m.get('content', '')}" for m in messages)
+
+
+class ContextPlan:
+    """
+    Kế hoạch dựng prompt cho một lượt chat trong ngân sách token.
+
+    Lịch sử được chia: các khối lượt cũ (mỗi khối CONTEXT_SUMMARY_BLOCK_TURNS
+    lượt) được thay bằng một bản tóm tắt cuốn chiếu, phần còn lại (ít nhất
+    CONTEXT_KEEP_TURNS lượt gần nhất) giữ nguyên văn. Tóm tắt của k khối đầu
+    được cache theo tiền tố lịch sử và dựng từ tóm tắt của k-1 khối + khối
+    mới, nên mỗi request thường chỉ cần tra cache.
+
+    Khi tóm tắt mới nhất chưa có: nếu prompt vẫn vừa ngân sách với tóm tắt cũ
+    hơn thì dùng tạm (due=True, nên tính nền); nếu không vừa thì phải tính
+    ngay (blocking=True). Cuối cùng build() bỏ bớt message nguyên văn cũ nhất
+    nếu vẫn vượt ngân sách.
+    """
+
+    def __init__(self, system_text: str, history: list, message: str, budget: int = CONTEXT_TOKEN_BUDGET):
+        self.system_text = system_text
+        self.history = list(history or [])
+        self.message = message
+        self.budget = budget
+
+        keep = CONTEXT_KEEP_TURNS * 2
+        block = max(1, CONTEXT_SUMMARY_BLOCK_TURNS * 2)
+        blocks = (len(self.history) - keep) // block if len(self.history) > keep else 0
+        self.target_end = blocks * block
+        self.key = cache_key("context", self.history[:self.target_end]) if blocks else None
+
+        # Tóm tắt gần nhất đã có trong cache (tiền tố dài nhất)
+        self.summary = None
+        self.summary_end = 0
+        for end in range(self.target_end, 0, -block):
+            summary = summary_cache.peek(cache_key("context", self.history[:end]))
+            if summary is not None:
+                self.summary, self.summary_end = summary, end
+                break
+
+        # Các message cần gộp vào tóm tắt để có tóm tắt mới nhất
+        self.base_summary = self.summary
+        self.pending_turns = self.history[self.summary_end:self.target_end]
+        self.due = bool(self.pending_turns)
+        self.blocking = self.due and count_message_tokens(self._messages()) > self.budget
+
+    def use_summary(self, summary: str):
+        """Dùng tóm tắt mới nhất vừa tính xong"""
+        self.summary = summary
+        self.summary_end = self.target_end
+        self.due = self.blocking = False
+
+    def _messages(self, verbatim: list = None):
+        messages = [{"role": "system", "content": self.system_text}]
+        if self.summary:
+            messages.append({"role": "system", "content": SUMMARY_HEADER + self.summary})
+        messages += self.history[self.summary_end:] if verbatim is None else verbatim
+        messages.append({"role": "user", "content": self.message})
+        return messages
+
+    def build(self):
+        """
+        Danh sách message cuối cùng (đã cắt cho vừa ngân sách) và ghi số liệu
+
+        Returns:
+            list
+        """
+        verbatim = self.history[self.summary_end:]
+        messages = self._messages(verbatim)
+        prompt_tokens = count_message_tokens(messages)
+        dropped = 0
+        # Bỏ message nguyên văn cũ nhất đến khi vừa ngân sách (luôn giữ tin nhắn mới)
+        while prompt_tokens > self.budget and verbatim:
+            prompt_tokens -= count_message_tokens(verbatim[:1])
+            verbatim = verbatim[1:]
+            dropped += 1
+        if dropped:
+            messages = self._messages(verbatim)
+
+        full_tokens = count_message_tokens(
+            [{"role": "system", "content": self.system_text}] + self.history + [{"role": "user", "content": self.message}]
+        )
+        with _metrics_lock:
+            _metrics["requests"] += 1
+            _metrics["summarized"] += 1 if self.summary else 0
+            _metrics["trimmed"] += 1 if dropped else 0
+            _metrics["dropped_messages"] += dropped
+            _metrics["full_tokens"] += full_tokens
+            _metrics["prompt_tokens"] += prompt_tokens
+        return messages
+
+
+def record_summary_call(ok: bool):
+    """Đếm lượt gọi LLM để tóm tắt (ok=False nếu lỗi)"""
+    with _metrics_lock:
+        _metrics["summary_calls"] += 1
+        _metrics["summary_errors"] += 0 if ok else 1
+
+
+def get_context_metrics():
+    """
+    Số token tiết kiệm được nhờ tóm tắt/cắt lịch sử so với gửi nguyên lịch sử
+
+    Returns:
+        dict: {requests, summarized_requests, trimmed_requests, dropped_messages, avg_full_tokens,
+               avg_prompt_tokens, tokens_saved_per_request, tokens_saved_total, summary_calls,
+               summary_errors, budget, cache}
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+
+    requests = metrics["requests"]
+    saved = metrics["full_tokens"] - metrics["prompt_tokens"]
+    return {
+        "requests": requests,
+        "summarized_requests": metrics["summarized"],
+        "trimmed_requests": metrics["trimmed"],
+        "dropped_messages": metrics["dropped_messages"],
+        "avg_full_tokens": round(metrics["full_tokens"] / requests, 1) if requests else None,
+        "avg_prompt_tokens": round(metrics["prompt_tokens"] / requests, 1) if requests else None,
+        "tokens_saved_per_request": round(saved / requests, 1) if requests else None,
+        "tokens_saved_total": saved,
+        "summary_calls": metrics["summary_calls"],
+        "summary_errors": metrics["summary_errors"],
+        "budget": CONTEXT_TOKEN_BUDGET,
+        "cache": summary_cache.stats(),
+    }
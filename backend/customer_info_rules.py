@@ -0,0 +1,257 @@
+import re
+import json
+import hashlib
+import threading
+import unicodedata
+from text_utils import fold_vietnamese
+from llm_cache import LlmCache
+
+CUSTOMER_INFO_FIELDS = ("name", "phone", "petName", "petType", "time")
+
+# Kết quả đã quét theo tiền tố hội thoại: lần sau chỉ quét các tin nhắn mới
+_state_cache = LlmCache("customer_info_rules", ttl=7200)
+
+# --- Số điện thoại: di động 0/84/+84 + 9 số (03, 05, 07, 08, 09), cố định 02x + 8 số ---
+_SEP = r"[\s.\-]?"
+_PHONE = re.compile(
+    rf"(?<![\d+])(?:(?:\+?84|0){_SEP}([35789](?:{_SEP}\d){{8}})|0(2\d(?:{_SEP}\d){{8}}))(?!\d)"
+)
+
+# --- Thời gian (so trên text đã bỏ dấu) ---
+_PERIOD = r"(?:sang|trua|chieu|toi|dem)"
+_DAY_AFTER = r"(?:nay|mai|mot|hom nay|ngay mai)"
+_CLOCK = r"(?:\d{1,2}\s*(?:h|g|gio)(?:\s*(?:\d{2}|ruoi))?(?:\s*(?:p|phut))?|\d{1,2}:\d{2})"
+_TIME_PARTS = [
+    # 15h, 15h30, 3 giờ rưỡi chiều mai, 9:30 sáng
+    rf"{_CLOCK}(?:\s+{_PERIOD})?(?:\s+{_DAY_AFTER})?",
+    # chiều nay, sáng mai, tối mốt ("sáng"/"tối" đứng một mình dễ nhầm "sang"/"tôi")
+    rf"(?:buoi\s+)?{_PERIOD}\s+(?:nay|mai|mot)|buoi\s+{_PERIOD}",
+    r"hom nay|ngay mai|ngay kia|ngay mot|cuoi tuan(?:\s+nay|\s+sau)?|tuan\s+(?:sau|toi)",
+    r"thu\s*(?:[2-7]|hai|ba|tu|nam|sau|bay)(?:\s+(?:nay|toi|sau))?|chu nhat(?:\s+(?:nay|toi|sau))?",
+    # 20/11, 20-11-2026, ngày 20 (không phải "3 ngày", "ngày 20kg")
+    r"(?:ngay\s+)?\d{1,2}\s*[/\-]\s*\d{1,2}(?:\s*[/\-]\s*\d{2,4})?|ngay\s+\d{1,2}(?!\s*(?:ngay|dem|kg|\d))",
+]
+_TIME = re.compile(r"(?<!\w)(?:" + "|".join(_TIME_PARTS) + r")(?!\w)")
+# Chữ nối giữa hai cụm thời gian được gộp chung ("thứ 7 lúc 15h")
+_TIME_GAP = re.compile(r"^[\s,]*(?:(?:luc|vao|khoang|tam|tu)\s*)?$")
+
+# --- Loài thú cưng ---
+_PET_TYPES = {
+    "Chó": [
+        "cun", "cun con", "dog", "doggy", "puppy", "poodle", "corgi", "husky", "alaska", "pomeranian",
+        "phoc soc", "chihuahua", "shiba", "golden", "labrador", "pug", "becgie", "samoyed", "bichon",
+        "maltese", "shih tzu", "shihtzu", "schnauzer", "beagle", "dachshund", "lap xuong",
+    ],
+    "Mèo": [
+        "meo", "cat", "kitty", "meo anh", "ald", "anh long ngan", "anh long dai", "ba tu", "munchkin",
+        "scottish", "sphynx", "bengal", "ragdoll",
+    ],
+    "Hamster": ["hamster"],
+}
+_PET_TYPE_PATTERNS = {
+    pet_type: re.compile(r"(?<!\w)(?:" + "|".join(sorted(words, key=len, reverse=True)) + r")(?!\w)")
+    for pet_type, words in _PET_TYPES.items()
+}
+# "cho"/"tho" bỏ dấu trùng "cho" (động từ), "thơm tho": chỉ nhận khi viết có dấu
+_ACCENTED_PET_TYPES = {"Chó": re.compile(r"(?<!\w)chó(?!\w)"), "Thỏ": re.compile(r"(?<!\w)thỏ(?!\w)")}
+
+# --- Tên khách / tên thú cưng ---
+_NAME = r"(\w+(?:\s+\w+){0,2})"
+_PET_NAME = [
+    re.compile(rf"(?<!\w)(?:be|con|cun|meo)\s+(?:nha\s+(?:minh|em|toi|tui|to|chi|anh)\s+)?ten\s+(?:la\s+)?{_NAME}"),
+    re.compile(rf"(?<!\w)ten\s+(?:cua\s+)?(?:be|con|cun|meo)\s+(?:nha\s+(?:minh|em|toi|tui|to|chi|anh)\s+)?(?:la\s+)?{_NAME}"),
+]
+_PERSON_NAME = [
+    re.compile(rf"(?<!\w)(?:minh|em|toi|tui|to|anh|chi)\s+ten\s+(?:la\s+)?{_NAME}"),
+    re.compile(rf"(?<!\w)ten\s+(?:minh|em|toi|tui|to|anh|chi|khach)\s+(?:la\s+)?{_NAME}"),
+]
+# "Mình là Lan": chỉ nhận khi tên viết hoa (tránh "mình là khách cũ")
+_PERSON_INTRO = re.compile(rf"(?<!\w)(?:toi|minh|em)\s+la\s+{_NAME}")
+_NAME_STOPWORDS = {
+    "nha", "nhe", "nhen", "a", "ne", "nhi", "ha", "oi", "day", "va", "voi", "thi", "o", "la", "con", "be",
+    "sdt", "so", "dien", "thoai", "minh", "em", "toi", "anh", "chi", "nam", "tuoi", "kg", "can", "muon",
+    "dat", "lich", "cho", "chot", "ok", "shop", "ben", "khach", "sinh", "moi", "duc", "cai",
+}
+
+_metrics_lock = threading.Lock()
+_metrics = {"calls": 0, "complete_locally": 0, "messages_scanned": 0, "messages_reused": 0}
+
+
+def _fold_aligned(text: str):
+    """Bỏ dấu từng ký tự để vị trí trong bản bỏ dấu khớp với bản gốc"""
+    text = unicodedata.normalize("NFC", str(text or ""))
+    return text, "".join((fold_vietnamese(ch) or " ")[:1] for ch in text)
+
+
+def _clean_name(original: str, folded: str, start: int, end: int):
+    """Cắt tên tại từ dừng/chữ số, chuẩn hóa viết hoa nếu khách gõ toàn chữ thường"""
+    words = []
+    for match in re.finditer(r"\w+", folded[start:end]):
+        word = match.group(0)
+        if word in _NAME_STOPWORDS or any(ch.isdigit() for ch in word):
+            break
+        words.append(original[start + match.start():start + match.end()])
+    name = " ".join(words)
+    return name.title() if name.islower() else name
+
+
+def extract_phone(text: str) -> str:
+    """SĐT cuối cùng trong tin nhắn, dạng 0xxxxxxxxx (rỗng nếu không có)"""
+    found = ""
+    for match in _PHONE.finditer(text):
+        mobile, landline = match.groups()
+        digits = re.sub(r"\D", "", mobile or landline)
+        found = "0" + digits
+    return found
+
+
+def extract_time(original: str, folded: str) -> str:
+    """Cụm giờ hẹn trong tin nhắn ("15h chiều mai", "thứ 7 lúc 9h"), lấy nguyên văn của khách"""
+    spans = []
+    for match in _TIME.finditer(folded):
+        start, end = match.span()
+        if spans and (start <= spans[-1][1] or _TIME_GAP.match(folded[spans[-1][1]:start])):
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+    return ", ".join(original[start:end].strip() for start, end in spans)
+
+
+def extract_pet_type(original: str, folded: str) -> str:
+    """Loài thú cưng nếu tin nhắn chỉ nhắc tới đúng một loài"""
+    lowered = original.lower()
+    found = {pet_type for pet_type, pattern in _PET_TYPE_PATTERNS.items() if pattern.search(folded)}
+    found |= {pet_type for pet_type, pattern in _ACCENTED_PET_TYPES.items() if pattern.search(lowered)}
+    return found.pop() if len(found) == 1 else ""
+
+
+def extract_names(original: str, folded: str):
+    """
+    Returns:
+        tuple: (tên khách, tên thú cưng) - rỗng nếu không thấy
+    """
+    pet_name, pet_spans = "", []
+    for pattern in _PET_NAME:
+        for match in pattern.finditer(folded):
+            name = _clean_name(original, folded, *match.span(1))
+            if name:
+                pet_name = name
+                pet_spans.append(match.span())
+
+    person_name = ""
+    candidates = [(pattern, False) for pattern in _PERSON_NAME] + [(_PERSON_INTRO, True)]
+    for pattern, needs_capital in candidates:
+        for match in pattern.finditer(folded):
+            # "bé nhà em tên Mỡ": phần "em tên Mỡ" thuộc tên thú cưng
+            if any(start <= match.start() < end for start, end in pet_spans):
+                continue
+            if needs_capital and not original[match.start(1)].isupper():
+                continue
+            name = _clean_name(original, folded, *match.span(1))
+            if name:
+                person_name = name
+    return person_name, pet_name
+
+
+def extract_from_message(text: str):
+    """
+    Tìm thông tin khách trong một tin nhắn bằng luật (không gọi LLM)
+
+    Args:
+        text: Tin nhắn của khách
+
+    Returns:
+        dict: các trường tìm thấy trong {name, phone, petName, petType, time}
+    """
+    original, folded = _fold_aligned(text)
+    name, pet_name = extract_names(original, folded)
+    found = {
+        "name": name,
+        "phone": extract_phone(original),
+        "petName": pet_name,
+        "petType": extract_pet_type(original, folded),
+        "time": extract_time(original, folded),
+    }
+    return {field: value for field, value in found.items() if value}
+
+
+def _prefix_keys(history: list):
+    """Hash cuốn chiếu của từng tiền tố hội thoại"""
+    digest = hashlib.sha256()
+    keys = []
+    for msg in history:
+        digest.update(json.dumps([msg.get("role"), msg.get("content")], ensure_ascii=False).encode("utf-8"))
+        keys.append(digest.hexdigest())
+    return keys
+
+
+def _scan(history: list):
+    """
+    Returns:
+        tuple: (info, last_match) - last_match là vị trí tin nhắn cuối luật tìm thấy thông tin (-1 nếu không có)
+    """
+    keys = _prefix_keys(history)
+    info, last_match, start = dict.fromkeys(CUSTOMER_INFO_FIELDS, ""), -1, 0
+    for end in range(len(keys), 0, -1):
+        cached = _state_cache.peek(keys[end - 1])
+        if cached is not None:
+            info, last_match, start = dict(cached["info"]), cached["last_match"], end
+            break
+
+    for index in range(start, len(history)):
+        msg = history[index]
+        if msg.get("role") == "user":
+            found = extract_from_message(msg.get("content", ""))
+            if found:
+                info.update(found)
+                last_match = index
+    if keys and start < len(keys):
+        _state_cache.get_or_compute(keys[-1], lambda: {"info": dict(info), "last_match": last_match})
+
+    with _metrics_lock:
+        _metrics["calls"] += 1
+        _metrics["complete_locally"] += 1 if all(info.values()) else 0
+        _metrics["messages_scanned"] += len(history) - start
+        _metrics["messages_reused"] += start
+    return info, last_match
+
+
+def scan_history(history: list):
+    """
+    Thông tin khách tìm được bằng luật trong các tin nhắn của khách.
+    Kết quả được nhớ theo hội thoại nên mỗi lần gọi chỉ quét các tin nhắn
+    thêm vào từ lần trước; tin nhắn sau ghi đè thông tin tin trước (khách sửa SĐT, đổi giờ).
+
+    Args:
+        history: Lịch sử chat [{role, content}]
+
+    Returns:
+        dict: {name, phone, petName, petType, time} - rỗng nếu luật không tìm thấy
+    """
+    return _scan(history)[0]
+
+
+def scan_history_tail(history: list):
+    """
+    Như scan_history, kèm phần hội thoại còn có thể chứa các trường luật chưa tìm thấy:
+    từ tin nhắn cuối cùng luật tìm thấy thông tin trở đi (cả hội thoại nếu luật không tìm thấy gì).
+    Tin nhắn đó được giữ lại vì có thể còn trường luật bỏ sót; tin của trợ lý giữ làm ngữ cảnh
+    (khách trả lời "Mỡ" cho câu hỏi tên bé).
+
+    Args:
+        history: Lịch sử chat [{role, content}]
+
+    Returns:
+        tuple: (info, tail) - info như scan_history, tail là danh sách tin nhắn
+    """
+    info, last_match = _scan(history)
+    return info, history[max(last_match, 0):]
+
+
+def get_customer_info_rule_stats():
+    """
+    Returns:
+        dict: {calls, complete_locally, messages_scanned, messages_reused, cache}
+    """
+    with _metrics_lock:
+        return dict(_metrics, cache=_state_cache.stats())
@@ -0,0 +1,139 @@
+from text_utils import fold_vietnamese, tokenize
+
+# Cụm từ -> trọng số. Viết có dấu cho dễ đọc, lúc so khớp cả hai phía đều được bỏ dấu
+# nên khách gõ không dấu vẫn nhận ra. Các từ dễ trùng khi bỏ dấu ("lo", "sợ", "đau",
+# "chán"...) chỉ dùng trong cụm để tránh nhầm với "lò", "số", "đâu", "chân".
+LEXICON = {
+    "annoyed": {
+        "bực mình": 2, "bực ghê": 2, "bực thật": 2, "bực bội": 2, "bực quá": 2, "bức xúc": 2, "khó chịu": 2,
+        "chán quá": 2, "chán ghê": 2, "chán thật": 2, "thất vọng": 2, "tệ quá": 2, "quá tệ": 2,
+        "tệ hại": 2, "dịch vụ tệ": 2, "không hài lòng": 2, "phiền quá": 1.5, "phiền phức": 1.5,
+        "vô lý": 1.5, "lừa đảo": 2, "làm ăn kiểu gì": 2, "điên tiết": 2, "chờ mãi": 2,
+        "đợi mãi": 2, "chờ lâu": 1.5, "đợi lâu": 1.5, "lâu quá": 1.5, "chậm quá": 1.5,
+        "không ai trả lời": 2, "không ai nghe máy": 2, "hủy đơn": 1.5, "bỏ đi": 1,
+        "đm": 2, "vcl": 2, "wtf": 2,
+    },
+    "worried": {
+        "lo quá": 2, "lo lắng": 2, "lo ghê": 2, "hơi lo": 2, "lo cho bé": 2, "sợ quá": 2,
+        "mình sợ": 2, "em sợ": 2, "hơi sợ": 2, "sợ bé": 2, "sợ đau": 2, "hoảng": 2,
+        "bỏ ăn": 2, "biếng ăn": 2, "bị ốm": 2, "ốm rồi": 2, "đang ốm": 2, "bệnh": 1.5,
+        "bị nôn": 2, "nôn ói": 2, "nôn mửa": 2, "tiêu chảy": 2, "bị sốt": 2, "sốt cao": 2,
+        "chảy máu": 2, "bị thương": 2, "bị đau": 2, "đau quá": 2, "có đau không": 2,
+        "kêu đau": 2, "yếu lắm": 1.5, "yếu quá": 1.5, "co giật": 2, "khó thở": 2,
+        "có sao không": 1.5, "có an toàn không": 1.5, "an toàn không": 1.5,
+        "rụng lông": 1, "ve rận": 1, "bọ chét": 1, "ngứa": 1,
+    },
+    "happy": {
+        "cảm ơn": 1.5, "cám ơn": 1.5, "thanks": 1.5, "thank you": 1.5, "tuyệt": 2,
+        "tuyệt vời": 2, "xinh": 1.5, "đẹp quá": 2, "đẹp lắm": 2, "dễ thương": 1.5,
+        "vui": 1.5, "hài lòng": 2, "ưng ý": 2, "ưng quá": 2, "thích quá": 2, "rất thích": 2,
+        "thích lắm": 2, "yêu shop": 2, "quá đỉnh": 2, "đỉnh quá": 2, "hay quá": 1.5,
+        "chu đáo": 1.5, "xuất sắc": 2, "hehe": 1, "hihi": 1, "haha": 1,
+    },
+}
+
+# Câu hỏi thông tin thường ngày -> trung lập
+NEUTRAL_CUES = {
+    "bao nhiêu": 1, "giá": 1, "mấy giờ": 1, "mở cửa": 1, "địa chỉ": 1, "ở đâu": 1,
+    "còn phòng": 1, "đặt lịch": 1, "book": 1, "tư vấn": 1, "cho hỏi": 1,
+    "gói nào": 1, "dịch vụ gì": 1,
+}
+
+# Cụm lịch sự có chứa từ cảm xúc ("vui lòng" = "xin hãy"): khớp trước các cụm cảm xúc
+# để "vui" trong đó không bị tính là happy, và tính như câu hỏi thông tin
+POLITE_PHRASES = {"vui lòng": 1, "làm ơn": 1}
+
+EMOJI = {
+    "annoyed": ("😡", "🤬", "😤", "😠", "👎", "😒"),
+    "worried": ("😢", "😭", "😰", "😟", "😥", "😨", "🥺", ":(", ":(("),
+    "happy": ("😍", "🥰", "😊", "😄", "😁", "❤", "💕", "👍", "🤩", "😘", ":)", "^^", "=))"),
+}
+
+NEGATIONS = {"khong", "chang", "cha", "ko", "k", "chua", "kg", "hok"}
+
+
+def _compile(phrases: dict):
+    """Bỏ dấu + tách từ cho các cụm, xếp cụm dài trước để khớp cụm dài nhất"""
+    compiled = [(tuple(tokenize(fold_vietnamese(phrase))), weight) for phrase, weight in phrases.items()]
+    return sorted(compiled, key=lambda item: len(item[0]), reverse=True)
+
+
+_LEXICON = {emotion: _compile(phrases) for emotion, phrases in LEXICON.items()}
+_NEUTRAL = _compile(NEUTRAL_CUES)
+_POLITE = _compile(POLITE_PHRASES)
+
+
+def _match(tokens: list, phrases: list, used: set):
+    """
+    Tìm các cụm trong danh sách từ (mỗi từ chỉ được tính cho một cụm)
+
+    Returns:
+        list: [(vị trí bắt đầu, trọng số)]
+    """
+    hits = []
+    for phrase, weight in phrases:
+        n = len(phrase)
+        for start in range(len(tokens) - n + 1):
+            span = range(start, start + n)
+            if tuple(tokens[start:start + n]) == phrase and not used.intersection(span):
+                used.update(span)
+                hits.append((start, weight))
+    return hits
+
+
+def classify_emotion(message: str):
+    """
+    Đoán cảm xúc của tin nhắn tiếng Việt (có dấu hoặc không dấu) bằng từ điển,
+    emoji và dấu câu, không gọi model
+
+    Độ tin cậy = điểm cao nhất / (điểm cao nhất + điểm nhì + 1): một dấu hiệu rõ
+    khoảng 0.67, hai dấu hiệu cùng chiều khoảng 0.8, các dấu hiệu trái chiều kéo
+    độ tin cậy xuống thấp để chuyển cho LLM.
+
+    Args:
+        message: Tin nhắn của khách
+
+    Returns:
+        tuple: (cảm xúc, độ tin cậy 0..1)
+    """
+    text = str(message or "")
+    tokens = tokenize(fold_vietnamese(text))
+    scores = {emotion: 0.0 for emotion in LEXICON}
+
+    used = set()
+    polite_score = sum(weight for _, weight in _match(tokens, _POLITE, used))
+    # Xét annoyed trước để "không hài lòng" không bị tính thành "hài lòng"
+    for emotion in ("annoyed", "worried", "happy"):
+        for start, weight in _match(tokens, _LEXICON[emotion], used):
+            negated = start > 0 and tokens[start - 1] in NEGATIONS
+            if not negated:
+                scores[emotion] += weight
+            elif emotion == "happy":
+                # "không vui", "chẳng ưng ý" -> bực
+                scores["annoyed"] += weight
+
+    for emotion, emojis in EMOJI.items():
+        scores[emotion] += 1.5 * sum(text.count(emoji) for emoji in emojis)
+
+    # Dấu câu / viết hoa
+    if "??" in text:
+        scores["annoyed"] += 0.5
+    shouted = [word for word in text.split() if len(word) >= 3 and word.isalpha() and word.isupper()]
+    if len(shouted) >= 2:
+        scores["annoyed"] += 1
+    if "!!" in text:
+        top = max(scores, key=scores.get)
+        if scores[top] > 0:
+            scores[top] += 0.5
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (top, top_score), (_, second_score) = ranked[0], ranked[1]
+
+    if top_score == 0:
+        # Không có dấu hiệu cảm xúc: câu hỏi thông tin thì khá chắc là trung lập
+        neutral_score = polite_score + sum(weight for _, weight in _match(tokens, _NEUTRAL, used))
+        if "?" in text:
+            neutral_score += 0.5
+        return "neutral", 0.75 if neutral_score >= 1 else 0.4
+
+    return top, round(top_score / (top_score + second_score + 1), 3)
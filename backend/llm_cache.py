@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Số kết quả tối đa giữ trong mỗi cache và thời gian sống (giây)
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600"))
+
+
+def _normalize(value):
+    """Chuẩn hóa input trước khi băm: NFC, gộp khoảng trắng (không đổi hoa/thường)"""
+    if isinstance(value, str):
+        return " ".join(unicodedata.normalize("NFC", value).split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def cache_key(*parts) -> str:
+    """
+    Khóa cache = sha256 của input đã chuẩn hóa
+
+    Args:
+        parts: Các input tạo nên prompt (chuỗi, list, dict)
+
+    Returns:
+        str
+    """
+    payload = json.dumps(_normalize(list(parts)), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Giữ tham chiếu tới task compute đang chạy (event loop chỉ giữ tham chiếu yếu)
+_background_tasks = set()
+
+
+def _background_done(task):
+    _background_tasks.discard(task)
+    if not task.cancelled():
+        # Lỗi đã được chuyển cho các bên chờ; tránh cảnh báo "exception was never retrieved"
+        task.exception()
+
+
+class LlmCache:
+    """
+    Cache LRU + TTL cho kết quả gọi LLM, có gộp các lời gọi trùng nhau
+    đang chạy (single-flight): lời gọi đến sau chờ kết quả của lời gọi
+    đầu thay vì gọi Groq thêm lần nữa. Lời gọi lỗi không được cache.
+    """
+
+    def __init__(self, name: str, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (hết hạn lúc, kết quả), thứ tự từ cũ tới mới dùng
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key: str, compute):
+        """
+        Lấy kết quả trong cache, hoặc gọi compute() (mỗi key chỉ một lời gọi tại một thời điểm)
+
+        Args:
+            key: Khóa cache (xem cache_key)
+            compute: Hàm không tham số trả về kết quả; exception được ném lại cho mọi bên chờ
+
+        Returns:
+            Kết quả của compute
+        """
+        hit, value, owner = self._lookup(key)
+        if hit:
+            return value
+        future = value
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._store(key, future, result)
+        return result
+
+    async def aget_or_compute(self, key: str, compute):
+        """
+        Như get_or_compute cho code async: compute() trả về coroutine, bên chờ
+        không chặn event loop (dùng chung cache và single-flight với bản đồng bộ)
+
+        Args:
+            key: Khóa cache (xem cache_key)
+            compute: Hàm không tham số trả về coroutine
+
+        Returns:
+            Kết quả của coroutine
+        """
+        hit, value, owner = self._lookup(key)
+        if hit:
+            return value
+        future = value
+        if not owner:
+            # shield: bên chờ bị hủy không được hủy Future dùng chung của các bên khác
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        # compute chạy trong task riêng: bên gọi đầu bị hủy (khách ngắt kết nối) thì
+        # lời gọi vẫn chạy tiếp và trả kết quả cho các bên đang chờ cùng key
+        task = asyncio.ensure_future(self._acompute(key, future, compute))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_done)
+        return await asyncio.shield(task)
+
+    async def _acompute(self, key: str, future: Future, compute):
+        try:
+            result = await compute()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._store(key, future, result)
+        return result
+
+    def peek(self, key: str):
+        """
+        Kết quả còn hạn trong cache, không gọi compute (không thấy thì không tính là miss)
+
+        Returns:
+            Kết quả hoặc None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            return None
+
+    def in_flight(self, key: str) -> bool:
+        """True nếu đang có lời gọi tính key này"""
+        with self._lock:
+            return key in self._in_flight
+
+    def _lookup(self, key: str):
+        """
+        Returns:
+            tuple: (trúng cache?, kết quả hoặc Future, là lời gọi đầu tiên?)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1], False
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, future, False
+
+            self.misses += 1
+            future = self._in_flight[key] = Future()
+            return False, future, True
+
+    def _fail(self, key: str, future: Future, error: BaseException):
+        with self._lock:
+            del self._in_flight[key]
+        future.set_exception(error)
+
+    def _store(self, key: str, future: Future, result):
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        future.set_result(result)
+
+    def clear(self):
+        """Xóa toàn bộ kết quả đã cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Số liệu của cache
+
+        Returns:
+            dict: {size, max_size, ttl, hits, misses, coalesced, evictions, hit_rate}
+        """
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+            }
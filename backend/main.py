@@ -1,22 +1,53 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+import json
+import asyncio
+from contextlib import aclosing
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from ai_logic import chat_with_ai, extract_services_from_history, extract_customer_info_from_history
+from ai_logic import (
+    achat_with_ai,
+    astream_chat_with_ai,
+    aextract_services_from_history,
+    aextract_customer_info_from_history,
+    get_emotion_metrics,
+    get_llm_cache_stats,
+    get_context_metrics,
+    get_rate_limit_stats,
+    get_model_route_stats,
+    get_groq_health_stats,
+    async_client
+)
 from api_data import (
     validate_login,
     get_services,
-    save_order_to_file,
-    send_email_task,
-    confirm_order,
+    asave_order_to_file,
+    aconfirm_order,
     get_all_orders,
-    get_stats
+    stream_orders,
+    get_stats,
+    get_stats_timeseries,
+    get_monthly_stats,
+    get_notification_status
 )
+from order_stats import get_order_stats
+from order_timeseries import get_order_timeseries
+from order_events import order_events
+from order_writer import OrderCommitPending, stop_order_writer
+from notifier import get_notifier, stop_notifier
+from chat_sessions import get_chat_sessions, stop_chat_sessions
+from service_index import get_service_index
+from catalog_answers import get_catalog_answers, get_catalog_answer_metrics
 
 load_dotenv()
 
+# Chu kỳ gửi keep-alive trên kênh SSE (giây)
+SSE_KEEPALIVE_SECONDS = 15
+
 app = FastAPI()
 
 # Cấu hình CORS
@@ -35,6 +66,38 @@ except:
     print("⚠️  Thư mục 'static' chưa tồn tại")
 
 
+@app.on_event("startup")
+def warm_order_stats():
+    """
+    Dựng bộ đếm thống kê, bản sao dạng cột, chỉ mục gói dịch vụ, mẫu trả lời
+    bảng giá và gửi lại thông báo còn trong outbox khi khởi động
+    """
+    get_order_stats()
+    get_order_timeseries()
+    get_service_index()
+    get_catalog_answers()
+    get_notifier()
+
+
+@app.on_event("shutdown")
+def flush_order_writer():
+    """Ghi nốt các đơn còn trong hàng đợi và dừng thread gửi email trước khi tắt server"""
+    stop_order_writer()
+    stop_notifier()
+
+
+@app.on_event("shutdown")
+def save_chat_sessions():
+    """Ghi các phiên chat đang mở xuống đĩa để khách chat tiếp được sau khi khởi động lại"""
+    stop_chat_sessions()
+
+
+@app.on_event("shutdown")
+async def close_groq_client():
+    """Đóng pool kết nối tới Groq"""
+    await async_client.close()
+
+
 # --- MODELS ---
 class LoginRequest(BaseModel):
     username: str
@@ -43,29 +106,71 @@ class LoginRequest(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
-    history: list
+    # Phiên chat phía server (lấy từ kết quả lượt trước); bỏ trống ở lượt đầu
+    session_id: str = None
+    # Các tin chỉ hiển thị ở client từ sau lượt trước (vd. hóa đơn, khách bấm hủy đơn)
+    client_messages: list = []
+    # Client cũ gửi cả lịch sử mỗi lượt (dùng làm lịch sử ban đầu của phiên mới)
+    history: list = None
     selected_services: list = []
+    # Cảm xúc server trả về ở lượt trước (mặc định lấy từ phiên)
+    emotion: str = None
 
 
 class ConfirmOrderRequest(BaseModel):
     order: dict
-    history: list
+    history: list = None
 
 
 class ExtractServicesRequest(BaseModel):
-    history: list
+    session_id: str = None
+    client_messages: list = []
+    history: list = None
+
+
+def _open_chat_session(data: ChatRequest):
+    """
+    Lấy (hoặc tạo) phiên chat của request. Có thể đọc/ghi file phiên đã đẩy xuống đĩa,
+    nên endpoint async gọi qua asyncio.to_thread.
+
+    Returns:
+        tuple: (phiên, lịch sử trước tin nhắn mới, cảm xúc lượt trước)
+    """
+    sessions = get_chat_sessions()
+    if data.session_id:
+        session = sessions.get(data.session_id)
+        if session is None:
+            # Client gửi lại cả lịch sử (không kèm session_id) để mở phiên mới
+            raise HTTPException(status_code=404, detail="Phiên chat không tồn tại hoặc đã hết hạn")
+    else:
+        session = sessions.create(data.history)
+
+    history, emotion = sessions.snapshot(session)
+    return session, history + data.client_messages, data.emotion or emotion
+
+
+def _request_history(data: ExtractServicesRequest):
+    """Lịch sử chat cho các API trích xuất: lấy từ phiên nếu có, không thì từ request (đọc đĩa, gọi qua asyncio.to_thread)"""
+    if not data.session_id:
+        return (data.history or []) + data.client_messages
+    sessions = get_chat_sessions()
+    session = sessions.get(data.session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Phiên chat không tồn tại hoặc đã hết hạn")
+    history, _ = sessions.snapshot(session)
+    return history + data.client_messages
 
 
 # --- API ENDPOINTS ---
 
 @app.get("/api/services")
-def get_services_endpoint():
+async def get_services_endpoint():
     """API lấy danh sách dịch vụ"""
     return get_services()
 
 
 @app.post("/api/login")
-def login(data: LoginRequest):
+async def login(data: LoginRequest):
     """API đăng nhập - trả về role của user"""
     result = validate_login(data.username, data.password)
     if result:
@@ -73,50 +178,244 @@ def login(data: LoginRequest):
     raise HTTPException(status_code=401, detail="Sai thông tin đăng nhập")
 
 
+async def _save_chat_order(order_data):
+    """Lưu đơn trong câu trả lời chat; ghi chậm quá hạn thì đơn vẫn sẽ được ghi nên không báo lỗi (khách gửi lại sẽ tạo đơn trùng)"""
+    try:
+        await asave_order_to_file(order_data)
+    except OrderCommitPending as e:
+        print(f"⚠️  {e}")
+
+
 @app.post("/api/chat")
-def chat(data: ChatRequest, background_tasks: BackgroundTasks):
+async def chat(data: ChatRequest):
     """API chat với Mimi - xử lý đơn hàng với lựa chọn dịch vụ"""
-    result = chat_with_ai(data.message, data.history, data.selected_services)
+    session, history, emotion = await asyncio.to_thread(_open_chat_session, data)
+    result = await achat_with_ai(data.message, history, data.selected_services, previous_emotion=emotion)
     
-    # Nếu có đơn hàng, lưu vào file và gửi email
+    # Nếu có đơn hàng, lưu vào file (email thông báo được ghi vào outbox cùng lúc)
     if result.get("order_data"):
-        save_order_to_file(result["order_data"])
-        background_tasks.add_task(send_email_task, result["order_data"])
+        await _save_chat_order(result["order_data"])
     
+    await asyncio.to_thread(get_chat_sessions().record, session, data.client_messages, data.message, result["reply"],
+                            result.get("emotion"))
+    result["session_id"] = session.id
     return result
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(data: ChatRequest):
+    """
+    API chat dạng SSE: gửi từng đoạn câu trả lời (event "token") ngay khi có,
+    cuối cùng là event "done" giống kết quả của /api/chat (đơn hàng đã được lưu)
+    """
+    session, history, emotion = await asyncio.to_thread(_open_chat_session, data)
+
+    async def events():
+        # aclosing: khách ngắt kết nối thì đóng luồng Groq ngay, không chờ GC
+        async with aclosing(astream_chat_with_ai(data.message, history, data.selected_services,
+                                                 previous_emotion=emotion)) as chat_events:
+            async for event, payload in chat_events:
+                if event == "done":
+                    # Nếu có đơn hàng, lưu vào file (email thông báo được ghi vào outbox cùng lúc)
+                    if payload.get("order_data"):
+                        await _save_chat_order(payload["order_data"])
+                    await asyncio.to_thread(get_chat_sessions().record, session, data.client_messages, data.message,
+                                            payload["reply"], payload.get("emotion"))
+                    payload["session_id"] = session.id
+                yield _sse_event(event, payload)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/api/confirm-order")
-def confirm_order_endpoint(data: ConfirmOrderRequest, background_tasks: BackgroundTasks):
-    """API xác nhận và lưu đơn hàng"""
-    result = confirm_order(data.order)
-    
-    # Nếu xác nhận thành công, gửi email
-    if result.get("success"):
-        background_tasks.add_task(send_email_task, data.order)
-    
+async def confirm_order_endpoint(data: ConfirmOrderRequest):
+    """
+    API xác nhận và lưu đơn hàng (email thông báo được gửi từ outbox).
+    Trả 202 kèm order_id nếu đơn chưa ghi xong trong ORDER_COMMIT_TIMEOUT (đơn vẫn sẽ được ghi).
+    """
+    result = await aconfirm_order(data.order)
+    if result.get("pending"):
+        return JSONResponse(result, status_code=202)
     return result
 
 
 @app.post("/api/extract-services")
-def extract_services(data: ExtractServicesRequest):
-    """API trích xuất dịch vụ từ lịch sử chat"""
-    return extract_services_from_history(data.history)
+async def extract_services(data: ExtractServicesRequest):
+    """API trích xuất dịch vụ từ lịch sử chat (của phiên, hoặc client gửi lên)"""
+    return await aextract_services_from_history(await asyncio.to_thread(_request_history, data))
 
 
 @app.post("/api/extract-customer-info")
-def extract_customer_info(data: ExtractServicesRequest):
-    """API trích xuất thông tin khách hàng từ lịch sử chat"""
-    return extract_customer_info_from_history(data.history)
+async def extract_customer_info(data: ExtractServicesRequest):
+    """API trích xuất thông tin khách hàng từ lịch sử chat (của phiên, hoặc client gửi lên)"""
+    return await aextract_customer_info_from_history(await asyncio.to_thread(_request_history, data))
 
 
 @app.get("/api/orders")
-def get_orders():
-    """API lấy danh sách tất cả đơn hàng"""
-    return get_all_orders()
+def get_orders(
+    limit: int = None,
+    cursor: str = None,
+    date_from: str = None,
+    date_to: str = None,
+    phone: str = None,
+    service: str = None,
+    newest_first: bool = False
+):
+    """API lấy danh sách đơn hàng (phân trang bằng cursor, lọc theo ngày/SĐT/dịch vụ)"""
+    try:
+        return get_all_orders(limit, cursor, date_from, date_to, phone, service, newest_first)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/orders/stream")
+def stream_orders_endpoint(
+    date_from: str = None,
+    date_to: str = None,
+    phone: str = None,
+    service: str = None,
+    newest_first: bool = False
+):
+    """API xuất đơn hàng dạng NDJSON, không dựng cả danh sách trong bộ nhớ"""
+    return StreamingResponse(
+        stream_orders(date_from, date_to, phone, service, newest_first),
+        media_type="application/x-ndjson"
+    )
 
 
 @app.get("/api/stats")
-def get_stats_endpoint():
-    """API lấy thống kê: tổng đơn, tổng doanh thu, đơn hôm nay"""
-    return get_stats()
+def get_stats_endpoint(request: Request, response: Response, include_orders: bool = False):
+    """
+    API lấy thống kê: tổng đơn, tổng doanh thu, đơn hôm nay (hỗ trợ ETag/If-None-Match).
+    Danh sách đơn lấy theo trang ở /api/orders; include_orders=true trả kèm toàn bộ lịch sử.
+    """
+    etag = get_order_stats().etag("full" if include_orders else "lite")
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return get_stats(include_orders)
+
+
+@app.get("/api/stats/timeseries")
+def get_stats_timeseries_endpoint(
+    bucket: str = "day",
+    group_by: str = "none",
+    date_from: str = None,
+    date_to: str = None
+):
+    """API doanh thu theo giờ/ngày/tuần, có thể tách theo dịch vụ (group_by=service)"""
+    try:
+        return get_stats_timeseries(bucket, group_by, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/stats/monthly")
+def get_monthly_stats_endpoint():
+    """API thống kê theo tháng: số đơn, doanh thu, tổng theo dịch vụ"""
+    return get_monthly_stats()
+
+
+@app.get("/api/admin/notifications")
+async def get_notification_status_endpoint():
+    """API tình trạng hàng đợi email thông báo: số thông báo chờ, đang thử lại, dead-letter, độ trễ"""
+    return get_notification_status()
+
+
+@app.get("/api/admin/emotion")
+async def get_emotion_metrics_endpoint():
+    """API tỉ lệ phân loại cảm xúc tại chỗ (không gọi LLM) và thời gian tiết kiệm được"""
+    return get_emotion_metrics()
+
+
+@app.get("/api/admin/llm-cache")
+async def get_llm_cache_stats_endpoint():
+    """API số liệu hit/miss của cache kết quả LLM (cảm xúc, trích xuất dịch vụ/thông tin khách)"""
+    return get_llm_cache_stats()
+
+
+@app.get("/api/admin/chat-sessions")
+async def get_chat_session_stats_endpoint():
+    """API số phiên chat đang mở, đã ghi xuống đĩa và đã hết hạn"""
+    return get_chat_sessions().stats()
+
+
+@app.get("/api/admin/context")
+async def get_context_metrics_endpoint():
+    """API số token tiết kiệm mỗi request nhờ tóm tắt lịch sử chat cũ và ngân sách token"""
+    return get_context_metrics()
+
+
+@app.get("/api/admin/rate-limit")
+async def get_rate_limit_stats_endpoint():
+    """API hàng đợi gọi Groq theo độ ưu tiên, hạn mức request/token còn lại và thời gian chờ lượt"""
+    return get_rate_limit_stats()
+
+
+@app.get("/api/admin/model-routes")
+async def get_model_route_stats_endpoint():
+    """API model đang dùng cho từng tác vụ, số lần nâng/hạ cấp model và p50/p95 độ trễ"""
+    return get_model_route_stats()
+
+
+@app.get("/api/admin/groq-health")
+async def get_groq_health_stats_endpoint():
+    """API deadline gọi Groq, trạng thái circuit breaker của từng model và số request hedging"""
+    return get_groq_health_stats()
+
+
+@app.get("/api/admin/catalog-answers")
+async def get_catalog_answer_metrics_endpoint():
+    """API tỉ lệ tin nhắn hỏi bảng giá / gói được trả lời từ danh mục (không gọi LLM)"""
+    return get_catalog_answer_metrics()
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Đóng gói một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/stats/stream")
+async def stats_stream(request: Request):
+    """
+    Kênh SSE cho dashboard: gửi snapshot lúc kết nối, sau đó chỉ gửi
+    delta khi có đơn mới. Dashboard không làm gì thì server cũng không làm gì.
+    """
+    async def events():
+        queue = order_events.subscribe()
+        try:
+            day = datetime.now().strftime("%Y-%m-%d")
+            yield _sse_event("snapshot", get_order_stats().snapshot())
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Sang ngày mới thì số liệu "hôm nay" phải về 0
+                    today = datetime.now().strftime("%Y-%m-%d")
+                    if today != day:
+                        day = today
+                        yield _sse_event("snapshot", get_order_stats().snapshot())
+                    else:
+                        yield ": keep-alive\n\n"
+                    continue
+
+                if event["type"] == "snapshot":
+                    yield _sse_event("snapshot", get_order_stats().snapshot())
+                else:
+                    yield _sse_event("order", event)
+        finally:
+            order_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
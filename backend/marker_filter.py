@@ -0,0 +1,71 @@
+def _partial_suffix(text: str, marker: str) -> int:
+    """Độ dài phần cuối của text có thể là đầu của marker (chưa nhận đủ để biết)"""
+    for size in range(min(len(text), len(marker) - 1), 0, -1):
+        if text.endswith(marker[:size]):
+            return size
+    return 0
+
+
+class MarkerFilter:
+    """
+    Lọc khối start...end khỏi một luồng text nhận theo từng mảnh (token).
+
+    Text ngoài khối được trả ra ngay khi chắc chắn không phải đầu của
+    marker; nội dung trong khối được giữ lại trong blocks, không bao giờ
+    lọt ra ngoài kể cả khi marker bị cắt ngang giữa hai mảnh.
+    """
+
+    def __init__(self, start: str, end: str):
+        self.start = start
+        self.end = end
+        self.blocks = []
+        # True nếu luồng kết thúc khi khối chưa đóng (xem flush)
+        self.unterminated = False
+        self._buffer = ""
+        self._inside = False
+
+    def feed(self, text: str) -> str:
+        """
+        Nhận thêm một mảnh text
+
+        Args:
+            text: Mảnh text mới
+
+        Returns:
+            str: Phần text hiển thị được (có thể rỗng)
+        """
+        self._buffer += text
+        visible = []
+        while True:
+            if not self._inside:
+                index = self._buffer.find(self.start)
+                if index < 0:
+                    keep = _partial_suffix(self._buffer, self.start)
+                    cut = len(self._buffer) - keep
+                    visible.append(self._buffer[:cut])
+                    self._buffer = self._buffer[cut:]
+                    return "".join(visible)
+                visible.append(self._buffer[:index])
+                self._buffer = self._buffer[index + len(self.start):]
+                self._inside = True
+            else:
+                index = self._buffer.find(self.end)
+                if index < 0:
+                    return "".join(visible)
+                self.blocks.append(self._buffer[:index])
+                self._buffer = self._buffer[index + len(self.end):]
+                self._inside = False
+
+    def flush(self) -> str:
+        """
+        Kết thúc luồng: trả phần text còn giữ lại. Khối chưa đóng bị bỏ
+        (không hiển thị nửa khối JSON cho khách).
+
+        Returns:
+            str
+        """
+        rest = "" if self._inside else self._buffer
+        self.unterminated = self._inside
+        self._buffer = ""
+        self._inside = False
+        return rest
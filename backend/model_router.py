@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Bảng định tuyến mặc định: tác vụ -> (model chính, model dự phòng, ngân sách độ trễ p95 ms).
+# Phân loại 4 nhãn và trích xuất JSON nhỏ dùng model instant; trả lời khách và tóm
+# tắt (phải giữ đủ SĐT, gói, giờ hẹn) dùng model 70B.
+# Ghi đè từng tác vụ bằng env: MODEL_<TÁC VỤ>, MODEL_<TÁC VỤ>_FALLBACK (rỗng = không có),
+# MODEL_<TÁC VỤ>_BUDGET_MS, vd. MODEL_EMOTION=llama-3.3-70b-versatile
+DEFAULT_ROUTES = {
+    "chat": ("llama-3.3-70b-versatile", "llama-3.1-8b-instant", 8000),
+    "summary": ("llama-3.3-70b-versatile", "llama-3.1-8b-instant", 6000),
+    "emotion": ("llama-3.1-8b-instant", "llama-3.3-70b-versatile", 1500),
+    "extract_services": ("llama-3.1-8b-instant", "llama-3.3-70b-versatile", 3000),
+    "extract_customer_info": ("llama-3.1-8b-instant", "llama-3.3-70b-versatile", 3000),
+}
+
+# Số lượt gọi model chính gần nhất dùng để quyết định chuyển sang model dự phòng
+ROUTE_WINDOW = int(os.getenv("ROUTE_WINDOW", "20"))
+ROUTE_MIN_SAMPLES = int(os.getenv("ROUTE_MIN_SAMPLES", "10"))
+# Thời gian dùng model dự phòng trước khi thử lại model chính (giây)
+ROUTE_DEGRADE_SECONDS = float(os.getenv("ROUTE_DEGRADE_SECONDS", "60"))
+# Số mẫu độ trễ giữ lại cho p50/p95 của mỗi model
+ROUTE_STATS_SAMPLES = 1000
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class Route:
+    """
+    Định tuyến một tác vụ: model chính, model dự phòng và ngân sách độ trễ.
+
+    - Hạ cấp: khi p95 của ROUTE_WINDOW lượt gọi model chính gần nhất vượt
+      ngân sách, các lượt sau dùng model dự phòng trong ROUTE_DEGRADE_SECONDS
+      giây rồi mới thử lại model chính.
+    - Nâng cấp: lượt gọi lỗi hoặc kết quả không đọc được (parse ném lỗi) được
+      gọi lại ngay một lần bằng model còn lại.
+    """
+
+    def __init__(self, task: str, model: str, fallback: str = None, budget_ms: float = None):
+        self.task = task
+        self.model = model
+        self.fallback = fallback or None
+        self.budget_ms = budget_ms
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=ROUTE_WINDOW)
+        self._degraded_until = 0.0
+        self._latencies = {}
+        self._stats = {"calls": 0, "fallback_calls": 0, "escalations": 0, "degradations": 0}
+        self._model_stats = {}
+
+    def plan(self):
+        """
+        Thứ tự model cho một lượt gọi: model nên dùng trước, rồi model còn lại (nếu có)
+
+        Returns:
+            list: [model, ...]
+        """
+        with self._lock:
+            degraded = self.fallback is not None and time.monotonic() < self._degraded_until
+        if self.fallback is None:
+            return [self.model]
+        return [self.fallback, self.model] if degraded else [self.model, self.fallback]
+
+    def record(self, model: str, elapsed_ms: float, ok: bool, escalated: bool = False):
+        """
+        Ghi một lượt gọi
+
+        Args:
+            model: Model đã gọi
+            elapsed_ms: Thời gian gọi (kể cả parse)
+            ok: Gọi thành công và kết quả hợp lệ
+            escalated: Lượt gọi lại bằng model còn lại sau khi model trước lỗi
+        """
+        with self._lock:
+            stats = self._model_stats.setdefault(model, {"calls": 0, "errors": 0})
+            stats["calls"] += 1
+            stats["errors"] += 0 if ok else 1
+            self._stats["escalations"] += 1 if escalated else 0
+            if ok:
+                self._latencies.setdefault(model, deque(maxlen=ROUTE_STATS_SAMPLES)).append(elapsed_ms)
+
+            if model != self.model or self.budget_ms is None or self.fallback is None:
+                return
+            self._recent.append(elapsed_ms)
+            p95 = _percentile(list(self._recent), 0.95)
+            if len(self._recent) >= ROUTE_MIN_SAMPLES and p95 > self.budget_ms:
+                self._degraded_until = time.monotonic() + ROUTE_DEGRADE_SECONDS
+                self._stats["degradations"] += 1
+                # Sau thời gian hạ cấp, model chính được đánh giá lại từ đầu
+                self._recent.clear()
+                print(f"⚠️  Route {self.task}: p95 {self.model} {p95:.0f}ms > {self.budget_ms:.0f}ms, "
+                      f"dùng {self.fallback} trong {ROUTE_DEGRADE_SECONDS:.0f}s")
+
+    def finish(self, model: str):
+        """Đếm một lượt gọi của tác vụ đã xong (model trả kết quả cuối cùng)"""
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["fallback_calls"] += 1 if model != self.model else 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: {model, fallback, budget_ms, degraded_s, calls, fallback_calls, escalations, degradations,
+                   models: {model: {calls, errors, p50_ms, p95_ms}}}
+        """
+        with self._lock:
+            degraded_s = max(0.0, self._degraded_until - time.monotonic())
+            models = {
+                model: dict(
+                    stats,
+                    p50_ms=_percentile(list(self._latencies.get(model, [])), 0.5),
+                    p95_ms=_percentile(list(self._latencies.get(model, [])), 0.95),
+                )
+                for model, stats in self._model_stats.items()
+            }
+            return dict(
+                self._stats,
+                model=self.model,
+                fallback=self.fallback,
+                budget_ms=self.budget_ms,
+                degraded_s=round(degraded_s, 1),
+                models=models,
+            )
+
+
+def _route_from_env(task: str, model: str, fallback: str, budget_ms: float):
+    prefix = f"MODEL_{task.upper()}"
+    budget = os.getenv(f"{prefix}_BUDGET_MS")
+    return Route(
+        task,
+        os.getenv(prefix) or model,
+        os.getenv(f"{prefix}_FALLBACK", fallback),
+        float(budget) if budget else budget_ms,
+    )
+
+
+class ModelRouter:
+    """Bảng định tuyến tác vụ -> Route (model chính, dự phòng, ngân sách độ trễ)"""
+
+    def __init__(self, routes: dict = None):
+        routes = DEFAULT_ROUTES if routes is None else routes
+        self.routes = {task: _route_from_env(task, *config) for task, config in routes.items()}
+
+    def route(self, task: str) -> Route:
+        return self.routes[task]
+
+    def stats(self):
+        """
+        Returns:
+            dict: {tác vụ: Route.stats()}
+        """
+        return {task: route.stats() for task, route in self.routes.items()}
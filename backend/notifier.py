@@ -0,0 +1,527 @@
+import os
+import json
+import time
+import heapq
+import queue
+import random
+import smtplib
+import threading
+from collections import deque
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.header import Header
+
+# Máy chủ SMTP (đổi sang server giả lập khi test, ví dụ localhost:1025 với SMTP_SSL=off)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "on").lower() == "on"
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "off").lower() == "on"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "20"))
+# Đăng nhập bằng EMAIL_GUI/MAT_KHAU_UNG_DUNG (bắt buộc có mật khẩu); SMTP_AUTH=off cho server giả lập
+SMTP_AUTH = os.getenv("SMTP_AUTH", "on").lower() == "on"
+
+# Số kết nối SMTP giữ sẵn (đã đăng nhập)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "1"))
+
+# Kết nối rảnh quá lâu thì gửi NOOP kiểm tra trước khi dùng lại (giây)
+SMTP_IDLE_CHECK_SECONDS = float(os.getenv("SMTP_IDLE_CHECK_SECONDS", "30"))
+
+# > 0: gom các đơn trong N giây thành một email tổng hợp
+NOTIFY_DIGEST_SECONDS = float(os.getenv("NOTIFY_DIGEST_SECONDS", "0"))
+
+# Outbox thông báo: mỗi đơn cần báo một dòng, ghi cùng lúc với đơn hàng
+NOTIFY_OUTBOX_FILE = os.getenv("NOTIFY_OUTBOX_FILE", "notify_outbox.jsonl")
+
+# Log xác nhận đã gửi (hoặc đã chuyển dead-letter) theo mã đơn
+NOTIFY_ACK_FILE = os.getenv("NOTIFY_ACK_FILE", "notify_acks.jsonl")
+
+# Thông báo gửi thất bại quá NOTIFY_MAX_ATTEMPTS lần được chuyển sang đây
+NOTIFY_DEAD_LETTER_FILE = os.getenv("NOTIFY_DEAD_LETTER_FILE", "notify_dead.jsonl")
+
+# Số thread gửi email (mặc định bằng số kết nối SMTP)
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", str(SMTP_POOL_SIZE)))
+
+# Thử lại với backoff lũy thừa: BASE, 2*BASE, 4*BASE... tối đa MAX giây
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "2"))
+NOTIFY_BACKOFF_MAX = float(os.getenv("NOTIFY_BACKOFF_MAX", "600"))
+
+# Số đơn tối đa trong một email tổng hợp
+NOTIFY_BATCH_MAX = int(os.getenv("NOTIFY_BATCH_MAX", "50"))
+
+# Thu gọn outbox/ack khi đang chạy: sau chừng này ack và không có email đang gửi dở
+NOTIFY_COMPACT_AFTER = int(os.getenv("NOTIFY_COMPACT_AFTER", "200"))
+
+# Chế độ fsync cho outbox/ack, giống ORDER_FSYNC
+NOTIFY_FSYNC = os.getenv("NOTIFY_FSYNC", os.getenv("ORDER_FSYNC", "always")).lower()
+
+
+def _credentials():
+    return os.getenv("EMAIL_GUI"), os.getenv("MAT_KHAU_UNG_DUNG"), os.getenv("EMAIL_NHAN")
+
+
+def _order_lines(order_data):
+    return f"""    👤 Tên: {order_data.get('name')}
+    📞 SĐT: {order_data.get('phone')}
+    🐕 Dịch vụ: {order_data.get('service')}
+    📅 Lịch hẹn: {order_data.get('time')}
+    💰 Giá tạm tính: {order_data.get('price')}"""
+
+
+def build_order_email(order_data, sender: str, receiver: str):
+    """
+    Tạo email thông báo một đơn hàng mới
+
+    Args:
+        order_data: Thông tin đơn hàng
+        sender: Email gửi
+        receiver: Email nhận
+
+    Returns:
+        MIMEText
+    """
+    time_now = datetime.now().strftime("%H:%M - %d/%m/%Y")
+    subject = f"🔔 [ĐƠN MỚI] Khách {order_data.get('name', 'Ẩn danh')} chốt đơn!"
+
+    body = f"""
+    Kính gửi Chủ Shop,
+
+    Khách hàng vừa chốt đơn qua Chatbot Mimi!
+    ----------------------------
+    ⏰ Thời gian: {time_now}
+{_order_lines(order_data)}
+    ----------------------------
+    """
+
+    msg = MIMEText(body, 'plain', 'utf-8')
+    msg['Subject'] = Header(subject, 'utf-8')
+    msg['From'] = sender
+    msg['To'] = receiver
+    return msg
+
+
+def build_digest_email(orders: list, sender: str, receiver: str):
+    """
+    Tạo một email tổng hợp nhiều đơn hàng
+
+    Args:
+        orders: Danh sách đơn hàng
+        sender: Email gửi
+        receiver: Email nhận
+
+    Returns:
+        MIMEText
+    """
+    if len(orders) == 1:
+        return build_order_email(orders[0], sender, receiver)
+
+    time_now = datetime.now().strftime("%H:%M - %d/%m/%Y")
+    subject = f"🔔 [ĐƠN MỚI] {len(orders)} đơn hàng vừa được chốt!"
+    blocks = "\n    ----------------------------\n".join(_order_lines(order) for order in orders)
+
+    body = f"""
+    Kính gửi Chủ Shop,
+
+    Có {len(orders)} đơn hàng mới qua Chatbot Mimi!
+    ⏰ Thời gian: {time_now}
+    ----------------------------
+{blocks}
+    ----------------------------
+    """
+
+    msg = MIMEText(body, 'plain', 'utf-8')
+    msg['Subject'] = Header(subject, 'utf-8')
+    msg['From'] = sender
+    msg['To'] = receiver
+    return msg
+
+
+class SmtpPool:
+    """
+    Giữ sẵn các kết nối SMTP đã đăng nhập để không phải bắt tay TLS và
+    login lại cho mỗi email. Kết nối rảnh lâu được kiểm tra bằng NOOP,
+    kết nối hỏng thì bỏ và mở kết nối mới.
+    """
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, use_ssl: bool = SMTP_SSL,
+                 starttls: bool = SMTP_STARTTLS, size: int = SMTP_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(size)
+        self.connects = 0
+
+    def _connect(self):
+        sender, pwd, _ = _credentials()
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            if self.starttls:
+                conn.starttls()
+        if SMTP_AUTH:
+            conn.login(sender, pwd)
+        self.connects += 1
+        return conn
+
+    def _acquire(self):
+        """Lấy một kết nối còn sống (dùng lại kết nối rảnh nếu có)"""
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < SMTP_IDLE_CHECK_SECONDS:
+                return conn
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except smtplib.SMTPException:
+                pass
+            _close(conn)
+
+    def send(self, msg, sender: str, receiver: str):
+        """
+        Gửi email qua một kết nối trong pool (thử lại một lần nếu server đã ngắt kết nối cũ)
+
+        Args:
+            msg: Email cần gửi
+            sender: Email gửi
+            receiver: Email nhận
+
+        Returns:
+            None
+        """
+        with self._slots:
+            for attempt in range(2):
+                conn = self._acquire()
+                try:
+                    conn.sendmail(sender, receiver, msg.as_string())
+                except smtplib.SMTPResponseException:
+                    # Server trả lỗi (4xx/5xx): không phải do kết nối cũ, để bên gọi quyết định thử lại
+                    _close(conn)
+                    raise
+                except (smtplib.SMTPServerDisconnected, ConnectionError, OSError):
+                    _close(conn)
+                    if attempt == 1:
+                        raise
+                    continue
+                except Exception:
+                    _close(conn)
+                    raise
+                self._idle.put((conn, time.monotonic()))
+                return
+
+    def close(self):
+        """Đóng mọi kết nối rảnh"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close(conn)
+
+
+def _close(conn):
+    try:
+        conn.quit()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _append_lines(path: str, records: list, fsync: bool):
+    """Ghi nối các bản ghi JSON vào cuối file bằng một lần write()"""
+    if not records:
+        return
+    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data)
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_lines(path: str):
+    """Đọc các bản ghi JSONL, bỏ qua dòng hỏng (ví dụ dòng cuối ghi dở khi crash)"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+
+class NotificationOutbox:
+    """
+    Outbox thông báo đơn hàng ghi trên đĩa, giao ít nhất một lần.
+
+    Đơn được ghi vào outbox ngay trong thread ghi đơn, trước khi request
+    nhận mã đơn; một nhóm thread cố định gửi email qua SmtpPool. Gửi xong
+    mới ghi ack, nên sau khi restart các đơn chưa có ack được gửi lại.
+    Gửi lỗi thì thử lại với backoff lũy thừa, quá NOTIFY_MAX_ATTEMPTS lần
+    thì chuyển sang file dead-letter. Outbox/ack được thu gọn lúc khởi động
+    và sau mỗi NOTIFY_COMPACT_AFTER ack để không phình mãi.
+    """
+
+    def __init__(self, pool: SmtpPool, workers: int = NOTIFY_WORKERS, digest_seconds: float = NOTIFY_DIGEST_SECONDS,
+                 outbox_path: str = NOTIFY_OUTBOX_FILE, ack_path: str = NOTIFY_ACK_FILE,
+                 dead_letter_path: str = NOTIFY_DEAD_LETTER_FILE, fsync: bool = NOTIFY_FSYNC == "always"):
+        self.pool = pool
+        self.digest_seconds = digest_seconds
+        self.outbox_path = outbox_path
+        self.ack_path = ack_path
+        self.dead_letter_path = dead_letter_path
+        self.fsync = fsync
+
+        self._cond = threading.Condition()
+        # Heap (thời điểm được gửi, thứ tự, entry) của các thông báo chờ gửi
+        self._due = []
+        self._seq = 0
+        self._in_flight = 0
+        self._acked_since_compact = 0
+        self._stopping = False
+        self.sent = 0
+        self.dead = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=1000)
+
+        self._recover()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"order-notifier-{i}", daemon=True)
+            for i in range(max(workers, 1))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _recover(self):
+        """Nạp lại các thông báo chưa có ack rồi thu gọn outbox/ack"""
+        done = {ack["id"] for ack in _read_lines(self.ack_path)}
+        pending = [entry for entry in _read_lines(self.outbox_path) if entry["id"] not in done]
+        self._rewrite_outbox(pending)
+
+        now = time.time()
+        for entry in pending:
+            self._schedule(entry, now)
+        if pending:
+            print(f"📨 Còn {len(pending)} thông báo đơn hàng chưa gửi, sẽ gửi lại")
+
+    def _rewrite_outbox(self, pending: list):
+        """Ghi lại outbox chỉ với các thông báo chưa gửi (tạm rồi os.replace) và xóa ack"""
+        tmp = self.outbox_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in pending:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.outbox_path)
+        open(self.ack_path, "w").close()
+
+    def _maybe_compact_locked(self):
+        """
+        Thu gọn outbox/ack khi đã đủ NOTIFY_COMPACT_AFTER ack mới (hoặc đã gửi hết)
+        và không có lô nào đang gửi: mọi thông báo chưa ack khi đó đều nằm trong _due
+        """
+        if self._in_flight or not self._acked_since_compact:
+            return
+        if self._due and self._acked_since_compact < NOTIFY_COMPACT_AFTER:
+            return
+        self._rewrite_outbox([entry for _, _, entry in sorted(self._due)])
+        self._acked_since_compact = 0
+
+    def _schedule(self, entry: dict, due: float):
+        heapq.heappush(self._due, (due, self._seq, entry))
+        self._seq += 1
+
+    def record(self, orders: list):
+        """
+        Ghi thông báo cho các đơn vừa lưu vào outbox (bền vững) và xếp lịch gửi
+
+        Args:
+            orders: Các đơn hàng đã có mã
+
+        Returns:
+            None
+        """
+        now = time.time()
+        entries = [{"id": order["id"], "order": order, "enqueued_at": now, "attempts": 0} for order in orders]
+        with self._cond:
+            _append_lines(self.outbox_path, entries, self.fsync)
+            for entry in entries:
+                self._schedule(entry, now + self.digest_seconds)
+            self._cond.notify_all()
+
+    def stop(self):
+        """Chờ các email đang gửi dở rồi dừng; thông báo còn lại nằm trong outbox cho lần chạy sau"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.pool.close()
+
+    def _take_batch(self):
+        """Chờ tới khi có thông báo đến hạn rồi lấy một lô (cả lô khi bật digest)"""
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                now = time.time()
+                if self._due and self._due[0][0] <= now:
+                    break
+                self._cond.wait(self._due[0][0] - now if self._due else None)
+
+            limit = NOTIFY_BATCH_MAX if self.digest_seconds > 0 else 1
+            # Mỗi đơn đến hạn sau digest_seconds kể từ lúc ghi: khi đơn cũ nhất đến hạn,
+            # lấy luôn các đơn ghi trong vòng digest_seconds sau nó (cùng một email)
+            cutoff = max(now, self._due[0][0] + self.digest_seconds)
+            batch = []
+            while self._due and self._due[0][0] <= cutoff and len(batch) < limit:
+                batch.append(heapq.heappop(self._due)[2])
+            self._in_flight += len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self._deliver(batch)
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._maybe_compact_locked()
+
+    def _deliver(self, batch: list):
+        sender, pwd, receiver = _credentials()
+        if not sender or not receiver or (SMTP_AUTH and not pwd):
+            # Chưa cấu hình email: giữ thông báo trong outbox (không ack, không tính lần thử)
+            # để gửi khi cấu hình xong - sau khi khởi động lại, _recover nạp lại từ outbox
+            print(f"❌ Thiếu thông tin Email, giữ {len(batch)} thông báo, thử lại sau {NOTIFY_BACKOFF_MAX:.0f}s")
+            with self._cond:
+                for entry in batch:
+                    self._schedule(entry, time.time() + NOTIFY_BACKOFF_MAX)
+                self._cond.notify_all()
+            return
+
+        orders = [entry["order"] for entry in batch]
+        try:
+            self.pool.send(build_digest_email(orders, sender, receiver), sender, receiver)
+        except Exception as e:
+            print(f"❌ Lỗi gửi mail: {e}")
+            self._retry(batch, str(e))
+            return
+
+        self._ack(batch, "sent")
+        now = time.time()
+        with self._cond:
+            self.sent += len(batch)
+            self._latencies.extend(now - entry["enqueued_at"] for entry in batch)
+        names = ", ".join(str(order.get('name')) for order in orders)
+        print(f"✅ Đã gửi email thành công cho khách: {names}")
+
+    def _ack(self, batch: list, status: str):
+        now = time.time()
+        _append_lines(self.ack_path, [{"id": entry["id"], "status": status, "at": now} for entry in batch], self.fsync)
+        with self._cond:
+            self._acked_since_compact += len(batch)
+
+    def _retry(self, batch: list, error: str):
+        """Xếp lịch gửi lại với backoff lũy thừa (có jitter), quá số lần thì chuyển dead-letter"""
+        now = time.time()
+        dead = []
+        with self._cond:
+            for entry in batch:
+                entry["attempts"] += 1
+                entry["last_error"] = error
+                if entry["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+                    dead.append(entry)
+                    continue
+                delay = min(NOTIFY_BACKOFF_BASE * 2 ** (entry["attempts"] - 1), NOTIFY_BACKOFF_MAX)
+                self._schedule(entry, now + delay * random.uniform(0.8, 1.2))
+                self.retries += 1
+            self.dead += len(dead)
+            self._cond.notify_all()
+
+        if dead:
+            _append_lines(self.dead_letter_path, [dict(entry, failed_at=now) for entry in dead], self.fsync)
+            self._ack(dead, "dead")
+            print(f"☠️  Chuyển {len(dead)} thông báo sang {self.dead_letter_path} sau {NOTIFY_MAX_ATTEMPTS} lần lỗi")
+
+    def status(self):
+        """
+        Tình trạng hàng đợi thông báo cho trang admin
+
+        Returns:
+            dict: {pending, due, retrying, in_flight, oldest_pending_seconds,
+                   sent, retries, dead, latency_seconds: {p50, p95, max}}
+        """
+        now = time.time()
+        with self._cond:
+            entries = [entry for _, _, entry in self._due]
+            due = sum(1 for at, _, _ in self._due if at <= now)
+            in_flight = self._in_flight
+            latencies = list(self._latencies)
+            counters = {"sent": self.sent, "retries": self.retries, "dead": self.dead}
+
+        oldest = min((entry["enqueued_at"] for entry in entries), default=None)
+        return {
+            "pending": len(entries) + in_flight,
+            "due": due,
+            "retrying": sum(1 for entry in entries if entry["attempts"] > 0),
+            "in_flight": in_flight,
+            "oldest_pending_seconds": round(now - oldest, 3) if oldest is not None else None,
+            **counters,
+            "latency_seconds": {
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "max": round(max(latencies), 3) if latencies else None,
+            },
+        }
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_notifier():
+    """
+    Lấy outbox thông báo dùng chung cho cả process (nạp lại thông báo chưa gửi ở lần gọi đầu)
+
+    Returns:
+        NotificationOutbox
+    """
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = NotificationOutbox(SmtpPool())
+    return _outbox
+
+
+def stop_notifier():
+    """Dừng các thread gửi thông báo (gọi khi tắt server)"""
+    global _outbox
+    with _outbox_lock:
+        if _outbox is not None:
+            _outbox.stop()
+            _outbox = None
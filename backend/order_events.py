@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+# Số sự kiện tối đa chờ gửi cho mỗi dashboard trước khi gửi lại snapshot
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Sự kiện đặc biệt: báo dashboard cần nhận lại snapshot đầy đủ
+RESYNC = {"type": "snapshot"}
+
+
+class OrderEventBroker:
+    """
+    Phát sự kiện đơn hàng mới tới các dashboard đang mở kênh SSE.
+    Đơn được ghi trong threadpool, còn SSE chạy trên event loop,
+    nên sự kiện được chuyển qua loop.call_soon_threadsafe().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        """
+        Đăng ký nhận sự kiện (gọi từ trong event loop)
+
+        Returns:
+            asyncio.Queue: hàng đợi sự kiện của subscriber này
+        """
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, queue):
+        """Hủy đăng ký khi dashboard ngắt kết nối"""
+        with self._lock:
+            self._subscribers = {sub for sub in self._subscribers if sub[1] is not queue}
+
+    def publish(self, event: dict):
+        """
+        Gửi sự kiện tới mọi subscriber (an toàn khi gọi từ bất kỳ thread nào)
+
+        Args:
+            event: Nội dung sự kiện
+
+        Returns:
+            None
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_deliver, queue, event)
+            except RuntimeError:
+                # Event loop đã đóng
+                self.unsubscribe(queue)
+
+
+def _deliver(queue, event):
+    """Đưa sự kiện vào hàng đợi; dashboard chậm quá thì bỏ delta, gửi lại snapshot"""
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC)
+
+
+order_events = OrderEventBroker()
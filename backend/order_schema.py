@@ -0,0 +1,220 @@
+import re
+from datetime import datetime
+from shop_data import SERVICES
+from service_index import get_service_index
+
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_price_vnd(price):
+    """
+    Đổi giá dạng chữ sang VND
+
+    Hỗ trợ "300k", "150k/ngày", "1.5tr", "300.000đ", "1.500.000đ", "1,200,000", "300000".
+
+    Args:
+        price: Chuỗi giá (hoặc số)
+
+    Returns:
+        int | None: Giá theo VND, None nếu không đọc được
+    """
+    if isinstance(price, (int, float)):
+        return int(price)
+
+    text = str(price or "").lower().replace(" ", "")
+    match = re.match(r"^(\d{1,3}(?:[.,]\d{3})+|\d+(?:[.,]\d+)?)(k|tr|triệu|trieu)?", text)
+    if not match:
+        return None
+
+    number, unit = match.groups()
+    if not unit:
+        # Không có đơn vị: "1.500.000" / "300,000" là dấu phân cách hàng nghìn
+        return int(number.replace(".", "").replace(",", ""))
+
+    # "1.500k", "1.200.000tr" là phân cách hàng nghìn; "1.5tr", "1,25tr" là số thập phân
+    grouped = re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+", number)
+    if grouped and (unit == "k" or len(re.findall(r"[.,]", number)) > 1):
+        value = float(number.replace(".", "").replace(",", ""))
+    else:
+        value = float(number.replace(",", "."))
+    return int(round(value * (1000 if unit == "k" else 1000000)))
+
+
+def _build_catalog():
+    """Dựng bảng tra gói dịch vụ theo sub id từ SERVICES"""
+    catalog = {}
+    for service_key, service_data in SERVICES.items():
+        for sub in service_data.get("sub_services", []):
+            catalog[sub["id"]] = {
+                "service_key": service_key,
+                "name": sub["name"],
+                "price_vnd": parse_price_vnd(sub["price"]) or 0,
+                # Giá khách sạn tính theo đêm ("150k/ngày")
+                "per_night": "/" in sub["price"],
+            }
+    return catalog
+
+
+SUB_SERVICES = _build_catalog()
+
+
+def resolve_sub_ids(order: dict):
+    """
+    Xác định các gói dịch vụ (sub id) trong đơn hàng
+
+    Ưu tiên danh sách "services" frontend gửi lên ({sub_id} hoặc {subService});
+    đơn cũ chỉ có chuỗi "service" thì tìm tên gói theo từng dòng bằng chỉ mục gói
+    dịch vụ (bỏ dấu, khớp trọn từ, cụm dài nhất trong dòng thắng).
+
+    Args:
+        order: Thông tin đơn hàng
+
+    Returns:
+        list: các sub id theo thứ tự xuất hiện
+    """
+    sub_ids = []
+    for item in order.get("services") or []:
+        if not isinstance(item, dict):
+            continue
+        sub_id = item.get("sub_id") or item.get("subService")
+        if sub_id in SUB_SERVICES:
+            sub_ids.append(sub_id)
+    if sub_ids:
+        return sub_ids
+
+    index = get_service_index()
+    for line in str(order.get("service") or "").splitlines():
+        hits = index.find(line)
+        if hits:
+            # Mỗi dòng là một gói: lấy cụm dài nhất, trùng độ dài thì cụm đứng trước
+            start, end, sub_id = max(hits, key=lambda hit: (hit[1] - hit[0], -hit[0]))
+            sub_ids.append(sub_id)
+    return sub_ids
+
+
+# "3 ngày", "2 đêm" - không tính số trong ngày tháng ("20/10 ngày"), trước ngày tháng
+# ("7 ngày 20/10") hay sau thứ ("thứ 7 ngày 20")
+_STAY_COUNT = re.compile(r"(?<![\d/\-:])(\d+)\s*(?:ngày|đêm|ngay|dem)(?!\s*\d)")
+_WEEKDAY_BEFORE = re.compile(r"(?:thứ|thu)\s*$")
+
+
+def parse_nights(order: dict) -> int:
+    """
+    Số đêm lưu trú cho gói khách sạn
+
+    Lấy từ trường "nights" nếu có, nếu không thì tìm "3 ngày" / "2 đêm" trong giờ hẹn
+    (bỏ qua ngày trong tuần/ngày tháng như "thứ 7 ngày 20/10").
+
+    Args:
+        order: Thông tin đơn hàng
+
+    Returns:
+        int: Số đêm (tối thiểu 1)
+    """
+    try:
+        nights = int(order.get("nights") or 0)
+    except (TypeError, ValueError):
+        nights = 0
+
+    if nights <= 0:
+        nights = 1
+        text = str(order.get("time") or "").lower()
+        for match in _STAY_COUNT.finditer(text):
+            if not _WEEKDAY_BEFORE.search(text[:match.start()]):
+                nights = int(match.group(1))
+                break
+
+    return max(nights, 1)
+
+
+def parse_created_ts(created_at):
+    """
+    Đổi created_at "YYYY-MM-DD HH:MM:SS" sang Unix timestamp
+
+    Returns:
+        int | None
+    """
+    try:
+        return int(datetime.strptime(str(created_at), CREATED_AT_FORMAT).timestamp())
+    except ValueError:
+        return None
+
+
+def normalize_order(order: dict):
+    """
+    Chuẩn hóa đơn hàng lúc ghi: thêm sub_ids, price_vnd (số nguyên),
+    nights, created_ts và price_source. Các trường gốc được giữ nguyên.
+
+    price_source cho biết giá lấy từ đâu:
+    - "catalog": cộng giá gói trong SERVICES (khách sạn nhân số đêm)
+    - "text": không nhận ra gói nào, đọc từ chuỗi "price"
+    - "unknown": không đọc được giá, price_vnd = 0
+
+    Args:
+        order: Thông tin đơn hàng
+
+    Returns:
+        dict: Đơn hàng đã chuẩn hóa (bản sao)
+    """
+    normalized = dict(order)
+    sub_ids = resolve_sub_ids(order)
+    nights = parse_nights(order)
+
+    if sub_ids:
+        price_vnd = sum(
+            SUB_SERVICES[sub_id]["price_vnd"] * (nights if SUB_SERVICES[sub_id]["per_night"] else 1)
+            for sub_id in sub_ids
+        )
+        price_source = "catalog"
+    else:
+        price_vnd = parse_price_vnd(order.get("price"))
+        price_source = "text" if price_vnd is not None else "unknown"
+        if price_vnd is None:
+            print(f"⚠️  Không đọc được giá đơn hàng: {order.get('price')!r}")
+            price_vnd = 0
+
+    normalized["sub_ids"] = sub_ids
+    normalized["service_keys"] = sorted({SUB_SERVICES[sub_id]["service_key"] for sub_id in sub_ids})
+    normalized["nights"] = nights if any(SUB_SERVICES[sub_id]["per_night"] for sub_id in sub_ids) else 0
+    normalized["price_vnd"] = price_vnd
+    normalized["price_source"] = price_source
+    normalized["created_ts"] = parse_created_ts(order.get("created_at"))
+    return normalized
+
+
+def line_items(order: dict):
+    """
+    Tách đơn đã chuẩn hóa thành từng dòng dịch vụ kèm doanh thu
+
+    Đơn không nhận ra gói nào trả về một dòng (None, None, price_vnd).
+
+    Args:
+        order: Đơn hàng đã chuẩn hóa
+
+    Returns:
+        list: [(service_key, sub_id, doanh thu VND)]
+    """
+    if order["price_source"] != "catalog":
+        return [(None, None, order["price_vnd"])]
+
+    items = []
+    for sub_id in order["sub_ids"]:
+        sub = SUB_SERVICES[sub_id]
+        price = sub["price_vnd"] * (order["nights"] if sub["per_night"] else 1)
+        items.append((sub["service_key"], sub_id, price))
+    return items
+
+
+def ensure_normalized(order: dict):
+    """
+    Trả về đơn đã chuẩn hóa (đơn ghi trước khi có schema mới thì chuẩn hóa lại)
+
+    Args:
+        order: Thông tin đơn hàng
+
+    Returns:
+        dict
+    """
+    if "price_vnd" in order and "sub_ids" in order:
+        return order
+    return normalize_order(order)
@@ -0,0 +1,109 @@
+import threading
+from datetime import datetime
+from order_store import get_order_store
+from order_schema import ensure_normalized
+
+
+class OrderStats:
+    """
+    Bộ đếm doanh thu / số đơn cập nhật dần mỗi khi ghi đơn mới.
+    Giữ tổng toàn bộ và tổng theo từng ngày, nên /api/stats là O(1).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total_orders = 0
+        self.total_revenue = 0
+        self.daily = {}
+        self.version = 0
+
+    def rebuild(self, daily_totals: dict):
+        """
+        Dựng lại bộ đếm từ tổng theo ngày của store (chạy lúc khởi động)
+
+        Args:
+            daily_totals: {"YYYY-MM-DD": (số đơn, doanh thu VND)}
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.daily = {day: list(totals) for day, totals in daily_totals.items()}
+            self.total_orders = sum(count for count, _ in self.daily.values())
+            self.total_revenue = sum(revenue for _, revenue in self.daily.values())
+            self.version += 1
+
+    def add(self, order: dict):
+        """
+        Cộng một đơn hàng vừa ghi vào bộ đếm
+
+        Args:
+            order: Thông tin đơn hàng (đã có created_at)
+
+        Returns:
+            None
+        """
+        price = ensure_normalized(order)["price_vnd"]
+        day = str(order.get("created_at", ""))[:10]
+        with self._lock:
+            self.total_orders += 1
+            self.total_revenue += price
+            bucket = self.daily.setdefault(day, [0, 0])
+            bucket[0] += 1
+            bucket[1] += price
+            self.version += 1
+
+    def snapshot(self, today: str = None):
+        """
+        Lấy thống kê hiện tại
+
+        Args:
+            today: Ngày cần lấy "YYYY-MM-DD" (mặc định hôm nay)
+
+        Returns:
+            dict: {total_orders, total_revenue, today_orders, today_revenue}
+        """
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            today_orders, today_revenue = self.daily.get(today, (0, 0))
+            return {
+                "total_orders": self.total_orders,
+                "total_revenue": self.total_revenue,
+                "today_orders": today_orders,
+                "today_revenue": today_revenue,
+            }
+
+    def etag(self, variant: str = "", today: str = None):
+        """
+        ETag cho /api/stats: đổi khi có đơn mới hoặc khi sang ngày mới
+
+        Args:
+            variant: Phân biệt các dạng response khác nhau của cùng số liệu
+            today: Ngày hiện tại "YYYY-MM-DD" (mặc định hôm nay)
+
+        Returns:
+            str: ETag (đã có dấu nháy kép)
+        """
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        return f'"{self.version}-{today}-{variant}"'
+
+
+_stats = None
+_stats_lock = threading.Lock()
+
+
+def get_order_stats():
+    """
+    Lấy bộ đếm dùng chung cho cả process (dựng từ store ở lần gọi đầu)
+
+    Returns:
+        OrderStats
+    """
+    global _stats
+    if _stats is None:
+        with _stats_lock:
+            if _stats is None:
+                stats = OrderStats()
+                stats.rebuild(get_order_store().daily_totals())
+                _stats = stats
+    return _stats
@@ -0,0 +1,1005 @@
+import os
+import re
+import json
+import sqlite3
+import bisect
+import threading
+from datetime import datetime
+from order_schema import SUB_SERVICES, normalize_order, ensure_normalized, line_items
+
+# File log đơn hàng dạng JSONL (mỗi dòng một đơn, chỉ ghi nối thêm)
+ORDER_LOG_FILE = os.getenv("ORDER_LOG_FILE", "orders.jsonl")
+
+# File JSON cũ (một mảng lớn) - chỉ dùng để migrate một lần
+LEGACY_ORDER_FILE = os.getenv("LEGACY_ORDER_FILE", "orders.json")
+
+# Chế độ fsync sau mỗi lần ghi: "always" (an toàn nhất) hoặc "off" (để OS tự flush)
+ORDER_FSYNC = os.getenv("ORDER_FSYNC", "always").lower()
+
+# Backend lưu đơn hàng: "jsonl" (mặc định), "sqlite" hoặc "segments" (mỗi tháng một file)
+ORDER_STORE = os.getenv("ORDER_STORE", "jsonl").lower()
+
+# Thư mục chứa các segment tháng khi ORDER_STORE=segments
+ORDER_SEGMENT_DIR = os.getenv("ORDER_SEGMENT_DIR", "orders")
+
+# File SQLite khi ORDER_STORE=sqlite
+ORDER_DB_FILE = os.getenv("ORDER_DB_FILE", "orders.db")
+
+# Giữ danh sách đơn đã parse trong bộ nhớ (kiểm tra lại bằng inode/size/mtime): "on" | "off"
+ORDER_READ_CACHE = os.getenv("ORDER_READ_CACHE", "on").lower() == "on"
+
+
+def match_order(order: dict, date_from: str = None, date_to: str = None, phone: str = None, service: str = None):
+    """
+    Kiểm tra đơn hàng có khớp bộ lọc hay không
+
+    Args:
+        order: Thông tin đơn hàng
+        date_from: Từ ngày "YYYY-MM-DD" (tính cả ngày này)
+        date_to: Đến ngày "YYYY-MM-DD" (tính cả ngày này)
+        phone: SĐT (khớp chính xác)
+        service: Mã dịch vụ ("spa") hoặc mã gói ("spa_1")
+
+    Returns:
+        bool
+    """
+    day = str(order.get("created_at", ""))[:10]
+    if date_from and day < date_from:
+        return False
+    if date_to and day > date_to:
+        return False
+    if phone and str(order.get("phone", "")) != phone:
+        return False
+    if service:
+        normalized = ensure_normalized(order)
+        if service not in normalized["sub_ids"] and service not in normalized["service_keys"]:
+            return False
+    return True
+
+
+def parse_cursor(cursor: str):
+    """
+    Số trong cursor phân trang (vị trí byte trong log hoặc id trong SQLite)
+
+    Returns:
+        int | None: None nếu không có cursor
+
+    Raises:
+        ValueError: Cursor không phải số không âm
+    """
+    if not cursor:
+        return None
+    if not str(cursor).isdigit():
+        raise ValueError(f"cursor không hợp lệ: {cursor!r}")
+    return int(cursor)
+
+
+def summarize_orders(orders):
+    """
+    Tổng hợp một nhóm đơn: số đơn, doanh thu, tổng theo dịch vụ và theo ngày
+
+    Args:
+        orders: iterable các đơn hàng
+
+    Returns:
+        dict: {orders, revenue, services: {key: {orders, revenue}}, daily: {ngày: [số đơn, doanh thu]}}
+    """
+    summary = {"orders": 0, "revenue": 0, "services": {}, "daily": {}}
+    for order in orders:
+        order = ensure_normalized(order)
+        summary["orders"] += 1
+        summary["revenue"] += order["price_vnd"]
+
+        day = summary["daily"].setdefault(str(order.get("created_at", ""))[:10], [0, 0])
+        day[0] += 1
+        day[1] += order["price_vnd"]
+
+        seen = set()
+        for service_key, _, price in line_items(order):
+            service_key = service_key or "other"
+            totals = summary["services"].setdefault(service_key, {"orders": 0, "revenue": 0})
+            totals["revenue"] += price
+            if service_key not in seen:
+                totals["orders"] += 1
+                seen.add(service_key)
+    return summary
+
+
+def _summaries_by_month(orders):
+    """Tổng hợp theo tháng bằng cách duyệt toàn bộ đơn hàng"""
+    by_month = {}
+    for order in orders:
+        by_month.setdefault(str(order.get("created_at", ""))[:7], []).append(order)
+    return {month: summarize_orders(month_orders) for month, month_orders in sorted(by_month.items())}
+
+
+class JsonlOrderLog:
+    """
+    Log đơn hàng append-only: mỗi đơn là một dòng JSON.
+    Chi phí ghi không phụ thuộc vào số đơn đã lưu.
+
+    Khi bật read cache, các đơn đã parse được giữ trong bộ nhớ cùng vị trí
+    byte của từng dòng. Cache được kiểm tra bằng (inode, size, mtime): file
+    không đổi thì không đọc đĩa, file dài thêm thì chỉ parse phần mới, còn
+    đơn do chính process này ghi thì được nối thẳng vào cache.
+    """
+
+    def __init__(self, path: str, fsync: str = "always", read_cache: bool = ORDER_READ_CACHE):
+        self.path = path
+        self.fsync = fsync
+        self.read_cache = read_cache
+        self._lock = threading.Lock()
+        self._tail_checked = False
+        self._cache_lock = threading.Lock()
+        self._reset_cache()
+
+    def _reset_cache(self):
+        self._cache_key = None
+        self._cache_offset = 0
+        self._starts = []
+        self._ends = []
+        self._orders = []
+
+    def append(self, order: dict):
+        """
+        Ghi nối một đơn hàng vào cuối log
+
+        Args:
+            order: Thông tin đơn hàng
+
+        Returns:
+            None
+        """
+        self.append_many([order])
+
+    def append_many(self, orders: list):
+        """
+        Ghi nối nhiều đơn hàng bằng một lần write() duy nhất
+
+        O_APPEND đảm bảo mỗi lần write() được đặt vào cuối file, kể cả khi
+        nhiều process cùng ghi, nên các đơn không bao giờ ghi đè lên nhau.
+
+        Args:
+            orders: Danh sách đơn hàng
+
+        Returns:
+            None
+        """
+        if not orders:
+            return
+
+        lines = [(json.dumps(order, ensure_ascii=False) + "\n").encode("utf-8") for order in orders]
+        data = b"".join(lines)
+
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size_before = os.fstat(fd).st_size
+                if not self._tail_checked:
+                    # Dòng cuối bị cắt ngang (crash khi đang ghi) thì xuống dòng trước,
+                    # để đơn mới không bị dính vào dòng hỏng
+                    if size_before:
+                        with open(self.path, "rb") as f:
+                            f.seek(size_before - 1)
+                            if f.read(1) != b"\n":
+                                data = b"\n" + data
+                    self._tail_checked = True
+                view = memoryview(data)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                if self.fsync == "always":
+                    os.fsync(fd)
+                if self.read_cache:
+                    self._extend_cache(size_before, len(data) - sum(map(len, lines)), lines, orders, os.fstat(fd))
+            finally:
+                os.close(fd)
+
+    def _extend_cache(self, size_before: int, prefix: int, lines: list, orders: list, st):
+        """Nối các đơn vừa ghi vào cache nếu không có process khác ghi xen vào"""
+        with self._cache_lock:
+            if (
+                self._cache_key is None
+                or self._cache_key[0] != st.st_ino
+                or self._cache_offset != size_before
+                or st.st_size != size_before + prefix + sum(map(len, lines))
+            ):
+                return
+
+            offset = size_before + prefix
+            for line, order in zip(lines, orders):
+                self._starts.append(offset)
+                offset += len(line)
+                self._ends.append(offset)
+                self._orders.append(order)
+            self._cache_offset = offset
+            self._cache_key = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _cached_rows(self):
+        """
+        Lấy cache đã kiểm tra lại với file trên đĩa
+
+        Returns:
+            tuple: (starts, ends, orders, số dòng) - các list chỉ được nối thêm,
+            nên người đọc dùng số dòng tại thời điểm gọi
+        """
+        with self._cache_lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset_cache()
+                return self._starts, self._ends, self._orders, 0
+
+            key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            if key != self._cache_key:
+                if self._cache_key is not None and self._cache_key[0] == st.st_ino and st.st_size >= self._cache_offset:
+                    # File chỉ dài thêm: parse phần mới từ vị trí đã đọc
+                    start = self._cache_offset
+                else:
+                    # File bị thay thế hoặc ngắn đi: đọc lại từ đầu
+                    self._reset_cache()
+                    start = 0
+                for line_start, line_end, order in self._scan(start):
+                    if order is not None:
+                        self._starts.append(line_start)
+                        self._ends.append(line_end)
+                        self._orders.append(order)
+                    self._cache_offset = line_end
+                self._cache_key = key
+
+            return self._starts, self._ends, self._orders, len(self._orders)
+
+    def iter_orders(self):
+        """
+        Đọc lần lượt từng đơn hàng trong log
+
+        Dòng hỏng (ví dụ bị cắt ngang do mất điện khi đang ghi) sẽ bị bỏ qua.
+
+        Returns:
+            generator: các dict đơn hàng theo thứ tự ghi
+        """
+        for _, order in self.query():
+            yield order
+
+    def _decode(self, offset: int, line: bytes):
+        """Giải mã một dòng log, trả về None nếu dòng trống hoặc hỏng"""
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            return json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"⚠️  Bỏ qua dòng hỏng tại byte {offset} trong {self.path}")
+            return None
+
+    def _scan(self, start: int):
+        """Đọc xuôi từ byte start, trả về (offset đầu dòng, offset cuối dòng, đơn hàng hoặc None)"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                # Dòng cuối chưa có "\n" là dòng đang ghi dở, chưa đọc
+                if not line.endswith(b"\n"):
+                    break
+                yield offset, offset + len(line), self._decode(offset, line)
+                offset += len(line)
+
+    def _iter_forward(self, start: int):
+        """Đọc xuôi từ byte start, trả về (offset dòng kế tiếp, đơn hàng)"""
+        for _, line_end, order in self._scan(start):
+            if order is not None:
+                yield line_end, order
+
+    def _iter_cached(self, position: int, newest_first: bool):
+        """Như _iter_forward / _iter_backward nhưng đọc từ cache"""
+        starts, ends, orders, count = self._cached_rows()
+        if newest_first:
+            index = (bisect.bisect_left(starts, position, 0, count) if position is not None else count) - 1
+            while index >= 0:
+                yield starts[index], orders[index]
+                index -= 1
+        else:
+            index = bisect.bisect_left(starts, position or 0, 0, count)
+            while index < count:
+                yield ends[index], orders[index]
+                index += 1
+
+    def _iter_backward(self, end: int = None, block_size: int = 64 * 1024):
+        """Đọc ngược từng khối từ byte end về đầu file, trả về (offset đầu dòng, đơn hàng)"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            if end is None:
+                end = f.seek(0, os.SEEK_END)
+                # Bỏ phần cuối chưa có "\n" (dòng đang ghi dở)
+                while end > 0:
+                    step = min(block_size, end)
+                    f.seek(end - step)
+                    newline = f.read(step).rfind(b"\n")
+                    if newline >= 0:
+                        end = end - step + newline + 1
+                        break
+                    end -= step
+
+            pos = end
+            tail = b""
+            while pos > 0:
+                size = min(block_size, pos)
+                pos -= size
+                f.seek(pos)
+                lines = (f.read(size) + tail).split(b"\n")
+                # Phần đầu khối có thể là nửa dòng, để dành ghép với khối trước
+                tail = lines[0]
+                offset = pos + len(tail) + 1
+                complete = []
+                for line in lines[1:]:
+                    complete.append((offset, line))
+                    offset += len(line) + 1
+                for line_offset, line in reversed(complete):
+                    order = self._decode(line_offset, line)
+                    if order is not None:
+                        yield line_offset, order
+            if tail:
+                order = self._decode(0, tail)
+                if order is not None:
+                    yield 0, order
+
+    def query(self, date_from: str = None, date_to: str = None, phone: str = None,
+              service: str = None, cursor: str = None, newest_first: bool = False):
+        """
+        Duyệt đơn hàng theo bộ lọc, bắt đầu từ cursor (không đọc cả file vào bộ nhớ)
+
+        Cursor là vị trí byte trong log nên trang sau chỉ đọc tiếp từ đó.
+
+        Args:
+            date_from, date_to, phone, service: Bộ lọc (xem match_order)
+            cursor: Cursor trả về từ lần duyệt trước
+            newest_first: Duyệt từ đơn mới nhất về cũ nhất
+
+        Returns:
+            generator: các cặp (cursor, đơn hàng)
+
+        Raises:
+            ValueError: Cursor không hợp lệ (khi bắt đầu duyệt)
+        """
+        position = parse_cursor(cursor)
+        if self.read_cache:
+            rows = self._iter_cached(position, newest_first)
+        elif newest_first:
+            rows = self._iter_backward(position)
+        else:
+            rows = self._iter_forward(position or 0)
+
+        for next_cursor, order in rows:
+            if match_order(order, date_from, date_to, phone, service):
+                yield str(next_cursor), order
+
+    def load_orders(self):
+        """
+        Đọc toàn bộ đơn hàng trong log
+
+        Returns:
+            list: danh sách đơn hàng
+        """
+        if self.read_cache:
+            _, _, orders, count = self._cached_rows()
+            return orders[:count]
+        return list(self.iter_orders())
+
+    def daily_totals(self):
+        """
+        Tính số đơn và doanh thu theo từng ngày bằng cách quét log
+
+        Returns:
+            dict: {"YYYY-MM-DD": (số đơn, doanh thu VND)}
+        """
+        totals = {}
+        for order in self.iter_orders():
+            day = str(order.get("created_at", ""))[:10]
+            count, revenue = totals.get(day, (0, 0))
+            totals[day] = (count + 1, revenue + ensure_normalized(order)["price_vnd"])
+        return totals
+
+    def monthly_summaries(self):
+        """
+        Tổng hợp theo tháng (quét toàn bộ log)
+
+        Returns:
+            dict: {"YYYY-MM": summary} (xem summarize_orders)
+        """
+        return _summaries_by_month(self.iter_orders())
+
+
+class SqliteOrderStore:
+    """
+    Lưu đơn hàng trong SQLite (chế độ WAL) với index trên created_at,
+    phone và dịch vụ để truy vấn admin không phải quét toàn bộ lịch sử.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL DEFAULT '',
+        phone TEXT NOT NULL DEFAULT '',
+        service TEXT NOT NULL DEFAULT '',
+        price_vnd INTEGER NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+    CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders(phone);
+    CREATE INDEX IF NOT EXISTS idx_orders_service ON orders(service);
+    CREATE TABLE IF NOT EXISTS order_services (
+        order_id INTEGER NOT NULL REFERENCES orders(id),
+        service_key TEXT NOT NULL DEFAULT '',
+        sub_id TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS idx_order_services_key ON order_services(service_key, order_id);
+    CREATE INDEX IF NOT EXISTS idx_order_services_sub ON order_services(sub_id, order_id);
+    """
+
+    def __init__(self, path: str, fsync: str = "always"):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        """Mỗi thread dùng một connection riêng"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=" + ("FULL" if self.fsync == "always" else "NORMAL"))
+            self._local.conn = conn
+        return conn
+
+    def append(self, order: dict):
+        """
+        Thêm một đơn hàng
+
+        Args:
+            order: Thông tin đơn hàng
+
+        Returns:
+            None
+        """
+        self.append_many([order])
+
+    def append_many(self, orders: list):
+        """
+        Thêm nhiều đơn hàng trong một transaction
+
+        Args:
+            orders: Danh sách đơn hàng
+
+        Returns:
+            None
+        """
+        if not orders:
+            return
+
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                for order in orders:
+                    normalized = ensure_normalized(order)
+                    cur = conn.execute(
+                        "INSERT INTO orders (created_at, phone, service, price_vnd, data) VALUES (?, ?, ?, ?, ?)",
+                        (
+                            str(order.get("created_at", "")),
+                            str(order.get("phone", "")),
+                            str(order.get("service", "")),
+                            normalized["price_vnd"],
+                            json.dumps(normalized, ensure_ascii=False),
+                        ),
+                    )
+                    conn.executemany(
+                        "INSERT INTO order_services (order_id, service_key, sub_id) VALUES (?, ?, ?)",
+                        [
+                            (cur.lastrowid, SUB_SERVICES[sub_id]["service_key"], sub_id)
+                            for sub_id in normalized["sub_ids"]
+                        ],
+                    )
+
+    def is_empty(self):
+        """Kiểm tra bảng orders còn trống hay không"""
+        return self._conn().execute("SELECT 1 FROM orders LIMIT 1").fetchone() is None
+
+    def iter_orders(self):
+        """
+        Đọc lần lượt từng đơn hàng theo thứ tự ghi
+
+        Returns:
+            generator: các dict đơn hàng
+        """
+        for _, order in self.query():
+            yield order
+
+    def query(self, date_from: str = None, date_to: str = None, phone: str = None,
+              service: str = None, cursor: str = None, newest_first: bool = False,
+              batch_size: int = 500):
+        """
+        Duyệt đơn hàng theo bộ lọc bằng truy vấn có index
+
+        Cursor là id của đơn cuối cùng đã trả về (keyset pagination). Mỗi lô
+        được fetchall() ngay nên generator có thể được đọc tiếp từ thread khác.
+
+        Args:
+            date_from, date_to, phone, service: Bộ lọc (xem match_order)
+            cursor: Cursor trả về từ lần duyệt trước
+            newest_first: Duyệt từ đơn mới nhất về cũ nhất
+            batch_size: Số dòng mỗi lần truy vấn
+
+        Returns:
+            generator: các cặp (cursor, đơn hàng)
+        """
+        where = []
+        params = []
+        if date_from:
+            where.append("created_at >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("created_at < ?")
+            params.append(date_to + "~")
+        if phone:
+            where.append("phone = ?")
+            params.append(phone)
+        if service:
+            where.append(
+                "id IN (SELECT order_id FROM order_services WHERE service_key = ? "
+                "UNION SELECT order_id FROM order_services WHERE sub_id = ?)"
+            )
+            params.extend([service, service])
+
+        last_id = parse_cursor(cursor)
+        while True:
+            clauses = list(where)
+            page_params = list(params)
+            if last_id is not None:
+                clauses.append("id < ?" if newest_first else "id > ?")
+                page_params.append(last_id)
+            sql = "SELECT id, data FROM orders"
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            sql += " ORDER BY id " + ("DESC" if newest_first else "ASC") + " LIMIT ?"
+            page_params.append(batch_size)
+
+            rows = self._conn().execute(sql, page_params).fetchall()
+            for order_id, data in rows:
+                yield str(order_id), json.loads(data)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def load_orders(self):
+        """
+        Đọc toàn bộ đơn hàng
+
+        Returns:
+            list: danh sách đơn hàng
+        """
+        return list(self.iter_orders())
+
+    def daily_totals(self):
+        """
+        Tính số đơn và doanh thu theo từng ngày bằng một truy vấn GROUP BY
+
+        Returns:
+            dict: {"YYYY-MM-DD": (số đơn, doanh thu VND)}
+        """
+        rows = self._conn().execute(
+            "SELECT substr(created_at, 1, 10), COUNT(*), COALESCE(SUM(price_vnd), 0) "
+            "FROM orders GROUP BY substr(created_at, 1, 10)"
+        )
+        return {day: (count, revenue) for day, count, revenue in rows}
+
+    def monthly_summaries(self):
+        """
+        Tổng hợp theo tháng (duyệt toàn bộ bảng orders)
+
+        Returns:
+            dict: {"YYYY-MM": summary} (xem summarize_orders)
+        """
+        return _summaries_by_month(self.iter_orders())
+
+
+class SegmentedOrderStore:
+    """
+    Lịch sử đơn hàng chia thành segment theo tháng (thư mục/YYYY-MM.jsonl).
+
+    Tháng đã qua được "đóng": file segment chuyển sang chỉ đọc và có thêm
+    YYYY-MM.summary.json (số đơn, doanh thu, tổng theo dịch vụ và theo
+    ngày). Thống kê các tháng đã đóng lấy từ summary, còn truy vấn gần đây
+    (lọc theo ngày) chỉ mở segment của tháng đó.
+    """
+
+    SEGMENT_PATTERN = re.compile(r"^(\d{4}-\d{2})\.jsonl$")
+
+    def __init__(self, directory: str, fsync: str = "always", read_cache: bool = ORDER_READ_CACHE):
+        self.directory = directory
+        self.fsync = fsync
+        self.read_cache = read_cache
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._summaries = {}
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            match = self.SEGMENT_PATTERN.match(name)
+            if match:
+                self._segments[match.group(1)] = self._open(match.group(1))
+
+        self.seal_closed_segments()
+
+    def _open(self, month: str):
+        return JsonlOrderLog(os.path.join(self.directory, f"{month}.jsonl"), fsync=self.fsync, read_cache=self.read_cache)
+
+    def _summary_path(self, month: str):
+        return os.path.join(self.directory, f"{month}.summary.json")
+
+    def is_closed(self, month: str):
+        """Segment đã đóng (có summary) thì không bao giờ ghi thêm"""
+        return month in self._summaries or os.path.exists(self._summary_path(month))
+
+    def summary(self, month: str):
+        """
+        Summary của một tháng đã đóng (đọc file một lần rồi giữ trong bộ nhớ)
+
+        Returns:
+            dict | None
+        """
+        if month not in self._summaries:
+            if not os.path.exists(self._summary_path(month)):
+                return None
+            with open(self._summary_path(month), "r", encoding="utf-8") as f:
+                self._summaries[month] = json.load(f)
+        return self._summaries[month]
+
+    def seal(self, month: str):
+        """
+        Đóng segment: ghi summary (tạm rồi os.replace) và chuyển file sang chỉ đọc
+
+        Args:
+            month: "YYYY-MM"
+
+        Returns:
+            dict: summary vừa ghi
+        """
+        segment = self._segments[month]
+        summary = summarize_orders(segment.iter_orders())
+
+        tmp_path = self._summary_path(month) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._summary_path(month))
+        os.chmod(segment.path, 0o444)
+
+        self._summaries[month] = summary
+        print(f"✅ Đã đóng segment {month}: {summary['orders']} đơn")
+        return summary
+
+    def seal_closed_segments(self, current_month: str = None):
+        """Đóng mọi segment của các tháng trước tháng hiện tại"""
+        current_month = current_month or datetime.now().strftime("%Y-%m")
+        for month in list(self._segments):
+            if month < current_month and not self.is_closed(month):
+                self.seal(month)
+
+    def append(self, order: dict):
+        """
+        Ghi nối một đơn hàng vào segment của tháng đó
+
+        Args:
+            order: Thông tin đơn hàng
+
+        Returns:
+            None
+        """
+        self.append_many([order])
+
+    def append_many(self, orders: list):
+        """
+        Ghi nối nhiều đơn, mỗi tháng một lần write()
+
+        Đơn thuộc tháng đã đóng (tạo trước nửa đêm cuối tháng, ghi xong sau đó)
+        vẫn vào segment của tháng đó: segment được mở lại, ghi nối rồi đóng lại
+        (tính lại summary) để truy vấn theo ngày và tổng hợp tháng thấy đơn này.
+
+        Args:
+            orders: Danh sách đơn hàng
+
+        Returns:
+            None
+        """
+        if not orders:
+            return
+
+        current_month = datetime.now().strftime("%Y-%m")
+        with self._lock:
+            by_month = {}
+            for order in orders:
+                month = str(order.get("created_at", ""))[:7] or current_month
+                by_month.setdefault(month, []).append(order)
+
+            for month, month_orders in sorted(by_month.items()):
+                if month not in self._segments:
+                    self._segments[month] = self._open(month)
+                if self.is_closed(month):
+                    self._append_late(month, month_orders)
+                else:
+                    self._segments[month].append_many(month_orders)
+
+            # Sang tháng mới thì đóng các tháng trước
+            self.seal_closed_segments(current_month)
+
+    def _append_late(self, month: str, orders: list):
+        """Ghi đơn đến muộn vào segment đã đóng: mở quyền ghi, ghi nối, đóng lại với summary mới"""
+        segment = self._segments[month]
+        os.chmod(segment.path, 0o644)
+        try:
+            segment.append_many(orders)
+        finally:
+            self.seal(month)
+        print(f"⚠️  Ghi {len(orders)} đơn đến muộn vào segment đã đóng {month}")
+
+    def _months(self, date_from: str = None, date_to: str = None):
+        """Các tháng có segment, bỏ qua tháng nằm ngoài khoảng ngày"""
+        return [
+            month for month in sorted(self._segments)
+            if (not date_from or month >= date_from[:7]) and (not date_to or month <= date_to[:7])
+        ]
+
+    def query(self, date_from: str = None, date_to: str = None, phone: str = None,
+              service: str = None, cursor: str = None, newest_first: bool = False):
+        """
+        Duyệt đơn hàng theo bộ lọc, chỉ mở các segment nằm trong khoảng ngày
+
+        Cursor có dạng "YYYY-MM:vị trí byte trong segment".
+
+        Args:
+            date_from, date_to, phone, service: Bộ lọc (xem match_order)
+            cursor: Cursor trả về từ lần duyệt trước
+            newest_first: Duyệt từ đơn mới nhất về cũ nhất
+
+        Returns:
+            generator: các cặp (cursor, đơn hàng)
+
+        Raises:
+            ValueError: Cursor không hợp lệ (khi bắt đầu duyệt)
+        """
+        if cursor and not re.fullmatch(r"\d{4}-\d{2}:\d+", cursor):
+            raise ValueError(f"cursor không hợp lệ: {cursor!r}")
+        cursor_month, position = cursor.split(":", 1) if cursor else (None, None)
+        months = self._months(date_from, date_to)
+        if newest_first:
+            months = [month for month in reversed(months) if not cursor_month or month <= cursor_month]
+        else:
+            months = [month for month in months if not cursor_month or month >= cursor_month]
+
+        for month in months:
+            segment_cursor = position if month == cursor_month else None
+            rows = self._segments[month].query(date_from, date_to, phone, service, segment_cursor, newest_first)
+            for row_cursor, order in rows:
+                yield f"{month}:{row_cursor}", order
+
+    def iter_orders(self):
+        """
+        Đọc lần lượt từng đơn hàng của mọi segment theo thứ tự ghi
+
+        Returns:
+            generator: các dict đơn hàng
+        """
+        for _, order in self.query():
+            yield order
+
+    def load_orders(self):
+        """
+        Đọc toàn bộ đơn hàng
+
+        Returns:
+            list: danh sách đơn hàng
+        """
+        return list(self.iter_orders())
+
+    def daily_totals(self):
+        """
+        Số đơn và doanh thu theo ngày: tháng đã đóng lấy từ summary,
+        chỉ segment đang mở phải quét
+
+        Returns:
+            dict: {"YYYY-MM-DD": (số đơn, doanh thu VND)}
+        """
+        totals = {}
+        for month in sorted(self._segments):
+            if self.is_closed(month):
+                daily = {day: tuple(value) for day, value in self.summary(month)["daily"].items()}
+            else:
+                daily = self._segments[month].daily_totals()
+            for day, (count, revenue) in daily.items():
+                old_count, old_revenue = totals.get(day, (0, 0))
+                totals[day] = (old_count + count, old_revenue + revenue)
+        return totals
+
+    def monthly_summaries(self):
+        """
+        Tổng hợp theo tháng: tháng đã đóng đọc từ summary, tháng đang mở quét segment
+
+        Returns:
+            dict: {"YYYY-MM": summary} (xem summarize_orders)
+        """
+        return {
+            month: self.summary(month) if self.is_closed(month) else summarize_orders(self._segments[month].iter_orders())
+            for month in sorted(self._segments)
+        }
+
+
+def write_segments(orders, directory: str):
+    """
+    Chia đơn hàng thành các segment tháng (dùng cho compaction offline)
+
+    Mỗi segment được ghi ra file tạm rồi os.replace(). Các tháng đã qua sẽ
+    được đóng (có summary) khi SegmentedOrderStore mở thư mục này.
+
+    Args:
+        orders: iterable các đơn hàng
+        directory: Thư mục đích (phải chưa có segment nào)
+
+    Returns:
+        dict: {"YYYY-MM": số đơn}
+    """
+    os.makedirs(directory, exist_ok=True)
+    if any(SegmentedOrderStore.SEGMENT_PATTERN.match(name) for name in os.listdir(directory)):
+        raise ValueError(f"Thư mục {directory} đã có segment")
+
+    files = {}
+    counts = {}
+    try:
+        for order in orders:
+            order = ensure_normalized(order)
+            month = str(order.get("created_at", ""))[:7] or datetime.now().strftime("%Y-%m")
+            if month not in files:
+                files[month] = open(os.path.join(directory, f"{month}.jsonl.tmp"), "w", encoding="utf-8")
+            files[month].write(json.dumps(order, ensure_ascii=False) + "\n")
+            counts[month] = counts.get(month, 0) + 1
+    finally:
+        for f in files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+    for month in files:
+        path = os.path.join(directory, f"{month}.jsonl")
+        os.replace(path + ".tmp", path)
+    return counts
+
+
+def migrate_legacy_orders(log: JsonlOrderLog, legacy_path: str = LEGACY_ORDER_FILE):
+    """
+    Chuyển orders.json cũ sang log JSONL (chỉ chạy một lần)
+
+    Mỗi đơn được chuẩn hóa (normalize_order) trên đường đi. Log mới được ghi
+    ra file tạm rồi os.replace() nên không bao giờ có log dở dang. Sau khi
+    xong, file cũ được đổi tên thành *.migrated. File cũ hỏng thì dừng migrate
+    và giữ nguyên file để sửa tay, không tạo log rỗng thay cho dữ liệu cũ.
+
+    Args:
+        log: Log đích
+        legacy_path: Đường dẫn file JSON cũ
+
+    Returns:
+        int: số đơn đã migrate (0 nếu không cần migrate)
+
+    Raises:
+        ValueError: File cũ không phải danh sách đơn hàng JSON hợp lệ
+    """
+    if not os.path.exists(legacy_path):
+        return 0
+
+    if os.path.exists(log.path):
+        print(f"⚠️  Đã có {log.path}, bỏ qua migrate {legacy_path}")
+        return 0
+
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        content = f.read()
+    try:
+        # File rỗng là chưa có đơn nào
+        orders = json.loads(content) if content.strip() else []
+    except json.JSONDecodeError as e:
+        print(f"❌ {legacy_path} bị hỏng ({e}), dừng migrate và giữ nguyên file")
+        raise ValueError(f"Không đọc được {legacy_path}: {e}") from e
+    if not isinstance(orders, list):
+        print(f"❌ {legacy_path} không phải danh sách đơn hàng, dừng migrate và giữ nguyên file")
+        raise ValueError(f"{legacy_path} không phải danh sách đơn hàng")
+
+    tmp_path = log.path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for order in orders:
+            f.write(json.dumps(normalize_order(order), ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, log.path)
+    os.replace(legacy_path, legacy_path + ".migrated")
+
+    print(f"✅ Đã migrate {len(orders)} đơn hàng từ {legacy_path} sang {log.path}")
+    return len(orders)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def import_log_into_sqlite(log: JsonlOrderLog, db: SqliteOrderStore):
+    """
+    Nạp log JSONL vào SQLite khi database còn trống (chỉ chạy một lần)
+
+    Args:
+        log: Log JSONL nguồn
+        db: Store SQLite đích
+
+    Returns:
+        int: số đơn đã nạp
+    """
+    if not db.is_empty():
+        return 0
+
+    orders = log.load_orders()
+    db.append_many(orders)
+    if orders:
+        print(f"✅ Đã nạp {len(orders)} đơn hàng từ {log.path} vào {db.path}")
+    return len(orders)
+
+
+def import_log_into_segments(log: JsonlOrderLog, directory: str):
+    """
+    Chia log JSONL thành segment tháng khi thư mục segment còn trống (chỉ chạy một lần)
+
+    Args:
+        log: Log JSONL nguồn
+        directory: Thư mục segment
+
+    Returns:
+        int: số đơn đã chia
+    """
+    if os.path.isdir(directory) and any(SegmentedOrderStore.SEGMENT_PATTERN.match(name) for name in os.listdir(directory)):
+        return 0
+
+    counts = write_segments(log.iter_orders(), directory)
+    if counts:
+        print(f"✅ Đã chia {sum(counts.values())} đơn hàng từ {log.path} thành {len(counts)} segment trong {directory}")
+    return sum(counts.values())
+
+
+def get_order_store():
+    """
+    Lấy store đơn hàng dùng chung cho cả process theo ORDER_STORE
+    (tự migrate dữ liệu cũ lần đầu)
+
+    Returns:
+        JsonlOrderLog | SqliteOrderStore | SegmentedOrderStore
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                log = JsonlOrderLog(ORDER_LOG_FILE, fsync=ORDER_FSYNC, read_cache=ORDER_READ_CACHE and ORDER_STORE == "jsonl")
+                migrate_legacy_orders(log)
+                if ORDER_STORE == "sqlite":
+                    db = SqliteOrderStore(ORDER_DB_FILE, fsync=ORDER_FSYNC)
+                    import_log_into_sqlite(log, db)
+                    _store = db
+                elif ORDER_STORE == "segments":
+                    import_log_into_segments(log, ORDER_SEGMENT_DIR)
+                    _store = SegmentedOrderStore(ORDER_SEGMENT_DIR, fsync=ORDER_FSYNC)
+                else:
+                    _store = log
+    return _store
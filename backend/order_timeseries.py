@@ -0,0 +1,272 @@
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from order_store import get_order_store
+from order_schema import SUB_SERVICES, ensure_normalized, line_items
+from shop_data import SERVICES
+
+BUCKETS = ("hour", "day", "week")
+GROUP_BYS = ("none", "service", "sub_service")
+
+# Đơn không nhận ra gói nào được xếp vào nhóm "other"
+OTHER = "other"
+SERVICE_CODES = list(SERVICES.keys()) + [OTHER]
+SUB_SERVICE_CODES = list(SUB_SERVICES.keys()) + [OTHER]
+SERVICE_CODE_OF = {key: code for code, key in enumerate(SERVICE_CODES)}
+SUB_SERVICE_CODE_OF = {sub_id: code for code, sub_id in enumerate(SUB_SERVICE_CODES)}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _local_seconds(created_at) -> int:
+    """Giờ địa phương của created_at tính bằng giây kể từ 1970 (không đổi múi giờ)"""
+    try:
+        return int((datetime.strptime(str(created_at), "%Y-%m-%d %H:%M:%S") - EPOCH).total_seconds())
+    except ValueError:
+        return -1
+
+
+def _day_number(date_str: str) -> int:
+    """"YYYY-MM-DD" -> số ngày kể từ 1970-01-01"""
+    return (datetime.strptime(date_str, "%Y-%m-%d") - EPOCH).days
+
+
+def _bucket_label(day: int, slot: int, bucket: str) -> str:
+    """Nhãn của một bucket: giờ "YYYY-MM-DD HH:00", ngày, hoặc thứ Hai đầu tuần"""
+    if bucket == "week":
+        # 1970-01-01 là thứ Năm
+        day -= (day + 3) % 7
+    date = EPOCH + timedelta(days=day)
+    if bucket == "hour":
+        return date.strftime("%Y-%m-%d") + f" {slot:02d}:00"
+    return date.strftime("%Y-%m-%d")
+
+
+class _Column:
+    """Mảng numpy tự nới dung lượng (gấp đôi) khi ghi nối"""
+
+    def __init__(self, dtype):
+        self.data = np.zeros(1024, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            grown = np.zeros(max(needed, len(self.data) * 2), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class OrderTimeseries:
+    """
+    Bản sao dạng cột (numpy) của lịch sử đơn hàng để gom nhóm theo
+    giờ/ngày/tuần và theo dịch vụ bằng phép toán vector.
+
+    Mỗi đơn có một dòng ở bảng order (thời gian, doanh thu) và một dòng
+    cho mỗi gói ở bảng item (đơn, thời gian, dịch vụ, gói, doanh thu).
+    Kết quả của các ngày đã qua được cache theo ngày; đơn ghi muộn thuộc
+    một ngày đã cache (tạo trước nửa đêm, ghi xong sau) xóa cache của ngày đó.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.order_t = _Column(np.int64)
+        self.order_price = _Column(np.int64)
+        self.item_order = _Column(np.int64)
+        self.item_t = _Column(np.int64)
+        self.item_service = _Column(np.int64)
+        self.item_sub = _Column(np.int64)
+        self.item_price = _Column(np.int64)
+        # {(theo giờ?, group_by): {ngày: [(slot, mã nhóm, số đơn, doanh thu)]}}
+        self._closed_days = {}
+
+    def _explode(self, orders: list, first_index: int):
+        """Tách đơn hàng thành các cột order / item"""
+        columns = {name: [] for name in ("order_t", "order_price", "item_order", "item_t",
+                                         "item_service", "item_sub", "item_price")}
+        for index, order in enumerate(orders, first_index):
+            order = ensure_normalized(order)
+            t = _local_seconds(order.get("created_at"))
+            columns["order_t"].append(t)
+            columns["order_price"].append(order["price_vnd"])
+
+            items = [
+                (SERVICE_CODE_OF[service_key or OTHER], SUB_SERVICE_CODE_OF[sub_id or OTHER], price)
+                for service_key, sub_id, price in line_items(order)
+            ]
+
+            for service_code, sub_code, price in items:
+                columns["item_order"].append(index)
+                columns["item_t"].append(t)
+                columns["item_service"].append(service_code)
+                columns["item_sub"].append(sub_code)
+                columns["item_price"].append(price)
+        return columns
+
+    def _extend(self, orders: list):
+        columns = self._explode(orders, self.order_t.size)
+        for name, values in columns.items():
+            getattr(self, name).extend(values)
+
+    def rebuild(self, orders):
+        """
+        Dựng lại toàn bộ các cột từ lịch sử đơn hàng
+
+        Args:
+            orders: iterable các đơn hàng
+
+        Returns:
+            None
+        """
+        orders = list(orders)
+        with self._lock:
+            self._reset()
+            self._extend(orders)
+
+    def add(self, order: dict):
+        """
+        Ghi nối một đơn vừa lưu
+
+        Args:
+            order: Thông tin đơn hàng
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._extend([order])
+            day = self.order_t.view()[-1] // 86400
+            for cache in self._closed_days.values():
+                cache.pop(day, None)
+
+    def _aggregate(self, day_mask, hourly: bool, group_by: str):
+        """
+        Gom nhóm vector hóa theo (ngày, giờ, nhóm) cho các dòng thỏa day_mask
+
+        Returns:
+            dict: {ngày: [(slot, mã nhóm, số đơn, doanh thu)]}
+        """
+        if group_by == "none":
+            t = self.order_t.view()
+            price = self.order_price.view()
+            group = np.zeros(len(t), dtype=np.int64)
+            order_idx = np.arange(len(t), dtype=np.int64)
+            n_groups = 1
+        else:
+            t = self.item_t.view()
+            price = self.item_price.view()
+            if group_by == "service":
+                group = self.item_service.view()
+                n_groups = len(SERVICE_CODES)
+            else:
+                group = self.item_sub.view()
+                n_groups = len(SUB_SERVICE_CODES)
+            order_idx = self.item_order.view()
+
+        day = t // 86400
+        mask = day_mask(day) & (t >= 0)
+        t, price, group, order_idx, day = t[mask], price[mask], group[mask], order_idx[mask], day[mask]
+        if len(t) == 0:
+            return {}
+
+        slot = (t % 86400) // 3600 if hourly else np.zeros(len(t), dtype=np.int64)
+        key = (day * 24 + slot) * n_groups + group
+
+        keys, inverse = np.unique(key, return_inverse=True)
+        revenue = np.bincount(inverse, weights=price, minlength=len(keys))
+
+        # Một đơn có nhiều gói cùng nhóm chỉ tính là một đơn
+        n_orders = max(self.order_t.size, 1)
+        distinct = np.unique(key * n_orders + order_idx) // n_orders
+        counts = np.bincount(np.searchsorted(keys, distinct), minlength=len(keys))
+
+        result = {}
+        for k, count, total in zip(keys.tolist(), counts.tolist(), revenue.tolist()):
+            group_code = k % n_groups
+            day_slot = k // n_groups
+            result.setdefault(day_slot // 24, []).append((day_slot % 24, group_code, count, int(total)))
+        return result
+
+    def query(self, bucket: str = "day", group_by: str = "none", date_from: str = None, date_to: str = None):
+        """
+        Doanh thu / số đơn theo thời gian
+
+        Args:
+            bucket: "hour" | "day" | "week"
+            group_by: "none" | "service" | "sub_service"
+            date_from: Từ ngày "YYYY-MM-DD" (mặc định 30 ngày trước)
+            date_to: Đến ngày "YYYY-MM-DD" (mặc định hôm nay)
+
+        Returns:
+            list: [{bucket, group, orders, revenue}] theo thứ tự thời gian
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket phải là một trong {BUCKETS}")
+        if group_by not in GROUP_BYS:
+            raise ValueError(f"group_by phải là một trong {GROUP_BYS}")
+
+        today = _day_number(datetime.now().strftime("%Y-%m-%d"))
+        first = _day_number(date_from) if date_from else today - 30
+        last = _day_number(date_to) if date_to else today
+        hourly = bucket == "hour"
+        codes = SERVICE_CODES if group_by == "service" else SUB_SERVICE_CODES
+
+        with self._lock:
+            # Ngày đã qua: lấy từ cache, chỉ tính các ngày chưa có trong cache
+            cache = self._closed_days.setdefault((hourly, group_by), {})
+            missing = [day for day in range(first, min(last, today - 1) + 1) if day not in cache]
+            if missing:
+                missing_days = np.array(missing, dtype=np.int64)
+                computed = self._aggregate(lambda d: np.isin(d, missing_days), hourly, group_by)
+                for day in missing:
+                    cache[day] = computed.get(day, [])
+
+            # Hôm nay (và sau đó) vẫn còn đơn mới nên luôn tính lại
+            open_rows = {}
+            if last >= today:
+                open_rows = self._aggregate(lambda d: (d >= max(first, today)) & (d <= last), hourly, group_by)
+
+        merged = {}
+        for day in range(first, last + 1):
+            rows = cache.get(day) if day < today else open_rows.get(day)
+            for slot, group_code, count, revenue in rows or []:
+                label = _bucket_label(day, slot, bucket)
+                group = None if group_by == "none" else codes[group_code]
+                totals = merged.setdefault((label, group), [0, 0])
+                totals[0] += count
+                totals[1] += revenue
+
+        return [
+            {"bucket": label, "group": group, "orders": count, "revenue": revenue}
+            for (label, group), (count, revenue) in sorted(merged.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+        ]
+
+
+_timeseries = None
+_timeseries_lock = threading.Lock()
+
+
+def get_order_timeseries():
+    """
+    Lấy bản sao dạng cột dùng chung cho cả process (dựng từ store ở lần gọi đầu)
+
+    Returns:
+        OrderTimeseries
+    """
+    global _timeseries
+    if _timeseries is None:
+        with _timeseries_lock:
+            if _timeseries is None:
+                timeseries = OrderTimeseries()
+                timeseries.rebuild(get_order_store().iter_orders())
+                _timeseries = timeseries
+    return _timeseries
@@ -0,0 +1,156 @@
+import os
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import Future
+from order_store import get_order_store
+
+# Gom các đơn đến trong cửa sổ này (ms) vào một lần ghi + một lần fsync
+ORDER_COMMIT_WINDOW_MS = float(os.getenv("ORDER_COMMIT_WINDOW_MS", "5"))
+
+# Số đơn tối đa trong một lần ghi
+ORDER_COMMIT_MAX_BATCH = int(os.getenv("ORDER_COMMIT_MAX_BATCH", "256"))
+
+# Thời gian tối đa request chờ đơn được ghi xong (giây)
+ORDER_COMMIT_TIMEOUT = float(os.getenv("ORDER_COMMIT_TIMEOUT", "30"))
+
+_STOP = object()
+
+
+class OrderCommitPending(Exception):
+    """Hết ORDER_COMMIT_TIMEOUT mà đơn chưa ghi xong; đơn vẫn trong hàng đợi và sẽ được ghi với order_id"""
+
+    def __init__(self, order_id: str):
+        super().__init__(f"Đơn {order_id} chưa ghi xong sau {ORDER_COMMIT_TIMEOUT:g}s, vẫn đang chờ ghi")
+        self.order_id = order_id
+
+# Các hàm được gọi (trong thread ghi) sau khi một lô đơn đã ghi bền vững
+_commit_listeners = []
+
+
+def add_commit_listener(listener):
+    """
+    Đăng ký hàm nhận danh sách đơn vừa ghi xong (chạy theo đúng thứ tự ghi)
+
+    Args:
+        listener: hàm nhận list các đơn hàng
+
+    Returns:
+        None
+    """
+    _commit_listeners.append(listener)
+
+
+class OrderWriter:
+    """
+    Thread ghi đơn duy nhất: các request đẩy đơn vào hàng đợi và nhận
+    Future; thread này gom mọi đơn đến trong một cửa sổ ngắn thành một
+    lần ghi bền vững (group commit) rồi trả mã đơn qua Future.
+    """
+
+    def __init__(self, store, window_ms: float = ORDER_COMMIT_WINDOW_MS, max_batch: int = ORDER_COMMIT_MAX_BATCH):
+        self.store = store
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, order: dict) -> Future:
+        """
+        Đưa đơn vào hàng đợi ghi. Mã đơn (order["id"]) được gán ngay để người gọi
+        hết thời gian chờ vẫn biết mã của đơn sẽ được ghi.
+
+        Args:
+            order: Đơn hàng đã chuẩn hóa
+
+        Returns:
+            Future: trả về mã đơn khi đã ghi xong, hoặc exception nếu ghi lỗi
+        """
+        order.setdefault("id", uuid.uuid4().hex[:12])
+        future = Future()
+        self._queue.put((order, future))
+        return future
+
+    def stop(self):
+        """Ghi nốt các đơn còn trong hàng đợi rồi dừng thread"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self):
+        """Chờ đơn đầu tiên, sau đó gom thêm các đơn đến trong cửa sổ"""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        stopping = False
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        return batch, stopping
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        orders = [order for order, _ in batch]
+
+        try:
+            self.store.append_many(orders)
+        except Exception as e:
+            print(f"❌ Lỗi ghi {len(orders)} đơn hàng: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for listener in _commit_listeners:
+            try:
+                listener(orders)
+            except Exception as e:
+                print(f"⚠️  Lỗi xử lý sau khi ghi đơn: {e}")
+
+        for order, future in batch:
+            future.set_result(order["id"])
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_order_writer():
+    """
+    Lấy thread ghi đơn dùng chung cho cả process
+
+    Returns:
+        OrderWriter
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = OrderWriter(get_order_store())
+    return _writer
+
+
+def stop_order_writer():
+    """Dừng thread ghi đơn (gọi khi tắt server)"""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+            _writer = None
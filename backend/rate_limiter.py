@@ -0,0 +1,396 @@
+import os
+import re
+import heapq
+import time
+import asyncio
+import itertools
+import threading
+
+# Hạn mức mặc định của Groq cho model chat (free tier llama-3.3-70b); được chỉnh
+# lại theo header x-ratelimit-* của từng response
+GROQ_RPM = float(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = float(os.getenv("GROQ_TPM", "12000"))
+# Số request tối đa được xếp hàng chờ lượt; vượt thì từ chối ngay
+GROQ_QUEUE_MAX = int(os.getenv("GROQ_QUEUE_MAX", "500"))
+
+# Độ ưu tiên (số nhỏ được phục vụ trước)
+PRIORITY_CHAT = 0          # completion trả lời khách (và tóm tắt lịch sử phải có trước nó)
+PRIORITY_ASSIST = 1        # phân loại cảm xúc (lỗi thì dùng "neutral")
+PRIORITY_BACKGROUND = 2    # trích xuất dịch vụ/thông tin khách, tóm tắt chạy nền
+
+# Thời gian chờ lượt tối đa theo độ ưu tiên (giây)
+QUEUE_TIMEOUTS = {
+    PRIORITY_CHAT: float(os.getenv("GROQ_QUEUE_WAIT_CHAT", "20")),
+    PRIORITY_ASSIST: float(os.getenv("GROQ_QUEUE_WAIT_ASSIST", "5")),
+    PRIORITY_BACKGROUND: float(os.getenv("GROQ_QUEUE_WAIT_BACKGROUND", "60")),
+}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class RateLimitTimeout(Exception):
+    """Không tới lượt gọi Groq trong thời gian chờ cho phép (rate limit phía client)"""
+
+
+def parse_duration(value) -> float:
+    """
+    Đổi thời gian dạng header của Groq ("7.66s", "2m59.56s", "120ms", "30") ra giây
+
+    Returns:
+        float hoặc None nếu không đọc được
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_number(headers, name: str):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Bucket nạp đều `rate` đơn vị/giây, chứa tối đa `capacity`"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Số giây tới khi có `amount` (sau refill), kể cả khi `amount` lớn hơn capacity"""
+        missing = amount - self.level
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cost", "deadline", "granted", "removed", "_wake")
+
+    def __init__(self, priority: int, seq: int, cost: float, deadline: float, wake):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.deadline = deadline
+        self.granted = False
+        self.removed = False
+        self._wake = wake
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def wake(self):
+        self._wake()
+
+
+class RateLimiter:
+    """
+    Giới hạn tốc độ gọi Groq phía client, dùng chung cho client đồng bộ và async.
+
+    Hai token bucket: số request/phút và số token/phút. Request chờ lượt trong
+    hàng đợi ưu tiên (chat của khách trước, trích xuất chạy nền sau; cùng độ ưu
+    tiên thì ai đến trước được trước), nên khi traffic dồn dập các lời gọi được
+    giãn ra thay vì nhận 429. Bucket được chỉnh theo header x-ratelimit-* của
+    Groq; khi vẫn bị 429 thì cả hàng đợi dừng tới hết retry-after.
+
+    Mỗi request có hạn chờ: nếu ước lượng thời gian tới lượt (theo các request
+    đứng trước và tốc độ nạp bucket) đã vượt hạn thì từ chối ngay bằng
+    RateLimitTimeout thay vì bắt khách chờ rồi mới báo lỗi.
+    """
+
+    def __init__(self, rpm: float = GROQ_RPM, tpm: float = GROQ_TPM, max_queue: int = GROQ_QUEUE_MAX):
+        self.requests = TokenBucket(rpm, rpm / 60)
+        self.tokens = TokenBucket(tpm, tpm / 60)
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._blocked_until = 0.0
+        self._stats = {
+            "admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0, "rate_limited": 0,
+            "wait_ms": 0.0, "max_wait_ms": 0.0, "header_updates": 0, "released": 0,
+        }
+
+    # --- Chờ lượt ---
+
+    def acquire(self, cost: float, priority: int = PRIORITY_CHAT, deadline: float = None):
+        """
+        Chờ tới lượt gọi Groq (chặn thread hiện tại)
+
+        Args:
+            cost: Số token ước lượng của request (prompt + completion)
+            priority: PRIORITY_CHAT | PRIORITY_ASSIST | PRIORITY_BACKGROUND
+            deadline: Mốc time.monotonic() phải có lượt trước đó (mặc định theo QUEUE_TIMEOUTS)
+
+        Raises:
+            RateLimitTimeout: Hàng đợi đầy hoặc không tới lượt trước deadline
+        """
+        event = threading.Event()
+        waiter = self._enqueue(cost, priority, deadline, event.set)
+        started = time.monotonic()
+        try:
+            while True:
+                timeout = self._poll(waiter)
+                if timeout is None:
+                    break
+                event.wait(timeout)
+                event.clear()
+        finally:
+            self._leave(waiter, started)
+
+    async def aacquire(self, cost: float, priority: int = PRIORITY_CHAT, deadline: float = None):
+        """Như acquire nhưng chờ không chặn event loop"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop đã đóng
+                pass
+
+        waiter = self._enqueue(cost, priority, deadline, wake)
+        started = time.monotonic()
+        try:
+            while True:
+                timeout = self._poll(waiter)
+                if timeout is None:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            self._leave(waiter, started)
+
+    def try_acquire(self, cost: float, priority: int = PRIORITY_CHAT) -> bool:
+        """
+        Lấy lượt ngay nếu không có request cùng/ưu tiên cao hơn đang chờ và bucket đủ
+        (không xếp hàng; dùng cho request phụ như hedging)
+
+        Returns:
+            bool: True nếu đã lấy lượt
+        """
+        now = time.monotonic()
+        with self._lock:
+            if any(not w.removed and w.priority <= priority for w in self._queue):
+                return False
+            if self._expected_wait_locked(cost, priority, now) > 0:
+                return False
+            self.requests.take(1)
+            self.tokens.take(min(cost, self.tokens.capacity))
+            self._stats["admitted"] += 1
+            return True
+
+    def release(self, cost: float):
+        """
+        Trả lại token đã giữ cho một request bị hủy trước khi trả lời (request phụ
+        thua khi hedging); lượt request vẫn tính vì request đã được gửi
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.tokens.refill(now)
+            self.tokens.give_back(min(cost, self.tokens.capacity))
+            self._stats["released"] += 1
+            head = next((w for w in self._queue if not w.removed), None)
+        if head is not None:
+            head.wake()
+
+    def _enqueue(self, cost: float, priority: int, deadline: float, wake):
+        now = time.monotonic()
+        if deadline is None:
+            deadline = now + QUEUE_TIMEOUTS.get(priority, QUEUE_TIMEOUTS[PRIORITY_BACKGROUND])
+        with self._lock:
+            if sum(1 for w in self._queue if not w.removed) >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise RateLimitTimeout(f"Groq rate limit: hàng đợi đầy ({self.max_queue} request)")
+            expected = self._expected_wait_locked(cost, priority, now)
+            if now + expected > deadline:
+                self._stats["rejected"] += 1
+                raise RateLimitTimeout(f"Groq rate limit: cần chờ khoảng {expected:.1f}s, quá hạn chờ")
+            waiter = _Waiter(priority, next(self._seq), cost, deadline, wake)
+            heapq.heappush(self._queue, waiter)
+            self._stats["queued"] += 1
+        return waiter
+
+    def _expected_wait_locked(self, cost: float, priority: int, now: float) -> float:
+        """Ước lượng thời gian tới lượt: các request cùng/ưu tiên cao hơn đang chờ đi trước"""
+        ahead = [w for w in self._queue if not w.removed and w.priority <= priority]
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        capacity = self.tokens.capacity
+        return max(
+            self._blocked_until - now,
+            self.requests.wait_time(len(ahead) + 1),
+            self.tokens.wait_time(sum(min(w.cost, capacity) for w in ahead) + min(cost, capacity)),
+        )
+
+    def _poll(self, waiter: _Waiter):
+        """
+        Cấp lượt cho các request đầu hàng đợi nếu bucket đủ
+
+        Returns:
+            None nếu waiter đã có lượt, ngược lại số giây chờ trước khi kiểm tra lại
+
+        Raises:
+            RateLimitTimeout: Quá deadline của waiter
+        """
+        now = time.monotonic()
+        with self._lock:
+            head_wait = self._dispatch_locked(now)
+            if waiter.granted:
+                return None
+            if now >= waiter.deadline:
+                waiter.removed = True
+                self._stats["timed_out"] += 1
+                raise RateLimitTimeout("Groq rate limit: hết thời gian chờ lượt")
+            timeout = waiter.deadline - now
+            if self._queue and self._queue[0] is waiter:
+                # Request đầu hàng tự hẹn giờ tới khi bucket đủ; các request sau chờ được đánh thức
+                timeout = min(timeout, head_wait)
+            return timeout
+
+    def _dispatch_locked(self, now: float) -> float:
+        """Cấp lượt theo thứ tự ưu tiên; trả về thời gian request đầu hàng còn phải chờ"""
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while self._queue:
+            head = self._queue[0]
+            if head.removed:
+                heapq.heappop(self._queue)
+                continue
+            # Request lớn hơn capacity chỉ cần chờ bucket đầy
+            wait = max(self._blocked_until - now, self.requests.wait_time(1),
+                       self.tokens.wait_time(min(head.cost, self.tokens.capacity)))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(min(head.cost, self.tokens.capacity))
+            head.granted = True
+            head.wake()
+        return 0.0
+
+    def _leave(self, waiter: _Waiter, started: float):
+        waited_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            if waiter.granted:
+                self._stats["admitted"] += 1
+                self._stats["wait_ms"] += waited_ms
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], waited_ms)
+            else:
+                # Bị hủy (task cancel) hoặc quá hạn: bỏ khỏi hàng đợi
+                waiter.removed = True
+            head = next((w for w in self._queue if not w.removed), None)
+        if head is not None:
+            head.wake()
+
+    # --- Cập nhật theo phản hồi của Groq ---
+
+    def observe(self, headers, cost: float = 0, used: float = None):
+        """
+        Chỉnh bucket theo header x-ratelimit-* của response thành công
+
+        Args:
+            headers: Header của response
+            cost: Số token đã trừ lúc cấp lượt
+            used: Số token thực tế (usage.total_tokens) nếu biết, phần dư được trả lại
+        """
+        limit_tokens = _header_number(headers, "x-ratelimit-limit-tokens")
+        remaining_tokens = _header_number(headers, "x-ratelimit-remaining-tokens")
+        remaining_requests = _header_number(headers, "x-ratelimit-remaining-requests")
+        reset_requests = parse_duration(headers.get("x-ratelimit-reset-requests"))
+
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            if used is not None and used < cost:
+                self.tokens.give_back(cost - used)
+            if limit_tokens:
+                # Hạn mức token của Groq tính theo phút
+                self.tokens.capacity = limit_tokens
+                self.tokens.rate = limit_tokens / 60
+            if remaining_tokens is not None:
+                self.tokens.level = min(self.tokens.level, remaining_tokens)
+            if remaining_requests is not None and remaining_requests < 1 and reset_requests:
+                # Hết hạn mức request trong ngày: dừng tới khi Groq nạp lại
+                self._blocked_until = max(self._blocked_until, now + reset_requests)
+            if limit_tokens or remaining_tokens is not None or remaining_requests is not None:
+                self._stats["header_updates"] += 1
+            head = next((w for w in self._queue if not w.removed), None)
+        if head is not None:
+            head.wake()
+
+    def rate_limited(self, headers):
+        """
+        Groq trả 429: dừng cả hàng đợi tới hết retry-after (hoặc thời gian nạp lại token)
+
+        Returns:
+            float: Số giây tạm dừng
+        """
+        pause = (parse_duration(headers.get("retry-after"))
+                 or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                 or 1.0)
+        now = time.monotonic()
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, now + pause)
+            self._stats["rate_limited"] += 1
+        return pause
+
+    def stats(self):
+        """
+        Returns:
+            dict: {queue, queue_by_priority, requests_available, tokens_available, rpm, tpm, paused_s,
+                   admitted, queued, rejected, timed_out, rate_limited, avg_wait_ms, max_wait_ms, header_updates,
+                   released}
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            waiting = [w for w in self._queue if not w.removed]
+            stats = dict(self._stats)
+            result = {
+                "queue": len(waiting),
+                "queue_by_priority": {p: sum(1 for w in waiting if w.priority == p) for p in sorted(QUEUE_TIMEOUTS)},
+                "requests_available": round(self.requests.level, 2),
+                "tokens_available": round(self.tokens.level),
+                "rpm": round(self.requests.rate * 60, 2),
+                "tpm": round(self.tokens.rate * 60),
+                "paused_s": round(max(0.0, self._blocked_until - now), 2),
+            }
+        admitted = stats.pop("admitted")
+        wait_ms = stats.pop("wait_ms")
+        return dict(
+            result,
+            admitted=admitted,
+            avg_wait_ms=round(wait_ms / admitted, 1) if admitted else None,
+            max_wait_ms=round(stats.pop("max_wait_ms"), 1),
+            **stats,
+        )
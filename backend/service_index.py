@@ -0,0 +1,161 @@
+import re
+import threading
+from collections import deque
+from text_utils import fold_vietnamese, tokenize
+from shop_data import SERVICES
+
+# Cách khách hay gọi các gói ngoài tên chính thức. Viết có dấu hay không đều được
+# (cả hai phía được bỏ dấu khi so khớp). Tránh từ đơn dễ trùng nghĩa khác, vd. "nhật"
+# (chủ nhật) hay "thường" (bình thường).
+SERVICE_ALIASES = {
+    "spa_1": ["gói thơm tho", "thơm tho"],
+    "spa_2": ["gói sạch sẽ", "sạch sẽ"],
+    "spa_3": ["gói siêu cấp", "siêu cấp"],
+    "style_1": ["teddy", "teddy bear", "kiểu gấu", "mặt gấu"],
+    "style_2": ["kiểu nhật", "cắt nhật", "style nhật", "kiểu nhật bản", "japanese", "japan"],
+    "style_3": ["summer", "summer cut", "cắt mùa hè"],
+    "style_4": ["bờm sư tử", "sư tử", "lion"],
+    "style_5": ["trái tim", "hình tim", "heart"],
+    "hotel_1": ["phòng thường", "phòng thg", "phòng tiêu chuẩn", "phòng bình thường", "phòng standard"],
+    "hotel_2": ["phòng vip", "vip"],
+}
+
+
+def _phrase(text: str):
+    return tuple(tokenize(fold_vietnamese(text)))
+
+
+def _catalog_aliases(name: str):
+    """
+    Tên gói, tên bỏ phần trong ngoặc, bỏ tiền tố "Kiểu" (nếu còn từ hai từ trở lên,
+    "Kiểu Nhật" -> "Nhật" dễ nhầm với "chủ nhật"), và chữ trong ngoặc nếu không
+    phải khoảng cân nặng
+    """
+    base = re.sub(r"\s*\(.*?\)", "", name).strip()
+    aliases = {name, base}
+    if fold_vietnamese(base).startswith("kieu ") and len(base.split()) > 2:
+        aliases.add(base.split(" ", 1)[1])
+    for inner in re.findall(r"\((.*?)\)", name):
+        if not re.search(r"\d", inner):
+            aliases.add(inner)
+    return aliases
+
+
+class ServiceIndex:
+    """
+    Chỉ mục tên gói dịch vụ để tìm gói trong tin nhắn khách mà không gọi LLM.
+
+    Tên và bí danh được bỏ dấu, tách từ một lần rồi dựng thành automaton
+    Aho-Corasick trên từ: mỗi tin nhắn chỉ cần duyệt các từ của nó một lượt,
+    không phụ thuộc số gói, và chỉ khớp trọn từ ("vip" không khớp "vipro").
+    """
+
+    def __init__(self, services: dict = None, aliases: dict = None):
+        services = SERVICES if services is None else services
+        aliases = SERVICE_ALIASES if aliases is None else aliases
+
+        self.subs = {}
+        patterns = {}
+        for service_key, service_data in services.items():
+            for sub in service_data.get("sub_services", []):
+                self.subs[sub["id"]] = {
+                    "service_key": service_key,
+                    "sub_id": sub["id"],
+                    "name": sub["name"],
+                    "price": sub["price"],
+                }
+                for alias in _catalog_aliases(sub["name"]) | set(aliases.get(sub["id"], [])):
+                    phrase = _phrase(alias)
+                    if phrase:
+                        patterns.setdefault(phrase, set()).add(sub["id"])
+
+        # Cụm trùng nhau giữa nhiều gói không xác định được gói nào, bỏ qua
+        self.patterns = {phrase: next(iter(ids)) for phrase, ids in patterns.items() if len(ids) == 1}
+        self._build(self.patterns)
+
+    def _build(self, patterns: dict):
+        # Trạng thái i: _goto[i] = {từ: trạng thái tiếp}, _out[i] = [(độ dài cụm, sub id)]
+        self._goto = [{}]
+        self._out = [[]]
+        for phrase, sub_id in patterns.items():
+            state = 0
+            for token in phrase:
+                if token not in self._goto[state]:
+                    self._goto.append({})
+                    self._out.append([])
+                    self._goto[state][token] = len(self._goto) - 1
+                state = self._goto[state][token]
+            self._out[state].append((len(phrase), sub_id))
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str):
+        """
+        Tìm mọi cụm tên gói trong text
+
+        Returns:
+            list: [(vị trí từ bắt đầu, vị trí kết thúc, sub id)]
+        """
+        hits = []
+        state = 0
+        for position, token in enumerate(tokenize(fold_vietnamese(text))):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for length, sub_id in self._out[state]:
+                hits.append((position - length + 1, position + 1, sub_id))
+        return hits
+
+    def match(self, text: str):
+        """
+        Các gói dịch vụ khách nhắc tới, theo thứ tự xuất hiện
+
+        Cụm dài nhất được ưu tiên và các cụm không chồng lên nhau ("phòng vip"
+        thắng "vip"), mỗi gói chỉ trả về một lần.
+
+        Args:
+            text: Tin nhắn của khách
+
+        Returns:
+            list: [{service_key, sub_id, name, price}]
+        """
+        hits = sorted(self.find(text), key=lambda hit: (hit[0], -(hit[1] - hit[0])))
+        matched = []
+        covered_until = 0
+        for start, end, sub_id in hits:
+            if start < covered_until:
+                continue
+            covered_until = end
+            if sub_id not in matched:
+                matched.append(sub_id)
+        return [dict(self.subs[sub_id]) for sub_id in matched]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_service_index():
+    """
+    Lấy chỉ mục gói dịch vụ (dựng ở lần gọi đầu)
+
+    Returns:
+        ServiceIndex
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ServiceIndex()
+    return _index
+
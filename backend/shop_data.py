@@ -247,5 +247,14 @@ NHẬN DIỆN CẢM XÚC KHÁCH HÀNG:
 """
 
 
+# Dùng khi EMOTION_MODE=inline: model tự nhận diện cảm xúc ngay trong câu trả lời
+EMOTION_TAG_INSTRUCTION = """
+TỰ NHẬN DIỆN CẢM XÚC:
+- Trước khi trả lời, xác định cảm xúc của khách trong tin nhắn cuối: annoyed, worried, happy hoặc neutral
+- Dòng ĐẦU TIÊN của câu trả lời PHẢI là thẻ ||EMOTION:<cảm xúc>|| (ví dụ: ||EMOTION:worried||)
+- Điều chỉnh giọng điệu theo đúng cảm xúc vừa xác định (theo hướng dẫn tương ứng ở trên)
+"""
+
+
 # Default system instruction (for backward compatibility)
 SYSTEM_INSTRUCTION = BASE_SYSTEM_INSTRUCTION
@@ -0,0 +1,32 @@
+import re
+import unicodedata
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_vietnamese(text: str) -> str:
+    """
+    Chuyển chữ tiếng Việt về dạng không dấu, viết thường ("Bực Mình" -> "buc minh")
+
+    Args:
+        text: Chuỗi bất kỳ
+
+    Returns:
+        str
+    """
+    text = str(text or "").lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text: str) -> list:
+    """
+    Tách chuỗi đã fold thành các từ (bỏ dấu câu, emoji)
+
+    Args:
+        text: Chuỗi (nên fold trước bằng fold_vietnamese)
+
+    Returns:
+        list: các từ
+    """
+    return _WORD.findall(text)
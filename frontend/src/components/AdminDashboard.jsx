@@ -1,29 +1,67 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './AdminDashboard.css';
 
+const API_URL = 'http://127.0.0.1:8000';
+const PAGE_SIZE = 50;
+
 export default function AdminDashboard({ onLogout }) {
   const [stats, setStats] = useState({
     total_orders: 0,
     total_revenue: 0,
     today_orders: 0,
-    today_revenue: 0,
-    orders: []
+    today_revenue: 0
   });
+  const [orders, setOrders] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const lastTotalRef = useRef(null);
   const [searchTerm, setSearchTerm] = useState('');
   const [sortBy, setSortBy] = useState('date');
 
   useEffect(() => {
-    loadStats();
-    const interval = setInterval(loadStats, 5000);
-    return () => clearInterval(interval);
+    // Trình duyệt không có SSE thì quay về polling (server trả 304 nếu không đổi)
+    if (typeof EventSource === 'undefined') {
+      loadStats();
+      const interval = setInterval(loadStats, 5000);
+      return () => clearInterval(interval);
+    }
+
+    // Server gửi snapshot khi kết nối, sau đó chỉ gửi delta khi có đơn mới
+    const source = new EventSource(`${API_URL}/api/stats/stream`);
+
+    source.addEventListener('snapshot', (e) => {
+      const data = JSON.parse(e.data);
+      setStats(data);
+      setLoading(false);
+      if (data.total_orders !== lastTotalRef.current) {
+        lastTotalRef.current = data.total_orders;
+        loadOrders();
+      }
+    });
+
+    source.addEventListener('order', (e) => {
+      const event = JSON.parse(e.data);
+      setStats(event.stats);
+      lastTotalRef.current = event.stats.total_orders;
+      setOrders(prev => [event.order, ...prev]);
+    });
+
+    source.onerror = () => setLoading(false);
+
+    return () => source.close();
   }, []);
 
   const loadStats = async () => {
     try {
-      const res = await fetch('http://127.0.0.1:8000/api/stats');
+      const res = await fetch(`${API_URL}/api/stats?include_orders=false`);
       const data = await res.json();
       setStats(data);
+
+      // Chỉ tải lại trang đơn đầu tiên khi có đơn mới
+      if (data.total_orders !== lastTotalRef.current) {
+        lastTotalRef.current = data.total_orders;
+        await loadOrders();
+      }
     } catch (error) {
       console.error('Lỗi tải thống kê:', error);
     } finally {
@@ -31,6 +69,19 @@ export default function AdminDashboard({ onLogout }) {
     }
   };
 
+  const loadOrders = async (cursor = null) => {
+    try {
+      const params = new URLSearchParams({ limit: PAGE_SIZE, newest_first: true });
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`${API_URL}/api/orders?${params}`);
+      const data = await res.json();
+      setOrders(prev => (cursor ? [...prev, ...data.orders] : data.orders));
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error('Lỗi tải đơn hàng:', error);
+    }
+  };
+
   const formatCurrency = (num) => {
     return new Intl.NumberFormat('vi-VN', {
       style: 'currency',
@@ -38,7 +89,7 @@ export default function AdminDashboard({ onLogout }) {
     }).format(num);
   };
 
-  const filteredOrders = stats.orders
+  const filteredOrders = orders
     .filter(order => {
       const searchLower = searchTerm.toLowerCase();
       return (
@@ -171,8 +222,14 @@ export default function AdminDashboard({ onLogout }) {
           )}
         </div>
 
+        {nextCursor && (
+          <button className="load-more-button" onClick={() => loadOrders(nextCursor)}>
+            Tải thêm đơn cũ hơn
+          </button>
+        )}
+
         <div className="orders-count">
-          {filteredOrders.length} / {stats.orders.length} đơn hàng
+          {filteredOrders.length} / {stats.total_orders} đơn hàng
         </div>
       </div>
     </div>
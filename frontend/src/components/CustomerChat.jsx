@@ -1,6 +1,47 @@
 import React, { useState, useRef, useEffect } from 'react';
 import './Chat.css';
 
+// Đọc luồng SSE của /api/chat/stream: gọi onToken cho từng đoạn, trả về payload của event "done"
+async function readChatStream(res, onToken) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of rawEvent.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+
+      const payload = JSON.parse(data);
+      if (event === 'token') onToken(payload.text);
+      else if (event === 'done') result = payload;
+    }
+  }
+  return result;
+}
+
+// Chỉ gửi role/content của các tin nhắn cho backend
+function toBackendMessages(msgs) {
+  return msgs.filter(msg => msg.role && msg.content).map(msg => ({
+    role: msg.role,
+    content: msg.content
+  }));
+}
+
 export default function CustomerChat({ onLogout }) {
   const [messages, setMessages] = useState([
     { role: 'assistant', content: '👋 Chào bạn! Em Mimi rất vui được giúp bạn. Bạn cần dịch vụ gì nào?' }
@@ -11,10 +52,31 @@ export default function CustomerChat({ onLogout }) {
   const [selectedServices, setSelectedServices] = useState([]);
   const [orderSummary, setOrderSummary] = useState(null);
   const [showOrderConfirm, setShowOrderConfirm] = useState(false);
+  // Phiên chat phía server: id phiên và số tin nhắn (đầu danh sách) server đã lưu
+  const sessionRef = useRef({ id: null, synced: 0 });
   const [showInfoForm, setShowInfoForm] = useState(false);
   const [customerInfo, setCustomerInfo] = useState({ name: '', phone: '', petName: '', petType: '', time: '' });
   const messagesEndRef = useRef(null);
 
+  // Gửi kèm phiên chat: chỉ các tin server chưa có thay vì cả lịch sử
+  const sessionBody = (msgs) => ({
+    session_id: sessionRef.current.id,
+    client_messages: toBackendMessages(msgs.slice(sessionRef.current.synced))
+  });
+
+  // POST tới API dùng phiên chat; phiên hết hạn (404) thì mở phiên mới với toàn bộ lịch sử
+  const postWithSession = async (url, makeBody) => {
+    const post = () => fetch(url, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(makeBody()),
+    });
+    const res = await post();
+    if (res.status !== 404 || !sessionRef.current.id) return res;
+    sessionRef.current = { id: null, synced: 0 };
+    return post();
+  };
+
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
@@ -89,31 +151,18 @@ export default function CustomerChat({ onLogout }) {
 
       setLoading(true);
       try {
-        const historyForBackend = [...messages, userMessage].filter(msg => msg.role && msg.content).map(msg => ({
-          role: msg.role,
-          content: msg.content
-        }));
+        const pendingMessages = [...messages, userMessage];
 
         // Extract services from chat history
-        const servicesRes = await fetch('http://127.0.0.1:8000/api/extract-services', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            history: historyForBackend
-          }),
-        });
+        const servicesRes = await postWithSession('http://127.0.0.1:8000/api/extract-services',
+          () => sessionBody(pendingMessages));
 
         const servicesData = await servicesRes.json();
         const extractedServices = servicesData.services || [];
 
         // Extract customer info from chat history
-        const infoRes = await fetch('http://127.0.0.1:8000/api/extract-customer-info', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            history: historyForBackend
-          }),
-        });
+        const infoRes = await postWithSession('http://127.0.0.1:8000/api/extract-customer-info',
+          () => sessionBody(pendingMessages));
 
         const infoData = await infoRes.json();
         const extractedInfo = infoData;
@@ -205,22 +254,21 @@ export default function CustomerChat({ onLogout }) {
     setLoading(true);
 
     try {
-      const historyForBackend = newMsgs.filter(msg => msg.role && msg.content).map(msg => ({
-        role: msg.role,
-        content: msg.content
+      // Tin cuối của newMsgs là tin nhắn đang gửi, server tự ghi cùng câu trả lời
+      const res = await postWithSession('http://127.0.0.1:8000/api/chat/stream', () => ({
+        message: textToSend,
+        ...sessionBody(newMsgs.slice(0, -1)),
+        selected_services: selectedServices
       }));
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
 
-      const res = await fetch('http://127.0.0.1:8000/api/chat', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          message: textToSend,
-          history: historyForBackend,
-          selected_services: selectedServices
-        }),
+      // Hiện câu trả lời dần theo từng đoạn server gửi về
+      let streamedReply = '';
+      const data = await readChatStream(res, (text) => {
+        streamedReply += text;
+        setMessages([...newMsgs, { role: 'assistant', content: streamedReply }]);
       });
-
-      const data = await res.json();
+      if (!data) throw new Error('Luồng chat kết thúc giữa chừng');
       const botMessage = {
         role: 'assistant',
         content: data.reply
@@ -228,6 +276,7 @@ export default function CustomerChat({ onLogout }) {
 
       const updatedMessages = [...newMsgs, botMessage];
       setMessages(updatedMessages);
+      sessionRef.current = { id: data.session_id, synced: updatedMessages.length };
 
       // Update services list
       if (data.services) {
@@ -327,18 +376,12 @@ export default function CustomerChat({ onLogout }) {
     setLoading(true);
 
     try {
-      const historyForBackend = messages.filter(msg => msg.role && msg.content).map(msg => ({
-        role: msg.role,
-        content: msg.content
-      }));
-
       // Send order details to backend for processing
       const res = await fetch('http://127.0.0.1:8000/api/confirm-order', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
-          order: orderSummary,
-          history: historyForBackend
+          order: orderSummary
         }),
       });
 